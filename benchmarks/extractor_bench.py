@@ -0,0 +1,79 @@
+"""Benchmark ProxyExtractor against IPPortPatternLine + Proxy.create_from_url on a generated corpus
+
+python -m benchmarks.extractor_bench --lines 1000000
+"""
+import argparse
+import random
+import time
+from src.parse_module.extractor import ProxyExtractor
+from src.parse_module.utils import IPPortPatternLine
+from src.models.client import Proxy
+
+
+def create_corpus(lines: int, seed: int = 0) -> bytes:
+    rnd = random.Random(seed)
+    templates = (
+        '{ip}:{port}',
+        '{ip}:{port} US elite proxy checked 2020-08-01',
+        'http://{ip}:{port}',
+        '"{ip}","{port}","RU","anonymous"',
+        '{ip}\t{port}\tyes',
+        'some line without proxy at all, just text of dump',
+    )
+    rows = []
+    for _ in range(lines):
+        ip = '.'.join(str(rnd.randint(1, 254)) for _ in range(4))
+        rows.append(rnd.choice(templates).format(ip=ip, port=rnd.randint(80, 65000)))
+    return '\n'.join(rows).encode()
+
+
+def chunks_of(corpus: bytes, chunk_size: int):
+    for start in range(0, len(corpus), chunk_size):
+        yield corpus[start:start + chunk_size]
+
+
+def bench_regexp(corpus: bytes, chunk_size: int) -> int:
+    """current path: regexp per line, format url, parse url"""
+    count = 0
+    text = corpus.decode()
+    for chunk in chunks_of(text, chunk_size):
+        ips = IPPortPatternLine.findall(chunk)
+        proxies = [Proxy.create_from_url(f'http://{prx[0]}:{prx[1]}') for prx in ips]
+        count += len(proxies)
+    return count
+
+
+def bench_extractor(corpus: bytes, chunk_size: int) -> int:
+    extractor = ProxyExtractor()
+    count = 0
+    tuples = []
+    for tpl in extractor.scan_stream(chunks_of(corpus, chunk_size)):
+        tuples.append(tpl)
+        if len(tuples) >= 10000:
+            count += len(extractor.create_proxies(tuples))
+            tuples = []
+    count += len(extractor.create_proxies(tuples))
+    return count
+
+
+def bench_scan_only(corpus: bytes, chunk_size: int) -> int:
+    return sum(1 for _ in ProxyExtractor().scan_stream(chunks_of(corpus, chunk_size)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='ip:port extraction benchmark')
+    parser.add_argument('--lines', type=int, default=1000000)
+    parser.add_argument('--chunk-size', type=int, default=1 << 20)
+    args = parser.parse_args()
+    corpus = create_corpus(args.lines)
+    print(f'corpus: {args.lines} lines, {len(corpus) / 2 ** 20:.1f} MiB')
+    for name, bench in (('regexp + create_from_url', bench_regexp), ('ProxyExtractor', bench_extractor),
+                        ('ProxyExtractor scan only', bench_scan_only)):
+        t1 = time.perf_counter()
+        count = bench(corpus, args.chunk_size)
+        elapsed = time.perf_counter() - t1
+        print(f'{name:28} {count:>9} proxies {elapsed:7.2f} s {args.lines / elapsed:>12,.0f} lines/s')
+
+
+if __name__ == '__main__':
+    main()
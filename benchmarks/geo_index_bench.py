@@ -0,0 +1,51 @@
+"""k nearest of GeoIndex at many proxies clustered around cities
+
+python -m benchmarks.geo_index_bench --proxies 100000 --k 10
+"""
+import argparse
+import random
+import time
+from src.models.geo import GeoIndex, haversine_km
+
+
+def main():
+    parser = argparse.ArgumentParser(description='GeoIndex nearest time')
+    parser.add_argument('--proxies', type=int, default=100000)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--queries', type=int, default=2000)
+    parser.add_argument('--cell', type=float, default=1.0)
+    args = parser.parse_args()
+    rnd = random.Random(0)
+    cities = [(rnd.uniform(-50, 65), rnd.uniform(-180, 180)) for _ in range(300)]
+    index = GeoIndex(cell_degrees=args.cell)
+    points = []
+    for n in range(args.proxies):
+        lat, lon = rnd.choice(cities)
+        lat, lon = max(-90.0, min(90.0, rnd.gauss(lat, 2))), (rnd.gauss(lon, 2) + 180) % 360 - 180
+        points.append((lat, lon))
+        index.update(f'10.{n >> 16 & 255}.{n >> 8 & 255}.{n & 255}', 8080, alive=rnd.random() < 0.8,
+                     latency=rnd.uniform(0.05, 5), lat=lat, lon=lon)
+    queries = [(rnd.uniform(-60, 70), rnd.uniform(-180, 180)) for _ in range(args.queries)]
+    t1 = time.perf_counter()
+    for lat, lon in queries:
+        index.nearest(lat, lon, k=args.k)
+    elapsed = time.perf_counter() - t1
+    near_city = [(max(-90.0, min(90.0, rnd.gauss(lat, 1))), (rnd.gauss(lon, 1) + 180) % 360 - 180)
+                 for lat, lon in (rnd.choice(cities) for _ in range(args.queries))]
+    t2 = time.perf_counter()
+    for lat, lon in near_city:
+        index.nearest(lat, lon, k=args.k)
+    elapsed_city = time.perf_counter() - t2
+    # check against full scan
+    for lat, lon in queries[:20]:
+        expected = sorted(haversine_km(lat, lon, p_lat, p_lon) for key, p_lat, p_lon in (
+            (key, point.lat, point.lon) for key, point in index._points.items() if point.alive))[:args.k]
+        got = [row['distance_km'] for row in index.nearest(lat, lon, k=args.k)]
+        assert [round(value, 3) for value in expected] == got, (expected, got)
+    print(f'{len(index)} alive proxies, cell {args.cell} deg, k={args.k}: '
+          f'random point {1e6 * elapsed / args.queries:.0f} us/query, '
+          f'near city {1e6 * elapsed_city / args.queries:.0f} us/query')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,39 @@
+"""Memory and speed of HealthStore at many proxies
+
+python -m benchmarks.health_store_bench --proxies 1000000 --checks 4
+
+checks/s is measured under tracemalloc, several times slower than without it
+"""
+import argparse
+import random
+import time
+import tracemalloc
+from src.models.health import HealthStore
+
+
+def main():
+    parser = argparse.ArgumentParser(description='HealthStore memory per proxy')
+    parser.add_argument('--proxies', type=int, default=1000000)
+    parser.add_argument('--checks', type=int, default=4)
+    args = parser.parse_args()
+    rnd = random.Random(0)
+    keys = [rnd.getrandbits(32) << 16 | rnd.randint(1, 65535) for _ in range(args.proxies)]
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    store = HealthStore()
+    t1 = time.perf_counter()
+    for _ in range(args.checks):
+        for key in keys:
+            store.add(key, ok=rnd.random() < 0.7, latency=rnd.uniform(0.05, 5))
+    elapsed = time.perf_counter() - t1
+    traced = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    print(f'{args.proxies} proxies x {args.checks} checks: {elapsed:.2f} s, '
+          f'{args.proxies * args.checks / elapsed:,.0f} checks/s')
+    print(f'memory: {traced / args.proxies:.1f} bytes/proxy traced, {store.nbytes() / args.proxies:.1f} bytes/proxy '
+          f'of columns, {len(store)} proxies in {store.nbytes() // 34} slots')
+
+
+if __name__ == '__main__':
+    main()
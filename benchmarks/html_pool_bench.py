@@ -0,0 +1,51 @@
+"""Event loop lag while parsers extract hrefs of large html pages: inline lxml vs HtmlExtractor process pool
+
+python -m benchmarks.html_pool_bench --pages 20 --posts 20000 --workers 2
+"""
+import argparse
+import asyncio
+import time
+from src.models.concurrency import LoopLagMonitor
+from src.parse_module.html_pool import HtmlExtractor
+
+
+def create_page(posts: int) -> str:
+    rows = [f'<div class="post"><h3><a href="http://example.com/post/{i}">post {i}</a></h3>'
+            f'<div id="post-body-{i}"><a href="https://workupload.com/file/{i}">file</a> text of post {i}</div></div>'
+            for i in range(posts)]
+    return '<html><body>' + ''.join(rows) + '</body></html>'
+
+
+async def bench(html_extractor: HtmlExtractor, page: str, pages: int) -> dict:
+    monitor = LoopLagMonitor(interval=0.01)
+    await monitor.start()
+    await asyncio.sleep(0.05)
+    monitor.reset_max()
+    t1 = time.perf_counter()
+    results = await asyncio.gather(*(html_extractor.xpath(page, '//h3//a/@href') for _ in range(pages)))
+    elapsed = time.perf_counter() - t1
+    await asyncio.sleep(0.05)
+    monitor.stop()
+    return {'hrefs': sum(len(hrefs) for hrefs in results), 'elapsed': elapsed,
+            'max_lag': monitor.reset_max(), 'lag': monitor.lag}
+
+
+async def main(args: argparse.Namespace) -> None:
+    page = create_page(args.posts)
+    print(f'page: {args.posts} posts, {len(page) / 2 ** 20:.1f} MiB, {args.pages} pages')
+    for name, workers in (('inline', 0), (f'process pool ({args.workers})', args.workers)):
+        html_extractor = HtmlExtractor(max_workers=workers)
+        if workers:
+            await html_extractor.xpath('<html></html>', '//a')  # start workers before measure
+        result = await bench(html_extractor, page, args.pages)
+        html_extractor.shutdown()
+        print(f'{name:20} {result["hrefs"]:>8} hrefs {result["elapsed"]:6.2f} s '
+              f'max loop lag {result["max_lag"] * 1000:8.1f} ms, ewma {result["lag"] * 1000:7.1f} ms')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='loop lag of html parsing')
+    parser.add_argument('--pages', type=int, default=20)
+    parser.add_argument('--posts', type=int, default=20000)
+    parser.add_argument('--workers', type=int, default=2)
+    asyncio.run(main(parser.parse_args()))
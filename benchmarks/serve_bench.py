@@ -0,0 +1,129 @@
+"""Throughput of read endpoints by count of api workers (entry.py --workers): requests per second and latency
+of clients in own processes, storage sqlite seeded with proxies, checks and parsers are off.
+clients share cpus with workers: scaling by workers is seen only with more cpus than workers + clients
+
+python -m benchmarks.serve_bench --workers 1,2,4 --path '/proxies?limit=20' --duration 10
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import random
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+import aiohttp
+from src.models.sqlite_db import SqliteDb, SqliteProxyDb
+
+Root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+async def seed(path: str, proxies: int) -> None:
+    sqlite_db = await SqliteDb(path).connect()
+    proxy_db = SqliteProxyDb(db_connect=sqlite_db)
+    for n in range(proxies):
+        await proxy_db.insert_proxy(host=f'10.{n >> 16 & 255}.{n >> 8 & 255}.{n & 255}', port=8080, scheme='http',
+                                    in_process=False, is_alive=n % 3 == 0, latency=random.random() * 5,
+                                    health_score=random.random(), country_code=random.choice(('DE', 'US', 'FR')))
+    await sqlite_db.close()
+
+
+def write_config(directory: str) -> str:
+    path = os.path.join(directory, 'bench.yaml')
+    with open(path, 'w') as f:
+        f.write(f'LOGGING_LEVEL: WARNING\n'
+                f'start_check_proxy: false\n'
+                f'storage: {{backend: sqlite, path: {os.path.join(directory, "proxies.sqlite3")}}}\n'
+                f'state_snapshot: {{enabled: false}}\n')
+    return path
+
+
+async def load(url: str, connections: int, duration: float) -> tuple:
+    """requests, errors, latencies of client process"""
+    latencies, errors = [], 0
+    deadline = time.monotonic() + duration
+
+    async def connection(session: aiohttp.ClientSession):
+        nonlocal errors
+        while time.monotonic() < deadline:
+            t1 = time.perf_counter()
+            try:
+                async with session.get(url) as response:
+                    await response.read()
+                    if response.status != 200:
+                        errors += 1
+                        continue
+            except aiohttp.ClientError:
+                errors += 1
+                continue
+            latencies.append(time.perf_counter() - t1)
+
+    # connection per client coroutine: new connections are balanced by kernel between workers
+    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=connections)) as session:
+        await asyncio.gather(*(connection(session) for _ in range(connections)))
+    return len(latencies), errors, latencies
+
+
+def client(args: tuple) -> tuple:
+    return asyncio.run(load(*args))
+
+
+async def wait_ready(url: str, timeout: float = 30) -> None:
+    deadline = time.monotonic() + timeout
+    async with aiohttp.ClientSession() as session:
+        while time.monotonic() < deadline:
+            try:
+                async with session.get(url) as response:
+                    if response.status == 200:
+                        return
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f'{url} is not ready in {timeout} s')
+
+
+def measure(workers: int, config: str, port: int, path: str, clients: int, connections: int,
+            duration: float) -> dict:
+    server = subprocess.Popen([sys.executable, 'entry.py', '-c', config, '--port', str(port),
+                               '--workers', str(workers)], cwd=Root)
+    try:
+        base = f'http://127.0.0.1:{port}'
+        asyncio.run(wait_ready(base + '/'))
+        # all api workers are up: ProxyIndex of each is loaded before port is served
+        time.sleep(1 + workers * 0.5)
+        with multiprocessing.Pool(clients) as pool:
+            results = pool.map(client, [(base + path, connections, duration)] * clients)
+    finally:
+        server.send_signal(signal.SIGINT)
+        server.wait(60)
+    latencies = sorted(latency for _, _, client_latencies in results for latency in client_latencies)
+    requests = sum(requests for requests, _, _ in results)
+    return {'rps': requests / duration, 'errors': sum(errors for _, errors, _ in results),
+            'p50': latencies[len(latencies) // 2] if latencies else None,
+            'p99': latencies[int(len(latencies) * 0.99)] if latencies else None}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='throughput of api by workers')
+    parser.add_argument('--workers', default='1,2,4', help='counts of api workers')
+    parser.add_argument('--path', default='/proxies?limit=20')
+    parser.add_argument('--proxies', type=int, default=20000)
+    parser.add_argument('--clients', type=int, default=4, help='processes of load')
+    parser.add_argument('--connections', type=int, default=32, help='connections of client process')
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--port', type=int, default=5600)
+    args = parser.parse_args()
+    directory = tempfile.mkdtemp()
+    config = write_config(directory)
+    asyncio.run(seed(os.path.join(directory, 'proxies.sqlite3'), args.proxies))
+    print(f'{os.cpu_count()} cpu, GET {args.path}, {args.clients} x {args.connections} connections')
+    for workers in (int(count) for count in args.workers.split(',')):
+        result = measure(workers, config, args.port, args.path, args.clients, args.connections, args.duration)
+        print(f'workers {workers}: {result["rps"]:.0f} req/s, errors {result["errors"]}, '
+              f'p50 {1e3 * result["p50"]:.1f} ms, p99 {1e3 * result["p99"]:.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+"""Warm start of StateSnapshot: dump, write and mmap load of ProxyIndex and HealthStore
+
+python -m benchmarks.snapshot_bench --proxies 100000
+"""
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+from src.models.health import HealthStore, proxy_key
+from src.models.index import ProxyIndex
+from src.models.snapshot import StateSnapshot
+
+
+async def run(proxies: int) -> None:
+    rnd = random.Random(0)
+    index, store = ProxyIndex(), HealthStore()
+    for n in range(proxies):
+        host, port = f'{rnd.randint(1, 223)}.{rnd.randint(0, 255)}.{rnd.randint(0, 255)}.{rnd.randint(1, 254)}', 8080
+        latency = rnd.uniform(0.05, 5)
+        index.apply(host, port, rnd.random() < 0.7, latency, rnd.choice(('DE', 'US', 'FR', None)), rnd.random())
+        store.add(proxy_key(host, port), ok=True, latency=latency)
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'state.snapshot')
+        snapshot = StateSnapshot(path, index=index, health_store=store)
+        t1 = time.perf_counter()
+        data = snapshot.dump()
+        t2 = time.perf_counter()
+        await snapshot.save()
+        t3 = time.perf_counter()
+        loaded = StateSnapshot(path, index=ProxyIndex(), health_store=HealthStore())
+        loaded.load()
+        t4 = time.perf_counter()
+    print(f'{len(index)} proxies, {len(store)} in HealthStore: snapshot {len(data) / 1024 / 1024:.1f} MiB')
+    print(f'dump {1000 * (t2 - t1):.0f} ms, save {1000 * (t3 - t2):.0f} ms, load {1000 * (t4 - t3):.0f} ms')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='StateSnapshot dump and load time')
+    parser.add_argument('--proxies', type=int, default=100000)
+    args = parser.parse_args()
+    asyncio.run(run(args.proxies))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""Latency of operations of pipeline on storage backends without postgres: insert, claim, save of check, list
+
+python -m benchmarks.storage_bench --proxies 20000
+"""
+import argparse
+import asyncio
+import datetime
+import os
+import tempfile
+import time
+from src.models.memory_db import MemoryProxyDb, MemoryLocationDb
+from src.models.sqlite_db import SqliteDb, SqliteProxyDb, aiosqlite
+
+
+async def measure(proxy_db, proxies: int) -> dict:
+    hosts = [f'10.{n >> 16 & 255}.{n >> 8 & 255}.{n & 255}' for n in range(proxies)]
+    result = {}
+    t1 = time.perf_counter()
+    for host in hosts:
+        await proxy_db.insert_proxy(host=host, port=8080, scheme='http', in_process=False)
+    result['insert'] = time.perf_counter() - t1
+    t1 = time.perf_counter()
+    for host in hosts:
+        await proxy_db.claim_proxy(host=host, port=8080)
+    result['claim'] = time.perf_counter() - t1
+    now = datetime.datetime.utcnow()
+    t1 = time.perf_counter()
+    for n, host in enumerate(hosts):
+        await proxy_db.update_proxy_pm(host=host, port=8080, is_alive=n % 3 == 0, latency=n % 1000 / 100,
+                                       date_update=now, in_process=False, claimed_by=None, claimed_until=None)
+    result['update'] = time.perf_counter() - t1
+    lists = 100
+    t1 = time.perf_counter()
+    for _ in range(lists):
+        await proxy_db.select_proxies(sort='latency', limit=100)
+    result['select_proxies'] = (time.perf_counter() - t1) / lists * proxies
+    return result
+
+
+async def run(proxies: int) -> None:
+    backends = [('memory', MemoryProxyDb(location_db=MemoryLocationDb()), None)]
+    if aiosqlite is not None:
+        path = os.path.join(tempfile.mkdtemp(), 'proxies.sqlite3')
+        sqlite_db = await SqliteDb(path).connect()
+        backends.append(('sqlite', SqliteProxyDb(db_connect=sqlite_db), sqlite_db))
+    else:
+        print('aiosqlite is not installed, sqlite is skipped')
+    for name, proxy_db, connection in backends:
+        result = await measure(proxy_db, proxies)
+        print(f'{name}: ' + ', '.join(f'{operation} {1e6 * seconds / proxies:.1f} us/op'
+                                      for operation, seconds in result.items()))
+        if connection is not None:
+            await connection.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='storage backends latency')
+    parser.add_argument('--proxies', type=int, default=20000)
+    args = parser.parse_args()
+    asyncio.run(run(args.proxies))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,33 +1,98 @@
 import argparse
 import asyncio
-import aiohttp
 import logging
+import sys
+from src.log import setup_logging
 from src.settings import load_config
-from src import create_app
 
+logger = logging.getLogger('entry')
 
-try:
-    import uvloop
-    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
-except ImportError:
-    print("uvloop is not install")
 
 parser = argparse.ArgumentParser(description='app api_es')
 parser.add_argument('--host', help='Host to listen', default='0.0.0.0')
 parser.add_argument('--port', help='Port to accept connections', default='5000')
 parser.add_argument('--reload', action='store_true', help='Auto reload code on change')
 parser.add_argument('-c', '--config', type=argparse.FileType('r'), 	help='Path to configuration file')
+parser.add_argument('-w', '--workers', type=int, help='Api processes on port and one pipeline process, '
+                                                       '0 - single process; config workers.count if not set')
+commands = parser.add_subparsers(dest='command')
+check_parser = commands.add_parser('check', help='Check proxies of file or stdin, no db and web server')
+check_parser.add_argument('input', nargs='?', default='-', help='File with proxies, - for stdin')
+check_parser.add_argument('-o', '--output', default='-', help='File of results, - for stdout')
+check_parser.add_argument('-f', '--format', choices=('ndjson', 'csv'), default='ndjson', help='Format of results')
+check_parser.add_argument('-n', '--concurrency', type=int, default=200, help='Checks in flight')
+check_parser.add_argument('--timeout', type=float, default=15, help='Seconds of check of proxy')
+check_parser.add_argument('--judge', action='append', help='Url of judge, may be repeated')
+check_parser.add_argument('--scheme', default='http', help='Scheme of proxy without scheme in input')
+check_parser.add_argument('--all', action='store_true', help='Write dead proxies too')
+check_parser.add_argument('-q', '--quiet', action='store_true', help='No progress on stderr')
 
-args = parser.parse_args()
-config = load_config(args.config)
-app = create_app(config=config)
 
-if args.reload:
-    print('Start with code reload')
-    import aioreloader
-    aioreloader.start()
+def check(args) -> None:
+    """batch check without db: sqlalchemy and asyncpg are not imported"""
+    from src.batch import BatchChecker
+    setup_logging(logging.WARNING, rate_limit={})
+    source = sys.stdin.buffer if args.input == '-' else open(args.input, 'rb')
+    output = sys.stdout if args.output == '-' else open(args.output, 'w', newline='')
+    checker = BatchChecker(output=output, output_format=args.format, concurrency=args.concurrency,
+                           timeout=args.timeout, judge_urls=args.judge, default_scheme=args.scheme,
+                           include_dead=args.all, progress=None if args.quiet else sys.stderr)
+    try:
+        asyncio.run(checker.run(source))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for file in (source, output):
+            if file not in (sys.stdin.buffer, sys.stdout):
+                file.close()
+
+
+def serve(args) -> None:
+    import aiohttp.web
+    from src import create_app
+
+    config = load_config(args.config)
+    workers_config = dict(config.get('workers', {}))
+    workers = args.workers if args.workers is not None else workers_config.pop('count', 0)
+    workers_config.pop('count', None)
+    if workers > 0:
+        if args.reload:
+            parser.error('--reload is not supported with workers')
+        serve_workers(args, config, workers, workers_config)
+        return
+    setup_logging(config.get('LOGGING_LEVEL', 'INFO'), rate_limit=config.get('logging_rate_limit'))
+    try:
+        import uvloop
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    except ImportError:
+        logger.info('uvloop is not install')
+
+    app = create_app(config=config)
+
+    if args.reload:
+        logger.info('Start with code reload')
+        import aioreloader
+        aioreloader.start()
+
+    aiohttp.web.run_app(app, host=args.host, port=args.port, print=logger.info)
+
+
+def serve_workers(args, config: dict, workers: int, workers_config: dict) -> None:
+    """supervisor of pipeline and api processes, see src.workers"""
+    from src.workers import WorkerSupervisor, WorkerLogFormat
+    setup_logging(config.get('LOGGING_LEVEL', 'INFO'), fmt=WorkerLogFormat)
+    supervisor = WorkerSupervisor(config, host=args.host, port=int(args.port), workers=workers, **workers_config)
+    logger.info('Start %s workers on %s:%s', workers, args.host, args.port)
+    try:
+        supervisor.run()
+    except (OSError, RuntimeError, ValueError) as e:
+        logger.error('workers are not started :: %s', e)
+        sys.exit(1)
 
 
 if __name__ == '__main__':
-    logging.basicConfig(level=getattr(logging, config.get('LOGGING_LEVEL', 'DEBUG')))
-    aiohttp.web.run_app(app, host=args.host, port=args.port)
\ No newline at end of file
+    args = parser.parse_args()
+    if args.command == 'check':
+        check(args)
+    else:
+        serve(args)
@@ -0,0 +1,16 @@
+-- Indexes for the claim queries of ProxyDb.select_and_set_proxy_to_process
+-- and for filtering/export by liveness and latency.
+
+-- new proxies: date_update IS NULL AND in_process = false
+CREATE INDEX IF NOT EXISTS ix_proxy_claim_new
+    ON proxy (date_creation)
+    WHERE date_update IS NULL AND in_process = false;
+
+-- recheck: date_update < X AND in_process = false ORDER BY date_update
+CREATE INDEX IF NOT EXISTS ix_proxy_claim_due
+    ON proxy (date_update)
+    WHERE in_process = false;
+
+-- filter/export: is_alive = true ORDER BY latency
+CREATE INDEX IF NOT EXISTS ix_proxy_alive_latency
+    ON proxy (is_alive, latency);
@@ -0,0 +1,8 @@
+-- Time-limited claims: a claimed proxy (in_process = true) belongs to claimed_by until claimed_until.
+-- Expired leases are released by ProxyDb.release_expired_leases.
+ALTER TABLE proxy ADD COLUMN IF NOT EXISTS claimed_until timestamp without time zone;
+ALTER TABLE proxy ADD COLUMN IF NOT EXISTS claimed_by VARCHAR;
+
+CREATE INDEX IF NOT EXISTS ix_proxy_lease_expire
+    ON proxy (claimed_until)
+    WHERE in_process = true;
@@ -0,0 +1,4 @@
+-- Result of one probe per check: anonymity level by header echo of judge, https - CONNECT to TLS endpoint works.
+-- anonymous (bool) is kept and filled as anonymity <> 'transparent'.
+ALTER TABLE proxy ADD COLUMN IF NOT EXISTS anonymity VARCHAR(16);
+ALTER TABLE proxy ADD COLUMN IF NOT EXISTS https BOOLEAN;
@@ -0,0 +1,8 @@
+-- Throughput probe of alive proxies: ttfb (seconds to first byte of payload), throughput (bytes per second).
+-- ix_proxy_alive_throughput - GET /proxies?sort=-throughput and min_throughput filter of ProxyDb.query_select_proxies
+ALTER TABLE proxy ADD COLUMN IF NOT EXISTS ttfb REAL;
+ALTER TABLE proxy ADD COLUMN IF NOT EXISTS throughput REAL;
+
+CREATE INDEX IF NOT EXISTS ix_proxy_alive_throughput
+    ON proxy (throughput DESC NULLS LAST)
+    WHERE is_alive = true;
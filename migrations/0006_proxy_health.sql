@@ -0,0 +1,12 @@
+-- Rolling history of last checks (HealthStore): health_bits - success bit per position of ring,
+-- health_latency - ring of quantized latencies (one byte per check), health_checks - total checks (head of ring).
+-- health_score, uptime, latency_p90 are derived from the ring on every check; ranking uses health_score.
+ALTER TABLE proxy ADD COLUMN IF NOT EXISTS health_bits INTEGER;
+ALTER TABLE proxy ADD COLUMN IF NOT EXISTS health_latency BYTEA;
+ALTER TABLE proxy ADD COLUMN IF NOT EXISTS health_checks INTEGER;
+ALTER TABLE proxy ADD COLUMN IF NOT EXISTS health_score REAL;
+ALTER TABLE proxy ADD COLUMN IF NOT EXISTS uptime REAL;
+ALTER TABLE proxy ADD COLUMN IF NOT EXISTS latency_p90 REAL;
+
+CREATE INDEX IF NOT EXISTS ix_proxy_health_score
+    ON proxy (health_score DESC NULLS LAST);
@@ -0,0 +1,42 @@
+-- Append-only history of checks, partitioned by day (partitions proxy_check_YYYYMMDD are created by CheckHistory),
+-- retention drops whole partitions. Analytics read proxy_check and rollups, never the hot proxy table.
+ALTER TABLE proxy ADD COLUMN IF NOT EXISTS source VARCHAR;
+
+CREATE TABLE IF NOT EXISTS proxy_check (
+    checked_at timestamp without time zone NOT NULL,
+    host inet NOT NULL,
+    port integer NOT NULL,
+    is_alive boolean,
+    latency real,
+    throughput real,
+    anonymity VARCHAR(16),
+    country_code VARCHAR,
+    source VARCHAR
+) PARTITION BY RANGE (checked_at);
+
+CREATE INDEX IF NOT EXISTS ix_proxy_check_host_port ON proxy_check (host, port, checked_at);
+
+-- dimension: proxy (key host:port), country (key country_code), source (key parser name)
+CREATE TABLE IF NOT EXISTS proxy_check_hourly (
+    bucket timestamp without time zone NOT NULL,
+    dimension VARCHAR(16) NOT NULL,
+    key VARCHAR NOT NULL,
+    checks integer NOT NULL,
+    alive integer NOT NULL,
+    latency_sum double precision NOT NULL,
+    latency_count integer NOT NULL,
+    latency_max real,
+    PRIMARY KEY (bucket, dimension, key)
+);
+
+CREATE TABLE IF NOT EXISTS proxy_check_daily (
+    bucket timestamp without time zone NOT NULL,
+    dimension VARCHAR(16) NOT NULL,
+    key VARCHAR NOT NULL,
+    checks integer NOT NULL,
+    alive integer NOT NULL,
+    latency_sum double precision NOT NULL,
+    latency_count integer NOT NULL,
+    latency_max real,
+    PRIMARY KEY (bucket, dimension, key)
+);
@@ -0,0 +1,12 @@
+-- Location of proxy on its row: location_ip - location the country was taken from (location.ip),
+-- country_code - copy of location.country_code, filters by country without join on INET.
+ALTER TABLE proxy ADD COLUMN IF NOT EXISTS location_ip INET REFERENCES location (ip) ON DELETE SET NULL;
+ALTER TABLE proxy ADD COLUMN IF NOT EXISTS country_code VARCHAR(8);
+
+UPDATE proxy SET location_ip = location.ip, country_code = location.country_code
+FROM location
+WHERE location.ip = proxy.host AND proxy.location_ip IS NULL;
+
+-- filter/export: country_code = X AND is_alive = true AND latency < Y, index-only with host, port
+CREATE INDEX IF NOT EXISTS ix_proxy_country_alive_latency
+    ON proxy (country_code, is_alive, latency) INCLUDE (host, port);
@@ -1,4 +1,40 @@
-from .app import create_app, create_tcp_connector
-from .models import (ProxyChecker, Proxy, ProxyClient, TaskProxyCheckHandler, CheckProxyPolicy, ProxyDb,
-                     proxy_table, location_table, ProxyDb, TaskHandlerToDB, Location, ApiLocation, LocationDb,
-                     StartProxyHandler, LocationTaskHandler, ReferenceProxy, ReferenceLocation)
+"""Names of app and models are imported on first use, see src.models"""
+import importlib
+from typing import TYPE_CHECKING
+
+_app_exports = ('create_app', 'create_tcp_connector')
+_model_exports = ('ProxyChecker', 'Proxy', 'ProxyClient', 'TaskProxyCheckHandler', 'CheckProxyPolicy', 'ProxyDb',
+                  'proxy_table', 'location_table', 'TaskHandlerToDB', 'Location', 'ApiLocation', 'LocationDb',
+                  'StartProxyHandler', 'LocationTaskHandler', 'ReferenceProxy', 'ReferenceLocation', 'MigrationRunner',
+                  'LeaseKeeper', 'RecheckScheduler', 'PriorityLaneQueue', 'AdaptiveConcurrency', 'JudgePool',
+                  'HealthStore', 'CheckHistory', 'ProxyGateway', 'GatewayProxyPool', 'ProxyIndex', 'ChangePublisher',
+                  'ChangeListener', 'StateSnapshot', 'GeoIndex', 'ProxyStorage', 'LocationStorage', 'MemoryProxyDb',
+                  'MemoryLocationDb', 'SqliteDb', 'SqliteProxyDb', 'SqliteLocationDb', 'IndexPoll')
+
+__all__ = _app_exports + _model_exports
+
+
+def __getattr__(name: str):
+    if name in _app_exports:
+        module = '.app'
+    elif name in _model_exports:
+        module = '.models'
+    else:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+    value = globals()[name] = getattr(importlib.import_module(module, __name__), name)
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
+
+
+if TYPE_CHECKING:
+    from .app import create_app, create_tcp_connector
+    from .models import (ProxyChecker, Proxy, ProxyClient, TaskProxyCheckHandler, CheckProxyPolicy, ProxyDb,
+                         proxy_table, location_table, TaskHandlerToDB, Location, ApiLocation, LocationDb,
+                         StartProxyHandler, LocationTaskHandler, ReferenceProxy, ReferenceLocation, MigrationRunner,
+                         LeaseKeeper, RecheckScheduler, PriorityLaneQueue, AdaptiveConcurrency, JudgePool,
+                         HealthStore, CheckHistory, ProxyGateway, GatewayProxyPool, ProxyIndex, ChangePublisher,
+                         ChangeListener, StateSnapshot, GeoIndex, ProxyStorage, LocationStorage, MemoryProxyDb,
+                         MemoryLocationDb, SqliteDb, SqliteProxyDb, SqliteLocationDb, IndexPoll)
@@ -2,17 +2,31 @@ import asyncpgsa
 import aiohttp
 import asyncio
 import logging
+from typing import Optional, Tuple
 from aiohttp import web, ClientSession, TCPConnector
 import src
-from .parse_module.free_proxy import Sslproxies24_top
+from .parse_module import ParseScheduler
 from .routes import setup_routes
+from .workers import ProxyForward, ProxyInbox
 
 logger = logging.getLogger(__name__)
 
+# processes of app, see create_app
+Roles = ('all', 'pipeline', 'api')
 
-async def create_app(config: dict) -> aiohttp.web.Application:
+
+async def create_app(config: dict, role: str = 'all', worker_queue=None) -> aiohttp.web.Application:
+    """
+    :param role: str, all - single process, pipeline / api - processes of src.workers.WorkerSupervisor
+    :param worker_queue: multiprocessing.Queue of supervisor, POST /proxy of api workers to pipeline
+    """
+    if role not in Roles:
+        raise ValueError(f'unknown role {role!r}, must be one of {Roles}')
     app = web.Application()
     app['config'] = config
+    app['role'] = role
+    if worker_queue is not None:
+        app['worker_queue'] = worker_queue
 
     setup_routes(app)
     app.on_startup.append(on_start)
@@ -25,43 +39,72 @@ async def on_start(app):
     config = app['config']
     tcp_config = {}
     app['http_client'] = ClientSession(connector=create_tcp_connector(tcp_config))
-    db_connect_kwargs = {}
-    app['asyncpgsa_db_pool'] = await asyncpgsa.create_pool(dsn=config['POSTGRESQL_URI'], **db_connect_kwargs)
+    if storage_backend(config) == 'postgres':
+        db_connect_kwargs = {}
+        app['asyncpgsa_db_pool'] = await asyncpgsa.create_pool(dsn=config['POSTGRESQL_URI'], **db_connect_kwargs)
+        # by pipeline process of workers, api workers do not write
+        if config.get('run_migrations', True) is True and app['role'] != 'api':
+            applied = await src.MigrationRunner(db_connect=app['asyncpgsa_db_pool']).migrate()
+            logger.info(f'applied migrations: {applied}')
     app['in_checker_queue'] = asyncio.Queue(config.get('limit_checker_queues', 0))
     app['out_checker_queue'] = asyncio.Queue(config.get('limit_checker_queues', 0))
-    await start_check_proxy(app=app, config=config)
+    if app['role'] == 'api':
+        await start_api_worker(app=app, config=config)
+    else:
+        await start_check_proxy(app=app, config=config)
 
 
 async def on_shutdown(app):
 
     logger.info('on_shutdown')
-    await shutdown_proxy_in_process(app)
-    await app['asyncpgsa_db_pool'].close()
-    logger.info('PSQL closed')
+    if 'parse_scheduler' in app:
+        app['parse_scheduler'].stop()
+    if 'proxy_inbox' in app:
+        app['proxy_inbox'].stop()
+    if 'index_poll' in app:
+        app['index_poll'].stop()
+    if 'judge_pool' in app:
+        app['judge_pool'].stop()
+    if 'gateway' in app:
+        await app['gateway'].stop()
+    if 'geo_index' in app:
+        app['geo_index'].stop()
+    if 'state_snapshot' in app:
+        app['state_snapshot'].stop()
+        try:
+            await app['state_snapshot'].save()
+        except OSError as e:
+            logger.error(f'snapshot on shutdown :: {e}, {e.args}')
+    if 'change_listener' in app:
+        await app['change_listener'].stop()
+    if 'change_publisher' in app:
+        app['change_publisher'].stop()
+        await app['change_publisher'].flush()
+    if 'check_history' in app:
+        app['check_history'].stop()
+        await app['check_history'].flush()
+    if 'start_proxy_handler' in app:
+        await shutdown_proxy_in_process(app)
+    if 'asyncpgsa_db_pool' in app:
+        await app['asyncpgsa_db_pool'].close()
+        logger.info('PSQL closed')
+    if 'sqlite_db' in app:
+        await app['sqlite_db'].close()
+        logger.info('sqlite closed')
     await app['http_client'].close()
     logger.info('http_client closed')
 
 
-async def shutdown_proxy_in_process(app):  # TODO need full update in process
+async def shutdown_proxy_in_process(app):
+    """release leases of this instance, leases of crashed instances expire by itself"""
     start_proxy_handler: src.StartProxyHandler = app['start_proxy_handler']
     start_proxy_handler.pause()
-    # create hard refs
-    refs = set(src.ReferenceProxy.get())
-    proxy_db: src.ProxyDb = app['ProxyDb']
-    tasks = []
-    for proxy in refs:
-        try:
-            logger.debug(f"replace in process false {proxy}  of {len(src.ReferenceProxy.get())}")
-            context = {
-                "host": proxy.host,
-                "port": proxy.port,
-                "in_process": False
-            }
-            task = asyncio.ensure_future( proxy_db.update_proxy_pm(**context))
-            tasks.append(task)
-        except Exception as e:
-            logger.info(f"Shutdown Proxy, :: {e}, {e.args}")
-    res = await asyncio.gather(*tasks, return_exceptions=True)
+    proxy_db: src.ProxyStorage = app['ProxyDb']
+    try:
+        res = await proxy_db.release_owner_leases()
+        logger.info(f'release leases of {proxy_db.owner} :: {res}')
+    except Exception as e:
+        logger.info(f"Shutdown Proxy, :: {e}, {e.args}")
     start_proxy_handler.stop()
     logger.info(f'STOP {start_proxy_handler.__class__.__name__}')
 
@@ -81,44 +124,266 @@ def create_tcp_connector(config: dict) -> TCPConnector:
     return connector
 
 
+def create_lane_queue(config: dict, name: str) -> 'src.PriorityLaneQueue':
+    """
+    :param config: dict, lane_weights: {lane: weight}, lane_maxsize: {queue name: {lane: maxsize}}
+    :param name: str, name of queue in app
+
+    :return: PriorityLaneQueue
+    """
+    maxsize = config.get('lane_maxsize', {}).get(name, 0)
+    return src.PriorityLaneQueue(lanes=config.get('lane_weights'), maxsize=maxsize)
+
+
+async def create_judge_pool(app: aiohttp.web.Application, config: dict) -> 'Optional[src.JudgePool]':
+    """
+    :param config: dict, judge_urls: [url of GET /judge of this app, reachable by proxies], judge_check_interval,
+        judge_https_url: TLS endpoint of CONNECT probe
+
+    :return: JudgePool started, None if judge_urls is not set
+    """
+    if not config.get('judge_urls'):
+        return None
+    judge_pool = app['judge_pool'] = src.JudgePool(urls=config['judge_urls'], http_session=app['http_client'],
+                                                   check_interval=config.get('judge_check_interval', 60),
+                                                   https_url=config.get('judge_https_url'))
+    await judge_pool.start()
+    return judge_pool
+
+
+async def create_check_history(app: aiohttp.web.Application, config: dict) -> 'Optional[src.CheckHistory]':
+    """
+    :param config: dict, check_history: {enabled, batch_size, flush_interval, maintenance_interval, retention_days, ...}
+
+    :return: CheckHistory started, None if not enabled
+    """
+    history_config = dict(config.get('check_history', {}))
+    if history_config.pop('enabled', True) is not True:
+        return None
+    if 'asyncpgsa_db_pool' not in app:
+        logger.warning(f'check_history needs postgres, storage is {storage_backend(config)}')
+        return None
+    check_history = app['check_history'] = src.CheckHistory(db_connect=app['asyncpgsa_db_pool'], **history_config)
+    await check_history.start()
+    return check_history
+
+
+async def create_change_sync(app: aiohttp.web.Application, config: dict) -> 'Optional[src.ChangePublisher]':
+    """ProxyIndex of app kept coherent with instances by LISTEN/NOTIFY
+    :param config: dict, change_events: {enabled, batch_size, flush_interval, check_interval}
+
+    :return: ChangePublisher started, None if not enabled
+    """
+    change_config = dict(config.get('change_events', {}))
+    if change_config.pop('enabled', True) is not True:
+        return None
+    if 'asyncpgsa_db_pool' not in app:
+        logger.warning(f'change_events need postgres, storage is {storage_backend(config)}')
+        return None
+    proxy_db: src.ProxyDb = app['ProxyDb']
+    index = app['proxy_index'] = src.ProxyIndex()
+    snapshot = create_state_snapshot(app, config)
+    listener = app['change_listener'] = src.ChangeListener(dsn=config['POSTGRESQL_URI'], index=index,
+                                                           proxy_db=proxy_db,
+                                                           check_interval=change_config.pop('check_interval', 5))
+    # listen before catch up of snapshot, full resync without snapshot
+    await listener.start(resync=snapshot is None or snapshot.load() is None)
+    publisher = app['change_publisher'] = src.ChangePublisher(db_connect=app['asyncpgsa_db_pool'],
+                                                              owner=proxy_db.owner, **change_config)
+    await publisher.start()
+    return publisher
+
+
+def create_state_snapshot(app: aiohttp.web.Application, config: dict) -> 'Optional[src.StateSnapshot]':
+    """snapshot of app['proxy_index'] (if change events are enabled) and app['health_store'], not loaded
+    :param config: dict, state_snapshot: {enabled, path, interval, catch_up_margin}
+
+    :return: StateSnapshot, None if not enabled
+    """
+    if 'state_snapshot' in app:
+        return app['state_snapshot']
+    snapshot_config = dict(config.get('state_snapshot', {}))
+    if snapshot_config.pop('enabled', True) is not True:
+        return None
+    snapshot = app['state_snapshot'] = src.StateSnapshot(index=app.get('proxy_index'),
+                                                         health_store=app.get('health_store'), **snapshot_config)
+    return snapshot
+
+
+async def create_geo_index(app: aiohttp.web.Application, config: dict) -> 'Optional[src.GeoIndex]':
+    """
+    :param config: dict, geo_index: {enabled, cell_degrees, refresh_interval}
+
+    :return: GeoIndex loaded and started, None if not enabled
+    """
+    geo_config = dict(config.get('geo_index', {}))
+    if geo_config.pop('enabled', True) is not True:
+        return None
+    geo_index = app['geo_index'] = src.GeoIndex(proxy_db=app['ProxyDb'], **geo_config)
+    await geo_index.start()
+    return geo_index
+
+
+async def create_gateway(app: aiohttp.web.Application, config: dict) -> 'Optional[src.ProxyGateway]':
+    """
+    :param config: dict, gateway: {enabled, host, port, socks5, max_attempts, connect_timeout,
+        keepalive_timeout, max_idle, pool: {size, refresh_interval, cooldown}}
+
+    :return: ProxyGateway started, None if not enabled
+    """
+    gateway_config = dict(config.get('gateway', {}))
+    if gateway_config.pop('enabled', False) is not True:
+        return None
+    pool = src.GatewayProxyPool(proxy_db=app['ProxyDb'], health_store=app['health_store'],
+                                **gateway_config.pop('pool', {}))
+    gateway = app['gateway'] = src.ProxyGateway(pool=pool, **gateway_config)
+    await gateway.start()
+    return gateway
+
+
+def create_concurrency(config: dict) -> 'src.AdaptiveConcurrency':
+    """
+    :param config: dict, checker_concurrency: {initial, min_limit, max_limit, fd_ceiling, interval, ...}
+
+    :return: AdaptiveConcurrency
+    """
+    return src.AdaptiveConcurrency(**config.get('checker_concurrency', {}))
+
+
+def storage_backend(config: dict) -> str:
+    return config.get('storage', {}).get('backend', 'postgres')
+
+
+async def create_storage(app: aiohttp.web.Application,
+                         config: dict) -> 'Tuple[src.ProxyStorage, src.LocationStorage]':
+    """
+    :param config: dict, storage: {backend: postgres | sqlite | memory, path: file of sqlite}, lease_seconds
+
+    :return: storage of proxies (app['ProxyDb']) and storage of locations
+    """
+    storage_config = config.get('storage', {})
+    backend = storage_backend(config)
+    lease_seconds = config.get('lease_seconds', 300)
+    if backend == 'postgres':
+        db = app['asyncpgsa_db_pool']
+        proxy_db = src.ProxyDb(db_connect=db, table_proxy=src.proxy_table, lease_seconds=lease_seconds)
+        location_db = src.LocationDb(db_connect=db, table_location=src.location_table)
+    elif backend == 'sqlite':
+        sqlite_db = app['sqlite_db'] = await src.SqliteDb(path=storage_config.get('path', 'proxies.sqlite3')).connect()
+        proxy_db = src.SqliteProxyDb(db_connect=sqlite_db, lease_seconds=lease_seconds)
+        location_db = src.SqliteLocationDb(db_connect=sqlite_db)
+    elif backend == 'memory':
+        location_db = src.MemoryLocationDb()
+        proxy_db = src.MemoryProxyDb(location_db=location_db, lease_seconds=lease_seconds)
+    else:
+        raise ValueError(f'unknown storage backend {backend!r}, must be postgres, sqlite or memory')
+    app['ProxyDb'] = proxy_db
+    return proxy_db, location_db
+
+
+async def create_index_sync(app: aiohttp.web.Application, config: dict) -> 'Optional[src.ProxyIndex]':
+    """ProxyIndex of api worker: LISTEN of change events (postgres), else poll of storage (sqlite)
+    :param config: dict, change_events: {enabled, check_interval}
+
+    :return: ProxyIndex loaded, None if not enabled
+    """
+    change_config = config.get('change_events', {})
+    if change_config.get('enabled', True) is not True:
+        return None
+    proxy_db = app['ProxyDb']
+    index = app['proxy_index'] = src.ProxyIndex()
+    check_interval = change_config.get('check_interval', 5)
+    if 'asyncpgsa_db_pool' in app:
+        listener = app['change_listener'] = src.ChangeListener(dsn=config['POSTGRESQL_URI'], index=index,
+                                                               proxy_db=proxy_db, check_interval=check_interval)
+        await listener.start()
+    else:
+        index_poll = app['index_poll'] = src.IndexPoll(index=index, proxy_db=proxy_db, interval=check_interval)
+        await index_poll.start()
+    return index
+
+
+async def start_api_worker(app: aiohttp.web.Application, config: dict):
+    """api process of workers: read endpoints from own ProxyIndex and GeoIndex synced with storage,
+    POST /proxy to pipeline process, no checks, parsers and snapshot
+    """
+    await create_storage(app, config)
+    await create_index_sync(app, config)
+    await create_geo_index(app, config)
+    app['queue_api_to_db'] = ProxyForward(app['worker_queue'])
+    logger.info('Start api worker')
+
+
 async def start_check_proxy(app: aiohttp.web.Application, config: dict):
     if config.get('start_check_proxy', True) is True:
         await create_task_handlers_api_to_db(app=app, config=config)
-        print('Start proxy_check_handler')
+        logger.info('Start proxy_check_handler')
         return
 
 
 async def create_task_handlers_api_to_db(app: aiohttp.web.Application, config: dict):
-    db = app['asyncpgsa_db_pool']
-    proxy_db = app['ProxyDb'] = src.ProxyDb(db_connect=db, table_proxy=src.proxy_table)
-    queue_api_to_db = app['queue_api_to_db'] = asyncio.Queue()
+    proxy_db, location_db = await create_storage(app, config)
+    scheduler = None
+    if config.get('recheck_scheduler', True) is True:
+        scheduler = app['recheck_scheduler'] = src.RecheckScheduler(
+            delta_minutes_for_check=proxy_db.delta_minutes_for_check)
+        await scheduler.load(proxy_db)
+    health_store = app['health_store'] = src.HealthStore(**config.get('health', {}))
+    check_history = await create_check_history(app, config)
+    change_publisher = await create_change_sync(app, config)
+    state_snapshot = create_state_snapshot(app, config)
+    if state_snapshot is not None:
+        if 'proxy_index' not in app:
+            # loaded by create_change_sync otherwise
+            state_snapshot.load()
+        await state_snapshot.catch_up(proxy_db)
+        await state_snapshot.start()
+    queue_api_to_db = app['queue_api_to_db'] = create_lane_queue(config, 'queue_api_to_db')
+    if 'worker_queue' in app:
+        proxy_inbox = app['proxy_inbox'] = ProxyInbox(app['worker_queue'], outgoing_queue=queue_api_to_db)
+        await proxy_inbox.start()
     task_handler_api_to_db = app['task_handler_api_to_db'] = src.TaskHandlerToDB(incoming_queue=queue_api_to_db,
-                                                                                 proxy_db=proxy_db)
+                                                                                 proxy_db=proxy_db, scheduler=scheduler,
+                                                                                 health_store=health_store,
+                                                                                 history=check_history,
+                                                                                 publisher=change_publisher)
     await task_handler_api_to_db.start()
 
-    start_proxy_queue = app['start_proxy_queue'] = asyncio.Queue(1)
+    start_proxy_queue = app['start_proxy_queue'] = create_lane_queue(config, 'start_proxy_queue')
     start_proxy_handler = app['start_proxy_handler'] = src.StartProxyHandler(proxy_db=proxy_db,
-                                                                             outgoing_queue=start_proxy_queue)
+                                                                             outgoing_queue=start_proxy_queue,
+                                                                             scheduler=scheduler)
     await start_proxy_handler.start()
 
-    checker_out_queue = app['checker_out_queue'] = asyncio.Queue()
+    checker_out_queue = app['checker_out_queue'] = create_lane_queue(config, 'checker_out_queue')
     checker_handler = app['checker_handler'] = src.TaskProxyCheckHandler(incoming_queue=start_proxy_queue,
                                                                          outgoing_queue=checker_out_queue,
-                                                                         max_tasks=100)
+                                                                         lease_keeper=src.LeaseKeeper(proxy_db),
+                                                                         concurrency=create_concurrency(config),
+                                                                         judge_pool=await create_judge_pool(app, config),
+                                                                         scheduler=scheduler,
+                                                                         **config.get('throughput_check', {}))
     await checker_handler.start()
 
     api_location = src.ApiLocation(app['http_client'])
-    location_db = src.LocationDb(db_connect=db, table_location=src.location_table)
     location_handler = app['location_handler'] = src.LocationTaskHandler(api_location=api_location,
                                                                          location_db=location_db,
                                                                          incoming_queue=checker_out_queue,
-                                                                         outgoing_queue=queue_api_to_db, max_tasks=20)
+                                                                         outgoing_queue=queue_api_to_db,
+                                                                         max_tasks=config.get('location_max_tasks', 20),
+                                                                         geo_index=await create_geo_index(app, config))
     await location_handler.start()
+    await create_gateway(app, config)
 
     #  start parse
 
-    ssl_proxies = Sslproxies24_top(client_session=app['http_client'], out_queue=queue_api_to_db)
-    await ssl_proxies.parse()
+    parse_scheduler = app['parse_scheduler'] = ParseScheduler(client_session=app['http_client'],
+                                                              out_queue=queue_api_to_db,
+                                                              sources=config.get('parse_sources'),
+                                                              sources_config=config.get('parse_sources_config'),
+                                                              limit_per_domain=config.get('parse_limit_per_domain', 4),
+                                                              html_workers=config.get('parse_html_workers', 2))
+    await parse_scheduler.start()
 
 
 
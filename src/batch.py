@@ -0,0 +1,153 @@
+import asyncio
+from asyncio import create_task
+import csv
+import json
+import logging
+import time
+from typing import BinaryIO, List, Optional, Set, TextIO, Tuple
+import aiohttp
+from .models.checker import ProxyChecker
+from .models.client import Proxy
+from .models.judges import JudgePool
+from .parse_module.extractor import ProxyExtractor, ProxyTuple
+
+logger = logging.getLogger(__name__)
+
+__all__ = ('BatchChecker', 'ResultColumns')
+
+ResultColumns = ('host', 'port', 'scheme', 'login', 'password', 'is_alive', 'latency', 'anonymity', 'https')
+
+
+class BatchChecker:
+    """Check proxies of file or stdin without db and web server: stream of chunks -> ProxyExtractor ->
+    ProxyChecker, at most concurrency checks in flight (reading waits for free slot),
+    result is written as soon as check is done, ndjson or csv, only alive unless include_dead.
+
+    checker = BatchChecker(output=sys.stdout, concurrency=500, judge_urls=['http://judge:8080/judge'])
+    stats = await checker.run(sys.stdin.buffer)
+    """
+    formats: tuple = ('ndjson', 'csv')
+    chunk_size: int = 1 << 16
+    judge_pool: Optional[JudgePool] = None
+
+    def __init__(self, output: TextIO, output_format: str = 'ndjson', concurrency: int = 200, timeout: float = 15,
+                 judge_urls: Optional[List[str]] = None, default_scheme: str = 'http', include_dead: bool = False,
+                 progress: Optional[TextIO] = None, progress_interval: float = 1.0):
+        """progress - stream of progress line (stderr), None - no progress"""
+        if output_format not in self.formats:
+            raise ValueError(f'output_format must be one of {self.formats}')
+        if concurrency < 1:
+            raise ValueError('concurrency must be > 0')
+        self.output = output
+        self.output_format = output_format
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.judge_urls = judge_urls or []
+        self.include_dead = include_dead
+        self.progress = progress
+        self.progress_interval = progress_interval
+        self.extractor = ProxyExtractor(default_scheme=default_scheme)
+        self._csv = csv.DictWriter(output, fieldnames=ResultColumns, extrasaction='ignore') \
+            if output_format == 'csv' else None
+        self._seen: Set[Tuple[str, str, int]] = set()
+        self.read = self.duplicates = self.checked = self.alive = 0
+        self._started = time.perf_counter()
+
+    async def read_tuples(self, source: BinaryIO):
+        """chunks of source in executor, token split between chunks is carried by last newline (see scan_stream)"""
+        loop = asyncio.get_event_loop()
+        read = getattr(source, 'read1', source.read)
+        tail = b''
+        while True:
+            chunk = await loop.run_in_executor(None, read, self.chunk_size)
+            if not chunk:
+                break
+            data = tail + chunk
+            cut = data.rfind(b'\n') + 1
+            tail = data[cut:]
+            for item in self.extractor.scan(data[:cut]):
+                yield item
+        for item in self.extractor.scan(tail):
+            yield item
+
+    async def run(self, source: BinaryIO) -> dict:
+        self._started = time.perf_counter()
+        slots = asyncio.Semaphore(self.concurrency)
+        tasks: Set[asyncio.Task] = set()
+        if self._csv:
+            self._csv.writeheader()
+        async with aiohttp.ClientSession() as session:
+            if self.judge_urls:
+                self.judge_pool = JudgePool(self.judge_urls, http_session=session)
+                await self.judge_pool.check_all()
+            reporter = create_task(self._report()) if self.progress else None
+            try:
+                async for item in self.read_tuples(source):
+                    if not self._add(item):
+                        continue
+                    await slots.acquire()
+                    task = create_task(self.check(item))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+                    task.add_done_callback(lambda _: slots.release())
+                if tasks:
+                    await asyncio.gather(*tasks)
+            finally:
+                for task in tasks:
+                    task.cancel()
+                if reporter:
+                    reporter.cancel()
+        self.output.flush()
+        stats = self.stats()
+        if self.progress:
+            self._write_progress(stats, end='\n')
+        return stats
+
+    def _add(self, item: ProxyTuple) -> bool:
+        self.read += 1
+        key = (item[2], item[0], item[1])
+        if key in self._seen:
+            self.duplicates += 1
+            return False
+        self._seen.add(key)
+        return True
+
+    async def check(self, item: ProxyTuple) -> Proxy:
+        host, port, scheme, login, password = item
+        proxy = Proxy(host=host, port=port, scheme=scheme, login=login, password=password)
+        proxy = await ProxyChecker(proxy=proxy, judge_pool=self.judge_pool, timeout=self.timeout).check_proxy()
+        self.checked += 1
+        if proxy.is_alive:
+            self.alive += 1
+        if proxy.is_alive or self.include_dead:
+            self.write(proxy)
+        return proxy
+
+    def write(self, proxy: Proxy) -> None:
+        context = proxy.as_dict()
+        row = {key: context.get(key) for key in ResultColumns}
+        if self._csv:
+            self._csv.writerow(row)
+        else:
+            self.output.write(json.dumps(row, default=str) + '\n')
+
+    def stats(self) -> dict:
+        elapsed = time.perf_counter() - self._started
+        return {'read': self.read, 'duplicates': self.duplicates, 'invalid': self.extractor.invalid,
+                'checked': self.checked, 'alive': self.alive, 'elapsed': round(elapsed, 3),
+                'rate': round(self.checked / elapsed, 1) if elapsed else 0.0}
+
+    def _write_progress(self, stats: dict, end: str) -> None:
+        in_flight = stats['read'] - stats['duplicates'] - stats['checked']
+        self.progress.write(f"\rchecked {stats['checked']} alive {stats['alive']} in flight {in_flight} "
+                            f"duplicates {stats['duplicates']} {stats['rate']}/s{end}")
+        self.progress.flush()
+
+    async def _report(self) -> None:
+        """progress line in place on terminal, line per interval otherwise"""
+        end = '' if self.progress.isatty() else '\n'
+        while True:
+            await asyncio.sleep(self.progress_interval)
+            self.output.flush()
+            self._write_progress(self.stats(), end=end)
+
@@ -1,5 +1,7 @@
+import datetime
+from aiohttp import web
 from aiohttp.web import View, json_response
-from ..models import Proxy, ReferenceLocation, ReferenceProxy
+from ..models import Proxy, ReferenceLocation, ReferenceProxy, PriorityLaneQueue
 import logging
 
 logger = logging.getLogger(__name__)
@@ -13,6 +15,106 @@ class Root(View):
         return json_response(contex, status=200)
 
 
+class JudgeHandler(View):
+    async def get(self):
+        """judge of proxy checks: ip of client and headers as received"""
+        headers = {name: ', '.join(self.request.headers.getall(name)) for name in self.request.headers.keys()}
+        context = {
+            'ip': self.request.remote,
+            'headers': headers,
+        }
+        return json_response(context, status=200)
+
+
+class JudgePayloadHandler(View):
+    chunk: bytes = b'\0' * (1 << 16)
+
+    async def get(self):
+        """payload of throughput probe: ?size= bytes, not more than config judge_max_payload"""
+        max_size = self.request.app.get('config', {}).get('judge_max_payload', 8 << 20)
+        try:
+            size = int(self.request.query.get('size', 1 << 20))
+        except ValueError:
+            return json_response(status=400, data={'Error': 'size must be int'})
+        size = max(0, min(size, max_size))
+        response = web.StreamResponse(headers={'Content-Type': 'application/octet-stream',
+                                               'Cache-Control': 'no-store'})
+        response.content_length = size
+        await response.prepare(self.request)
+        while size > 0:
+            chunk = self.chunk[:size]
+            await response.write(chunk)
+            size -= len(chunk)
+        await response.write_eof()
+        return response
+
+
+class ProxyListHandler(View):
+    filters = {'scheme': str, 'anonymity': str, 'max_latency': float, 'min_throughput': float, 'country': str,
+               'sort': str, 'limit': int, 'offset': int}
+
+    async def get(self):
+        """proxies by filters: ?alive=1&https=1&scheme=&anonymity=&country=&max_latency=&min_throughput=
+        &sort=-health_score (default)|latency|ttfb|throughput|uptime|latency_p90|date_update, -key - descending
+        &limit=&offset=
+        from ProxyIndex (source: index) if app has one, else from db, same columns (ProxyListColumns)
+        """
+        query = self.request.query
+        try:
+            kwargs = {name: cast(query[name]) for name, cast in self.filters.items() if name in query}
+            kwargs['is_alive'] = self.query_bool('alive', default=True)
+            kwargs['https'] = self.query_bool('https')
+            kwargs['limit'] = max(1, min(kwargs.get('limit', 100), 1000))
+            if kwargs.get('offset', 0) < 0:
+                raise ValueError('offset must not be negative')
+            index = self.request.app.get('proxy_index')
+            if index is not None:
+                rows, source = index.query(**kwargs), 'index'
+            else:
+                rows, source = await self.request.app['ProxyDb'].select_proxies(**kwargs), 'db'
+        except ValueError as e:
+            return json_response(status=400, data={'Error': f'Bad_request {e}'})
+        return json_response(status=200, data={'proxies': [self.serialize(row) for row in rows], 'source': source})
+
+    def query_bool(self, name: str, default=None):
+        """1/true/yes, 0/false/no, any - no filter"""
+        value = self.request.query.get(name)
+        if value is None:
+            return default
+        if value == 'any':
+            return None
+        return value.lower() in ('1', 'true', 'yes')
+
+    @staticmethod
+    def serialize(row) -> dict:
+        data = {}
+        for key, value in dict(row).items():
+            if isinstance(value, datetime.datetime):
+                value = value.isoformat()
+            elif value is not None and not isinstance(value, (str, int, float, bool)):
+                value = str(value)
+            data[key] = value
+        return data
+
+
+class ProxyNearHandler(View):
+    filters = {'lat': float, 'lon': float, 'k': int, 'max_latency': float, 'max_km': float}
+
+    async def get(self):
+        """k nearest alive proxies to point: ?lat=&lon=&k=10&max_latency=&max_km=, by distance"""
+        geo_index = self.request.app.get('geo_index')
+        if geo_index is None:
+            return json_response(status=503, data={'Error': 'geo index is not enabled'})
+        query = self.request.query
+        try:
+            kwargs = {name: cast(query[name]) for name, cast in self.filters.items() if name in query}
+            kwargs['k'] = max(1, min(kwargs.get('k', 10), 1000))
+            rows = geo_index.nearest(**kwargs)
+        except (ValueError, TypeError) as e:
+            return json_response(status=400, data={'Error': f'Bad_request {e}'})
+        return json_response(status=200, data={'proxies': rows})
+
+
 class ProxyHandler(View):
     async def post(self):
         """input json(proxy), create Proxy, put in Queue.
@@ -28,6 +130,7 @@ class ProxyHandler(View):
             logger.error(f'{e} ::: {e.args}')
             return json_response(status=400, data={'Error': f'Bad_request {e} :: {e.args}'})
         for prx in proxys:
+            prx.lane = 'user'
             await self.request.app['queue_api_to_db'].put(prx)
         return json_response(status=200, data={'status': 'put to processing'})
 
@@ -37,6 +140,36 @@ class StatsHandler(View):
     async def get(self):
         context = {
             "Proxy": len(ReferenceProxy.get()),
-            "Location": len(ReferenceLocation.get())
+            "Location": len(ReferenceLocation.get()),
+            "queues": {name: queue.stats() for name, queue in self.queues() if isinstance(queue, PriorityLaneQueue)}
         }
+        checker_handler = self.request.app.get('checker_handler')
+        if checker_handler and checker_handler.concurrency:
+            context['checker_concurrency'] = checker_handler.concurrency.stats()
+        if 'judge_pool' in self.request.app:
+            context['judges'] = self.request.app['judge_pool'].stats()
+        if 'task_handler_api_to_db' in self.request.app:
+            context['writes'] = self.request.app['task_handler_api_to_db'].write_stats.as_dict()
+        if 'proxy_index' in self.request.app:
+            index = self.request.app['proxy_index']
+            context['proxy_index'] = {'proxies': len(index), **index.stats}
+        if 'parse_scheduler' in self.request.app:
+            context['parsers'] = self.request.app['parse_scheduler'].stats()
         return json_response(status=200, data=context, )
+
+    def queues(self):
+        for name in ('queue_api_to_db', 'start_proxy_queue', 'checker_out_queue'):
+            if name in self.request.app:
+                yield name, self.request.app[name]
+
+
+class ConcurrencyStatsHandler(View):
+
+    async def get(self):
+        """current limit and history of AdaptiveConcurrency of checker"""
+        checker_handler = self.request.app.get('checker_handler')
+        if not checker_handler or not checker_handler.concurrency:
+            return json_response(status=404, data={'Error': 'adaptive concurrency is not enabled'})
+        concurrency = checker_handler.concurrency
+        context = dict(concurrency.stats(), history=list(concurrency.history))
+        return json_response(status=200, data=context)
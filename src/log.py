@@ -0,0 +1,76 @@
+import atexit
+import logging
+import logging.handlers
+import queue
+import sys
+import time
+from typing import Dict, List, Optional, TextIO, Tuple, Union
+
+__all__ = ('setup_logging', 'RateLimitFilter')
+
+LogFormat = '%(asctime)s %(levelname)s %(name)s: %(message)s'
+
+
+class RateLimitFilter(logging.Filter):
+    """At most burst records of one call site (file and line) per interval seconds, records above max_level pass.
+    First record of next interval tells count of dropped records.
+    Per proxy calls log by %-style args, message is formatted only for passed records.
+    """
+
+    def __init__(self, interval: float = 10, burst: int = 20, max_level: int = logging.WARNING):
+        super().__init__()
+        self.interval = interval
+        self.burst = burst
+        self.max_level = max_level
+        self.suppressed = 0
+        self._windows: Dict[Tuple[str, int], List] = {}  # call site: [start, passed, dropped]
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > self.max_level:
+            return True
+        key = (record.pathname, record.lineno)
+        now = time.monotonic()
+        window = self._windows.get(key)
+        if window is None or now - window[0] >= self.interval:
+            self._windows[key] = [now, 1, 0]
+            if window is not None and window[2]:
+                self._tell_dropped(record, window[2])
+            return True
+        if window[1] < self.burst:
+            window[1] += 1
+            return True
+        window[2] += 1
+        self.suppressed += 1
+        return False
+
+    @staticmethod
+    def _tell_dropped(record: logging.LogRecord, dropped: int) -> None:
+        if isinstance(record.args, tuple) and record.args:
+            record.msg, record.args = f'{record.msg} (%d similar dropped)', record.args + (dropped,)
+        elif not record.args:
+            record.msg = f'{record.msg} ({dropped} similar dropped)'
+
+
+def setup_logging(level: Union[int, str] = logging.INFO, rate_limit: Optional[dict] = None,
+                  stream: Optional[TextIO] = None, fmt: str = LogFormat) -> logging.handlers.QueueListener:
+    """root logger puts records to queue, thread of QueueListener writes them: no write to stream in event loop.
+    rate_limit - kwargs of RateLimitFilter, None - no limit
+
+    listener = setup_logging('INFO', rate_limit={'interval': 10, 'burst': 20})
+    """
+    records = queue.SimpleQueue()
+    handler = logging.StreamHandler(stream if stream is not None else sys.stderr)
+    handler.setFormatter(logging.Formatter(fmt))
+    queue_handler = logging.handlers.QueueHandler(records)
+    if rate_limit is not None:
+        queue_handler.addFilter(RateLimitFilter(**rate_limit))
+    root = logging.getLogger()
+    for old_handler in root.handlers[:]:
+        root.removeHandler(old_handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+    listener = logging.handlers.QueueListener(records, handler, respect_handler_level=True)
+    listener.start()
+    # records in queue are written on exit, listener may be stopped before
+    atexit.register(lambda: listener._thread is not None and listener.stop())
+    return listener
@@ -1,5 +1,70 @@
-from .client import ProxyClient, Proxy, Location, ReferenceProxy, ReferenceLocation
-from .db import *
-from .checker import (ProxyChecker, TaskProxyCheckHandler, CheckProxyPolicy, ApiLocation, LocationTaskHandler)
-from .db_work import ProxyDb, TaskHandlerToDB, LocationDb, StartProxyHandler
-from .errors import ManyRequestAtHourLocationApi
+"""Submodules are imported on first use of their name: ProxyChecker (checker) does not import sqlalchemy
+and asyncpg of db modules, e.g. batch check of entry.py without db.
+"""
+import importlib
+from typing import TYPE_CHECKING
+
+# name: submodule
+_exports = {
+    'ProxyClient': 'client', 'Proxy': 'client', 'Location': 'client', 'ReferenceProxy': 'client',
+    'ReferenceLocation': 'client',
+    'proxy_table': 'db', 'location_table': 'db',
+    'ProxyChecker': 'checker', 'TaskProxyCheckHandler': 'checker', 'CheckProxyPolicy': 'checker',
+    'JudgeProxyPolicy': 'checker', 'ApiLocation': 'checker', 'LocationTaskHandler': 'checker',
+    'ProxyDb': 'db_work', 'TaskHandlerToDB': 'db_work', 'LocationDb': 'db_work', 'StartProxyHandler': 'db_work',
+    'LeaseKeeper': 'db_work',
+    'ProxyStorage': 'storage', 'LocationStorage': 'storage',
+    'MemoryProxyDb': 'memory_db', 'MemoryLocationDb': 'memory_db',
+    'SqliteDb': 'sqlite_db', 'SqliteProxyDb': 'sqlite_db', 'SqliteLocationDb': 'sqlite_db',
+    'ManyRequestAtHourLocationApi': 'errors',
+    'MigrationRunner': 'migrations', 'load_migrations': 'migrations',
+    'RecheckScheduler': 'scheduler',
+    'PriorityLaneQueue': 'queues', 'proxy_lane': 'queues',
+    'AdaptiveConcurrency': 'concurrency', 'LoopLagMonitor': 'concurrency',
+    'Judge': 'judges', 'JudgePool': 'judges',
+    'HealthStore': 'health',
+    'CheckHistory': 'history',
+    'ProxyGateway': 'gateway', 'GatewayProxyPool': 'gateway',
+    'ProxyIndex': 'index',
+    'ChangePublisher': 'changes', 'ChangeListener': 'changes', 'IndexPoll': 'changes',
+    'StateSnapshot': 'snapshot',
+    'GeoIndex': 'geo',
+}
+
+__all__ = tuple(_exports)
+
+
+def __getattr__(name: str):
+    module = _exports.get(name)
+    if module is None:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+    value = globals()[name] = getattr(importlib.import_module(f'.{module}', __name__), name)
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_exports))
+
+
+if TYPE_CHECKING:
+    from .client import ProxyClient, Proxy, Location, ReferenceProxy, ReferenceLocation
+    from .db import proxy_table, location_table
+    from .checker import (ProxyChecker, TaskProxyCheckHandler, CheckProxyPolicy, JudgeProxyPolicy, ApiLocation,
+                          LocationTaskHandler)
+    from .db_work import ProxyDb, TaskHandlerToDB, LocationDb, StartProxyHandler, LeaseKeeper
+    from .storage import ProxyStorage, LocationStorage
+    from .memory_db import MemoryProxyDb, MemoryLocationDb
+    from .sqlite_db import SqliteDb, SqliteProxyDb, SqliteLocationDb
+    from .errors import ManyRequestAtHourLocationApi
+    from .migrations import MigrationRunner, load_migrations
+    from .scheduler import RecheckScheduler
+    from .queues import PriorityLaneQueue, proxy_lane
+    from .concurrency import AdaptiveConcurrency, LoopLagMonitor
+    from .judges import Judge, JudgePool
+    from .health import HealthStore
+    from .history import CheckHistory
+    from .gateway import ProxyGateway, GatewayProxyPool
+    from .index import ProxyIndex
+    from .changes import ChangePublisher, ChangeListener, IndexPoll
+    from .snapshot import StateSnapshot
+    from .geo import GeoIndex
@@ -0,0 +1,246 @@
+import asyncio
+from asyncio import create_task
+import asyncpg
+import datetime
+import json
+import logging
+from typing import Dict, List, Optional
+from .client import Proxy
+from .index import ProxyIndex, EntryColumns
+
+logger = logging.getLogger(__name__)
+
+__all__ = ('ChangePublisher', 'ChangeListener', 'IndexPoll', 'CHANNEL')
+
+CHANNEL = 'proxy_changes'
+# payload of NOTIFY is limited by 8000 bytes
+MaxPayload = 7500
+
+
+# position of date_update (iso text) in event
+DateUpdatePosition = 2 + EntryColumns.index('date_update')
+
+
+def proxy_event(proxy: Proxy) -> list:
+    """[host, port, *EntryColumns], date_update as iso text"""
+    event = [str(proxy.host), proxy.port] + [getattr(proxy, column) for column in EntryColumns]
+    if event[DateUpdatePosition] is not None:
+        event[DateUpdatePosition] = event[DateUpdatePosition].isoformat()
+    return event
+
+
+def apply_event(index: ProxyIndex, event: list) -> None:
+    if len(event) > DateUpdatePosition and event[DateUpdatePosition] is not None:
+        event[DateUpdatePosition] = datetime.datetime.fromisoformat(event[DateUpdatePosition])
+    index.apply(*event)
+
+
+class ChangePublisher:
+    """Publish changes of proxies saved by TaskHandlerToDB to other instances by NOTIFY,
+    batch of events every flush_interval seconds (or batch_size events) after update is committed:
+    payload {"o": owner, "s": seq, "e": [[host, port, alive, latency, country, score, scheme, ...], ...]}
+    (proxy_event), seq + 1 per NOTIFY of owner
+    """
+    _db: asyncpg.pool.Pool
+    _buffer: List[list]
+    _instance_start: Optional[asyncio.Task] = None
+
+    def __init__(self, db_connect: asyncpg.pool.Pool, owner: str, channel: str = CHANNEL, batch_size: int = 100,
+                 flush_interval: float = 0.5):
+        self._db = db_connect
+        self.owner = owner
+        self.channel = channel
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.seq = 0
+        self._buffer = []
+        self._flush_lock = asyncio.Lock()
+        self._flush_task: Optional[asyncio.Task] = None
+
+    def add(self, proxy: Proxy) -> None:
+        self._buffer.append(proxy_event(proxy))
+        if len(self._buffer) >= self.batch_size and (self._flush_task is None or self._flush_task.done()):
+            self._flush_task = create_task(self.flush())
+
+    def payloads(self, events: List[list]) -> List[str]:
+        """split events by size limit of NOTIFY, next seq for every payload"""
+        payloads = []
+        chunk, size = [], 0
+        for event in events:
+            encoded = json.dumps(event, separators=(',', ':'))
+            if chunk and size + len(encoded) > MaxPayload:
+                payloads.append(self._payload(chunk))
+                chunk, size = [], 0
+            chunk.append(encoded)
+            size += len(encoded) + 1
+        if chunk:
+            payloads.append(self._payload(chunk))
+        return payloads
+
+    def _payload(self, encoded_events: List[str]) -> str:
+        self.seq += 1
+        return f'{{"o":{json.dumps(self.owner)},"s":{self.seq},"e":[{",".join(encoded_events)}]}}'
+
+    async def flush(self) -> int:
+        async with self._flush_lock:
+            events, self._buffer = self._buffer, []
+            if not events:
+                return 0
+            try:
+                async with self._db.acquire() as conn:
+                    for payload in self.payloads(events):
+                        await conn.execute('SELECT pg_notify($1, $2)', self.channel, payload)
+            except Exception as e:
+                # listeners see gap of seq and resync
+                logger.error(f'notify {len(events)} changes :: {e}, {e.args}')
+                return 0
+            return len(events)
+
+    async def start(self) -> None:
+        self._instance_start = create_task(self._start())
+
+    def stop(self) -> None:
+        if self._instance_start:
+            self._instance_start.cancel()
+
+    async def _start(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+
+class ChangeListener:
+    """LISTEN on dedicated connection, apply change events to ProxyIndex.
+    Full resync from db on start, on reconnect and when seq of owner has gap,
+    events received during resync are buffered and applied after rows of resync.
+    """
+    index: ProxyIndex
+    _last_seq: Dict[str, int]
+    _connection: Optional[asyncpg.Connection] = None
+    _instance_start: Optional[asyncio.Task] = None
+
+    def __init__(self, dsn: str, index: ProxyIndex, proxy_db, channel: str = CHANNEL, check_interval: float = 5):
+        self.dsn = dsn
+        self.index = index
+        self.proxy_db = proxy_db
+        self.channel = channel
+        self.check_interval = check_interval
+        self._last_seq = {}
+        self._resync_task: Optional[asyncio.Task] = None
+        # events received while select of resync is in flight, None - no resync
+        self._pending: Optional[List[list]] = None
+
+    def on_notify(self, connection, pid: int, channel: str, payload: str) -> None:
+        try:
+            message = json.loads(payload)
+            owner, seq, events = message['o'], message['s'], message['e']
+        except (ValueError, KeyError, TypeError) as e:
+            logger.error(f'bad change event {payload[:100]} :: {e}')
+            return
+        last = self._last_seq.get(owner)
+        self._last_seq[owner] = seq
+        if last is not None and seq != last + 1:
+            self.index.stats['gaps'] += 1
+            logger.warning(f'gap of changes of {owner}: {last} -> {seq}, resync')
+            self.schedule_resync()
+        if self._pending is not None:
+            self._pending.extend(events)
+            return
+        for event in events:
+            apply_event(self.index, event)
+        self.index.stats['events'] += len(events)
+
+    def schedule_resync(self) -> None:
+        if self._resync_task is None or self._resync_task.done():
+            self._resync_task = create_task(self.resync())
+
+    async def resync(self) -> int:
+        """load replaces index: events of the select are buffered and replayed in order of arrival"""
+        self._pending = []
+        try:
+            rows = await self.proxy_db.select_index_rows()
+            count = self.index.load(rows)
+            for event in self._pending:
+                apply_event(self.index, event)
+            self.index.stats['events'] += len(self._pending)
+        finally:
+            self._pending = None
+        logger.info(f'proxy index resync: {count} proxies')
+        return count
+
+    async def connect(self, resync: bool = True) -> None:
+        self._connection = await asyncpg.connect(self.dsn)
+        await self._connection.add_listener(self.channel, self.on_notify)
+        # listen before resync - changes committed during resync are not lost
+        if resync:
+            await self.resync()
+
+    async def start(self, resync: bool = True) -> None:
+        """resync=False - index is loaded from snapshot, caught up by StateSnapshot.catch_up"""
+        await self.connect(resync=resync)
+        self._instance_start = create_task(self._start())
+
+    async def stop(self) -> None:
+        if self._instance_start:
+            self._instance_start.cancel()
+        if self._connection is not None and not self._connection.is_closed():
+            await self._connection.close()
+
+    async def _start(self) -> None:
+        """reconnect and resync if listener connection is lost"""
+        while True:
+            await asyncio.sleep(self.check_interval)
+            if self._connection is not None and not self._connection.is_closed():
+                continue
+            logger.warning('listener connection lost, reconnect')
+            try:
+                await self.connect()
+            except (OSError, asyncpg.PostgresError) as e:
+                logger.error(f'listener reconnect :: {e}, {e.args}')
+
+
+class IndexPoll:
+    """Sync ProxyIndex with storage without LISTEN (sqlite): full load on start,
+    then proxies with date_update newer than previous poll (minus margin seconds) every interval seconds.
+    Deleted proxies stay in index until restart.
+    """
+    index: ProxyIndex
+    _instance_start: Optional[asyncio.Task] = None
+
+    def __init__(self, index: ProxyIndex, proxy_db, interval: float = 5, margin: float = 60):
+        """margin - seconds of writes in flight: date_update is set before row is saved"""
+        self.index = index
+        self.proxy_db = proxy_db
+        self.interval = interval
+        self.margin = margin
+        self._since: Optional[datetime.datetime] = None
+
+    async def poll(self) -> int:
+        started = datetime.datetime.utcnow()
+        if self._since is None:
+            count = self.index.load(await self.proxy_db.select_index_rows())
+        else:
+            rows = await self.proxy_db.select_index_rows(updated_after=self._since)
+            for row in rows:
+                self.index.apply_row(row)
+            self.index.stats['events'] += len(rows)
+            count = len(rows)
+        self._since = started - datetime.timedelta(seconds=self.margin)
+        return count
+
+    async def start(self) -> None:
+        count = await self.poll()
+        logger.info('proxy index loaded: %s proxies', count)
+        self._instance_start = create_task(self._start())
+
+    def stop(self) -> None:
+        if self._instance_start:
+            self._instance_start.cancel()
+
+    async def _start(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.poll()
+            except Exception as e:
+                logger.error('proxy index poll :: %r', e)
@@ -1,24 +1,50 @@
 import asyncio
+from asyncio import create_task
 import logging
-import sys
 import datetime
-from typing import Optional, Union, Type
+import json
+import time
+from typing import TYPE_CHECKING, Optional, Union, Type
 import weakref
 from .errors import ManyRequestAtHourLocationApi
 from .client import ProxyClient, Proxy, Location
-from .db_work import LocationDb
+from .concurrency import AdaptiveConcurrency
+from .judges import Judge, JudgePool
+from .geo import GeoIndex
+from .scheduler import RecheckScheduler
+from .storage import LocationStorage
 from abc import ABC, abstractmethod
 import aiohttp
-
-if sys.version_info < (3, 7)[:2]:
-    from asyncio import ensure_future as create_task
-else:
-    from asyncio import create_task
+from aiohttp_proxy.errors import ProxyError
+if TYPE_CHECKING:
+    # db modules import sqlalchemy and asyncpg, not needed for check without db
+    from .db_work import LeaseKeeper
 
 logger = logging.getLogger(__name__)
 
-__all__ = ('ProxyChecker', 'TaskProxyCheckHandler', 'CheckProxyPolicy', 'BaseTaskHandler', 'BasePipelineTask',
-           'ApiLocation', 'LocationTaskHandler')
+# failures of network of proxy or api, logged without traceback
+RoutineErrors = (aiohttp.ClientError, asyncio.TimeoutError, ProxyError, OSError)
+
+__all__ = ('ProxyChecker', 'TaskProxyCheckHandler', 'CheckProxyPolicy', 'JudgeProxyPolicy', 'BaseTaskHandler',
+           'BasePipelineTask', 'ApiLocation', 'LocationTaskHandler', 'classify_anonymity')
+
+# headers added by proxies, lower case
+ProxyRevealingHeaders = frozenset((
+    'via', 'forwarded', 'x-forwarded-for', 'x-forwarded', 'forwarded-for', 'x-real-ip', 'client-ip', 'x-client-ip',
+    'true-client-ip', 'x-originating-ip', 'proxy-client-ip', 'x-proxy-id', 'proxy-connection', 'x-bluecoat-via',
+))
+
+
+def classify_anonymity(echo: dict, origin_ip: Optional[str]) -> str:
+    """level of proxy by echo of judge:
+    transparent - our ip is seen by judge, anonymous - proxy headers without our ip, elite - nothing of proxy
+    """
+    headers = {name.lower(): str(value) for name, value in (echo.get('headers') or {}).items()}
+    if origin_ip and (echo.get('ip') == origin_ip or any(origin_ip in value for value in headers.values())):
+        return 'transparent'
+    if ProxyRevealingHeaders.intersection(headers):
+        return 'anonymous'
+    return 'elite'
 
 
 class BaseTaskHandler(ABC):
@@ -54,13 +80,13 @@ class BasePipelineTask(ABC):
         self.max_tasks_semaphore = asyncio.Semaphore(max_tasks)
 
     async def _start(self) -> None:
-        print(f'{self.__class__} starting')
+        logger.info('%s starting', self.__class__.__name__)
         while True:
             await self.max_tasks_semaphore.acquire()
             proxy = await self.incoming_queue.get()
             self.incoming_queue.task_done()
             if not isinstance(proxy, Proxy):
-                logger.error(f'{proxy} -- not instance Proxy')
+                logger.error('%s -- not instance Proxy', proxy)
                 self.max_tasks_semaphore.release()
                 continue
             create_task(self.processing_task(proxy))
@@ -77,11 +103,26 @@ class BasePipelineTask(ABC):
 
 
 class ProxyChecker:
-    """Check proxy"""
+    """Check proxy, request to judge of judge_pool if set, else ProxyClient.test_url.
+    With judge one probe on session of proxy: echo of judge -> anonymity,
+    then CONNECT to judge_pool.https_url (if set) -> https,
+    then if throughput_size is set, payload of judge up to throughput_size bytes / throughput_seconds -> ttfb, throughput;
+    result is saved by one update of proxy
+    """
+
+    unexpected_error: Optional[BaseException] = None
+    judge: Optional[Judge] = None
+    https_timeout: float = 10
 
-    def __init__(self, proxy: Proxy):
+    def __init__(self, proxy: Proxy, judge_pool: Optional[JudgePool] = None, throughput_size: Optional[int] = None,
+                 throughput_seconds: float = 10, timeout: float = 180):
+        """timeout - seconds of check request through proxy"""
         self.proxy = proxy
-        self.proxy_policy = CheckProxyPolicy()
+        self.timeout = timeout
+        self.judge_pool = judge_pool
+        self.throughput_size = throughput_size
+        self.throughput_seconds = throughput_seconds
+        self.proxy_policy = JudgeProxyPolicy() if judge_pool else CheckProxyPolicy()
 
     @classmethod
     async def check(cls, proxy: Proxy) -> 'Proxy':
@@ -92,17 +133,29 @@ class ProxyChecker:
 
     async def check_proxy(self) -> Proxy:
         answer = None
-        async with ProxyClient(proxy=self.proxy) as sess:
+        if self.judge_pool:
+            self.judge = self.judge_pool.select()
+        async with ProxyClient(proxy=self.proxy, test_url=self.judge.url if self.judge else None) as sess:
+            sess.return_content = self.judge is not None
             try:
-                answer = await sess.get()
+                answer = await sess.get(timeout=self.timeout)
+                if answer and self.judge:
+                    answer['echo'] = self.parse_echo(answer.get('content'))
+                    if self.judge_pool.https_url and self.check_policy(answer):
+                        answer['https'] = await self.probe_https(sess)
+                    if self.throughput_size and self.check_policy(answer):
+                        answer['throughput'] = await self.probe_throughput(sess)
             except asyncio.exceptions.TimeoutError as e:
-                logger.info(f'{self.proxy}: {self.__class__.__name__} - {e} :: {e.args}')
+                logger.info('%s: %s - timeout %r', self.proxy, self.__class__.__name__, e)
             except (aiohttp.ClientProxyConnectionError, aiohttp.ServerConnectionError, aiohttp.ServerDisconnectedError,
                     aiohttp.ServerTimeoutError) as e:
-                logger.info(f'client error {self.proxy}: {self.__class__.__name__} - {e} :: {e.args}')
+                logger.info('client error %s: %s - %r', self.proxy, self.__class__.__name__, e)
             except Exception as e:
-                logger.info(f'{Proxy} -- {e}, -- {e.args}')
-                logger.exception(e)
+                self.unexpected_error = e
+                if isinstance(e, RoutineErrors):
+                    logger.info('%s: %s - %r', self.proxy, self.__class__.__name__, e)
+                else:
+                    logger.exception('%s: %s - %r', self.proxy, self.__class__.__name__, e)
             finally:
                 self.proxy.date_update = datetime.datetime.utcnow()
         if not answer:
@@ -118,10 +171,54 @@ class ProxyChecker:
     def rebuild_proxy(self, answer: dict) -> None:
         self.proxy.latency = float(round(answer['latency'], 3))
         self.proxy.is_alive = True
+        if answer.get('echo'):
+            origin_ip = self.judge.origin_ip or self.judge_pool.origin_ip
+            self.proxy.anonymity = classify_anonymity(answer['echo'], origin_ip=origin_ip)
+            self.proxy.anonymous = self.proxy.anonymity != 'transparent'
+        if 'https' in answer:
+            self.proxy.https = answer['https']
+        if answer.get('throughput'):
+            self.proxy.ttfb = float(round(answer['throughput']['ttfb'], 4))
+            self.proxy.throughput = float(round(answer['throughput']['throughput'], 1))
+
+    async def probe_https(self, sess: ProxyClient) -> bool:
+        """CONNECT through proxy to TLS endpoint, on session (connector) of first request:
+        one request of https_timeout seconds, https if endpoint answers 2xx or echo of judge
+        """
+        try:
+            result = await sess.fetch(url=self.judge_pool.https_url, timeout=self.https_timeout)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.info('%s https :: %s %s', self.proxy, e.__class__.__name__, e)
+            return False
+        if 200 <= result['status_response'] < 300 or self.parse_echo(result['content']) is not None:
+            return True
+        logger.info('%s https :: status %s', self.proxy, result['status_response'])
+        return False
+
+    async def probe_throughput(self, sess: ProxyClient) -> Optional[dict]:
+        """download payload of judge, only for proxy passed check, bounded by throughput_size and throughput_seconds"""
+        url = self.judge.payload_url(self.throughput_size)
+        try:
+            result = await sess.download(url=url, max_bytes=self.throughput_size, max_seconds=self.throughput_seconds)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            logger.info('%s throughput :: %s %s', self.proxy, e.__class__.__name__, e)
+            return None
+        if result['status_response'] != 200 or result['ttfb'] is None:
+            return None
+        return result
 
     def check_policy(self, data: dict) -> bool:
         return self.proxy_policy.is_valid(data=data)
 
+    @staticmethod
+    def parse_echo(content: Optional[bytes]) -> Optional[dict]:
+        """json of judge: {'ip': ..., 'headers': {...}}, None if proxy returned other page"""
+        try:
+            echo = json.loads(content)
+        except (TypeError, ValueError):
+            return None
+        return echo if isinstance(echo, dict) else None
+
 
 class CheckProxyPolicy:
     status_response = 200
@@ -132,25 +229,64 @@ class CheckProxyPolicy:
         return False
 
 
+class JudgeProxyPolicy(CheckProxyPolicy):
+    """status 200 and echo of judge, not error or ad page of proxy with status 200"""
+
+    def is_valid(self, data: Union[dict, str, None]) -> bool:
+        if not super().is_valid(data):
+            return False
+        echo = data.get('echo')
+        return isinstance(echo, dict) and 'ip' in echo
+
+
 class TaskProxyCheckHandler(BaseTaskHandler):
     incoming_queue: asyncio.Queue
     outgoing_queue: asyncio.Queue
     max_tasks_semaphore: asyncio.Semaphore
     _instance_start: Optional[asyncio.Task]
 
-    def __init__(self, outgoing_queue: asyncio.Queue, incoming_queue: Optional[asyncio.Queue] = None, max_tasks: int = 20):
+    lease_keeper: 'Optional[LeaseKeeper]'
+    concurrency: Optional[AdaptiveConcurrency]
+    judge_pool: Optional[JudgePool]
+    scheduler: Optional[RecheckScheduler]
+
+    def __init__(self, outgoing_queue: asyncio.Queue, incoming_queue: Optional[asyncio.Queue] = None, max_tasks: int = 20,
+                 lease_keeper: 'Optional[LeaseKeeper]' = None, concurrency: Optional[AdaptiveConcurrency] = None,
+                 judge_pool: Optional[JudgePool] = None, throughput_size: Optional[int] = None,
+                 throughput_seconds: float = 10, scheduler: Optional[RecheckScheduler] = None):
+        """concurrency - adaptive limit of checks instead of fixed max_tasks,
+        judge_pool - own judges instead of ProxyClient.test_url,
+        throughput_size - bytes of throughput probe of alive proxies (needs judge_pool), no probe if None,
+        scheduler - proxy of failed check is scheduled again after its lease (needs lease_keeper)
+        """
+        self.scheduler = scheduler
+        self.judge_pool = judge_pool
+        self.throughput_size = throughput_size if judge_pool else None
+        self.throughput_seconds = throughput_seconds
         self.incoming_queue = incoming_queue
         self.outgoing_queue = outgoing_queue
-        self.max_tasks_semaphore = asyncio.Semaphore(max_tasks)
+        self.concurrency = concurrency
+        self.max_tasks_semaphore = concurrency if concurrency else asyncio.Semaphore(max_tasks)
+        self.lease_keeper = lease_keeper
+
+    async def start(self) -> None:
+        if self.concurrency:
+            await self.concurrency.start()
+        await super().start()
+
+    def stop(self) -> None:
+        if self.concurrency:
+            self.concurrency.stop()
+        super().stop()
 
     async def _start(self) -> None:
-        print(f'{self.__class__.__name__} starting')
+        logger.info('%s starting', self.__class__.__name__)
         while True:
             await self.max_tasks_semaphore.acquire()
             proxy = await self.incoming_queue.get()
             self.incoming_queue.task_done()
             if not isinstance(proxy, Proxy):
-                logger.error(f'{proxy} -- not instance Proxy')
+                logger.error('%s -- not instance Proxy', proxy)
                 self.max_tasks_semaphore.release()
                 continue
             self.reference_tasks.add(create_task(self.processing_task(proxy)))
@@ -158,13 +294,26 @@ class TaskProxyCheckHandler(BaseTaskHandler):
 
     async def processing_task(self, proxy: Proxy) -> None:
         """Check proxy and put to queue"""
+        ok = False
         try:
-            checked_proxy = await ProxyChecker.check(proxy=proxy)
+            checker = ProxyChecker(proxy=proxy, judge_pool=self.judge_pool, throughput_size=self.throughput_size,
+                                   throughput_seconds=self.throughput_seconds)
+            if self.lease_keeper:
+                async with self.lease_keeper.hold(proxy):
+                    checked_proxy = await checker.check_proxy()
+            else:
+                checked_proxy = await checker.check_proxy()
+            ok = checker.unexpected_error is None
             await self.put_proxy_to_queue(checked_proxy)
         except Exception as e:
-            logger.error(f'{proxy} ::: {proxy}, {e} ::: {e.args}')
-            logger.exception(e)
+            logger.exception('%s ::: %r', proxy, e)
+            if self.scheduler is not None and self.lease_keeper is not None and proxy.in_process:
+                # not written: row stays claimed until lease expires
+                self.scheduler.schedule(proxy.host, proxy.port,
+                                        time.time() + self.lease_keeper.proxy_db.lease_seconds)
         finally:
+            if self.concurrency:
+                self.concurrency.record(ok=ok)
             self.max_tasks_semaphore.release()
 
     async def put_proxy_to_queue(self, proxy: Proxy) -> None:
@@ -209,8 +358,7 @@ class ApiLocation:
         try:
             _j_resp = await self.get_api(host=host)
         except Exception as e:
-            logger.error(f'{e} :: {e.args}')
-            logger.exception(e)
+            logger.info('location api %s :: %r', host, e)
             raise
         if _j_resp:
             location = self._create_location(json_from_api=_j_resp)
@@ -223,9 +371,10 @@ class ApiLocation:
 
 class LocationTaskHandler(BasePipelineTask, BaseTaskHandler):
     api_location: ApiLocation
-    location_db: LocationDb
+    location_db: LocationStorage
 
-    def __init__(self, api_location: ApiLocation, location_db: LocationDb, *args, **kwargs):
+    def __init__(self, api_location: ApiLocation, location_db: LocationStorage, *args, geo_index: Optional[GeoIndex] = None,
+                 **kwargs):
         """You're allowed up to 15,000 queries per hour by default.
          Once this limit is reached, all of your requests will result in HTTP 403, forbidden,
           until your quota is cleared.
@@ -234,24 +383,36 @@ class LocationTaskHandler(BasePipelineTask, BaseTaskHandler):
         super().__init__(*args, **kwargs)
         self.api_location = api_location
         self.location_db = location_db
+        self.skipped = 0  # proxies with location of same ip saved on row
+        self.geo_index = geo_index
 
     async def processing_task(self, proxy: Proxy) -> None:
         try:
-            location = await self.select_from_db(proxy.host)
-            if not location:
-                location = await self.api_location.find_location(proxy=proxy)
-                if isinstance(location, Location):
-                    await self.save_location_from_db(location=location)
-            proxy.location = location
+            geo_known = self.geo_index is None or (str(proxy.host), proxy.port) in self.geo_index
+            if proxy.location_is_actual() and geo_known:
+                # ip is not changed since location saved with proxy
+                self.skipped += 1
+            elif proxy.location_is_actual():
+                # coordinates for GeoIndex
+                proxy.set_location(await self.select_from_db(proxy.host))
+            else:
+                location = await self.select_from_db(proxy.host)
+                if not location:
+                    location = await self.api_location.find_location(proxy=proxy)
+                    if isinstance(location, Location):
+                        await self.save_location_from_db(location=location)
+                proxy.set_location(location)
+            if self.geo_index is not None:
+                self.geo_index.update_proxy(proxy)
+        except (ManyRequestAtHourLocationApi, *RoutineErrors) as e:
+            logger.info('location of %s :: %r', proxy, e)
         except Exception as e:
-            logger.error(f"{e} :: {e.args}")
-            logger.exception(e)
+            logger.exception('location of %s :: %r', proxy, e)
 
         try:
             await self.put_proxy_to_queue(proxy=proxy)
         except Exception as e:
-            logger.error(e)
-            logger.exception(e)
+            logger.exception('%s ::: %r', proxy, e)
         finally:
             self.max_tasks_semaphore.release()
 
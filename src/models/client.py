@@ -22,9 +22,9 @@ __all__ = ('ProxyClient', 'Proxy', 'Location', "ReferenceProxy", "ReferenceLocat
 def latency(coro):
     """wrapper -  approximately time read response, adds latency to returned dict"""
     async def wrapped(*args, **kwargs):
-        t1 = time.time()
+        t1 = time.perf_counter()
         result = await coro(*args, **kwargs)
-        _latency = time.time() - t1
+        _latency = time.perf_counter() - t1
         result.update({'latency': _latency})
         return result
     return wrapped
@@ -40,7 +40,7 @@ def retry(coro):
                 result = await coro(*args, **kwargs)
             except (aiohttp.ClientProxyConnectionError, aiohttp.ServerConnectionError, aiohttp.ServerDisconnectedError,
                     aiohttp.ServerTimeoutError) as e:
-                logger.info(f'retry {args}, {kwargs} ::: -> {e}, {e.args}')
+                logger.info('retry %s, %s ::: -> %r', args, kwargs, e)
                 if n >= nretry - 1:
                     raise
             return result
@@ -110,6 +110,45 @@ class ProxyClient:
                 context.update({'content': content})
         return context
 
+    async def fetch(self, url: str, timeout: float = 10, max_bytes: int = 1 << 16) -> dict:
+        """one request without retry, timeout - seconds of whole request, body up to max_bytes
+        context = {'url', 'status_response', 'content'}
+        """
+        async with self._session.get(url=url, timeout=aiohttp.ClientTimeout(total=timeout)) as response:
+            content = await response.content.read(max_bytes)
+        return {'url': url, 'status_response': response.status, 'content': content}
+
+    async def download(self, url: str, max_bytes: int = 1 << 20, max_seconds: float = 10,
+                       chunk_size: int = 1 << 16) -> dict:
+        """read body of url until max_bytes or max_seconds - budget of throughput probe,
+        ttfb - seconds to first byte of body, throughput - bytes per second after first byte
+        context = {'url', 'status_response', 'ttfb', 'bytes', 'elapsed', 'throughput'}
+        """
+        timeout = aiohttp.ClientTimeout(sock_connect=max_seconds, sock_read=max_seconds)
+        received, ttfb = 0, None
+        t1 = time.perf_counter()
+        deadline = t1 + max_seconds
+        async with self._session.get(url=url, timeout=timeout) as response:
+            async for chunk in response.content.iter_chunked(chunk_size):
+                now = time.perf_counter()
+                if ttfb is None:
+                    ttfb = now - t1
+                received += len(chunk)
+                if received >= max_bytes or now >= deadline:
+                    break
+        elapsed = time.perf_counter() - t1
+        transfer = elapsed - ttfb if ttfb is not None else 0.0
+        if transfer < 0.001:
+            transfer = elapsed
+        return {
+            'url': url,
+            'status_response': response.status,
+            'ttfb': ttfb,
+            'bytes': received,
+            'elapsed': elapsed,
+            'throughput': received / transfer if received else 0.0,
+        }
+
     async def close(self) -> None:
         await self._session.close()
 
@@ -203,7 +242,23 @@ class Proxy:
                  date_update: Optional[datetime.datetime] = None,
                  date_creation: Optional[datetime.datetime] = None,
                  anonymous: Optional[bool] = None,
-                 in_process: Optional[bool] = None
+                 anonymity: Optional[str] = None,
+                 https: Optional[bool] = None,
+                 ttfb: Optional[float] = None,
+                 throughput: Optional[float] = None,
+                 health_bits: Optional[int] = None,
+                 health_latency: Optional[bytes] = None,
+                 health_checks: Optional[int] = None,
+                 health_score: Optional[float] = None,
+                 uptime: Optional[float] = None,
+                 latency_p90: Optional[float] = None,
+                 in_process: Optional[bool] = None,
+                 claimed_until: Optional[datetime.datetime] = None,
+                 claimed_by: Optional[str] = None,
+                 lane: Optional[str] = None,
+                 source: Optional[str] = None,
+                 location_ip: Optional[str] = None,
+                 country_code: Optional[str] = None
                  ):
         self.host = host
         self.port = int(port)
@@ -216,12 +271,33 @@ class Proxy:
         self.date_update = date_update
         self.date_creation = date_creation
         self.anonymous = anonymous
+        self.anonymity = anonymity  # transparent, anonymous, elite
+        self.https = https
+        self.ttfb = ttfb  # seconds to first byte of payload of judge
+        self.throughput = throughput  # bytes per second
+        # history of last checks of HealthStore
+        self.health_bits = health_bits
+        self.health_latency = health_latency
+        self.health_checks = health_checks
+        self.health_score = health_score
+        self.uptime = uptime
+        self.latency_p90 = latency_p90
         self.in_process = in_process
+        self.claimed_until = claimed_until
+        self.claimed_by = claimed_by
+        self.lane = lane  # lane of PriorityLaneQueue, not saved in db
+        self.source = source  # name of parser (DefaultParse.name)
+        # location saved with proxy: ip of location (location.ip), country_code of location
+        self.location_ip = location_ip
+        self.country_code = country_code
+        self.loaded: Optional[dict] = None  # as_dict of row of db, see changes
 
         ReferenceProxy.add(self)
 
     def _create_uri(self) -> str:
-        host_port = f'{self.host}:{self.port}'
+        # ipv6 host in brackets (RFC 3986)
+        host = f'[{self.host}]' if ':' in str(self.host) else self.host
+        host_port = f'{host}:{self.port}'
         if self.login and self.password:
             uri = f'{self.scheme}://{self.login}:{self.password}@{host_port}'
         else:
@@ -231,21 +307,50 @@ class Proxy:
     @classmethod
     def create_from_url(cls, url: str) -> 'Proxy':
         proxy_type, login, password, hostport = _parse_proxy(url)
-        if ':' in hostport:
-            host, port = hostport.split(':')
+        if hostport.startswith('['):
+            host, _, port = hostport[1:].partition(']')
+            kw = {'host': host, "port": port.lstrip(':')} if port else {'host': host}
+        elif ':' in hostport:
+            host, port = hostport.rsplit(':', 1)
             kw = {'host': host, "port": port}
         else:
             kw = {'host': hostport}
         self = cls(scheme=proxy_type, login=login, password=password, **kw)
         return self
 
+    def set_location(self, location: Optional[Location]) -> None:
+        self.location = location
+        if location is not None:
+            self.location_ip = location.ip
+            self.country_code = location.country_code
+
+    def location_is_actual(self) -> bool:
+        """location saved with proxy is of its host"""
+        return self.location_ip is not None and str(self.location_ip) == str(self.host)
+
+    @classmethod
+    def create_from_row(cls, row) -> 'Proxy':
+        """proxy of row of db, remembers loaded state"""
+        self = cls(**dict(row))
+        self.loaded = self.as_dict()
+        return self
+
+    def changes(self) -> dict:
+        """columns of as_dict changed since loaded from db, all if not loaded"""
+        context = self.as_dict()
+        if self.loaded is None:
+            return context
+        return {k: v for k, v in context.items() if k not in self.loaded or self.loaded[k] != v}
+
     @property
     def url(self) -> str:
         return self._create_uri()
 
     def as_dict(self) -> dict:
         keys = ('host', 'port', 'login', 'password', 'latency', 'is_alive', 'scheme', 'date_update', 'date_creation',
-                'anonymous', 'in_process', )
+                'anonymous', 'anonymity', 'https', 'ttfb', 'throughput', 'health_bits', 'health_latency', 'health_checks',
+                'health_score', 'uptime', 'latency_p90', 'source', 'location_ip', 'country_code', 'in_process',
+                'claimed_until', 'claimed_by', )
         context = {k: v for k, v in self.__dict__ .items() if k in keys}
         return context
 
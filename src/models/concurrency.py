@@ -0,0 +1,197 @@
+import asyncio
+from asyncio import create_task
+import collections
+import logging
+import time
+from typing import Deque, Optional
+
+try:
+    import resource
+except ImportError:  # windows
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+__all__ = ('LoopLagMonitor', 'AdaptiveConcurrency', 'default_fd_ceiling')
+
+
+def default_fd_ceiling(fds_per_task: int = 2, reserve: int = 128) -> Optional[int]:
+    """max tasks by soft limit of open files (RLIMIT_NOFILE), None if unknown"""
+    if resource is None:
+        return None
+    soft, _ = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft == resource.RLIM_INFINITY:
+        return None
+    return max((soft - reserve) // fds_per_task, 1)
+
+
+class LoopLagMonitor:
+    """Measure event loop lag: how late wakes up asyncio.sleep(interval)"""
+    interval: float
+    lag: float
+    max_lag: float
+    _instance_start: Optional[asyncio.Task] = None
+
+    def __init__(self, interval: float = 0.1, smoothing: float = 0.2):
+        self.interval = interval
+        self.smoothing = smoothing
+        self.lag = 0.0
+        self.max_lag = 0.0
+        self.samples = 0
+
+    async def start(self) -> None:
+        self._instance_start = create_task(self._start())
+
+    def stop(self) -> None:
+        if self._instance_start:
+            self._instance_start.cancel()
+
+    def reset_max(self) -> float:
+        """max lag since previous reset"""
+        max_lag, self.max_lag = self.max_lag, 0.0
+        return max_lag
+
+    async def _start(self) -> None:
+        while True:
+            t1 = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            lag = max(time.perf_counter() - t1 - self.interval, 0.0)
+            self.lag += self.smoothing * (lag - self.lag)
+            self.max_lag = max(self.max_lag, lag)
+            self.samples += 1
+
+
+class AdaptiveConcurrency:
+    """AIMD limit of in-flight tasks, drop-in replacement of asyncio.Semaphore (acquire/release).
+    Every interval:
+        error rate or loop lag too high     -> limit *= decrease
+        throughput fell while limit is used -> limit -= increase
+        limit used and throughput not fell  -> limit += increase
+    limit stays in [min_limit, min(max_limit, fd_ceiling)]
+
+    concurrency = AdaptiveConcurrency(initial=20, max_limit=1000)
+    await concurrency.start()
+    await concurrency.acquire()
+    ...
+    concurrency.record(ok=True)
+    concurrency.release()
+    """
+    limit: int
+    in_flight: int
+    history: Deque[dict]
+    _instance_start: Optional[asyncio.Task] = None
+
+    def __init__(self, initial: int = 20, min_limit: int = 5, max_limit: int = 1000, fd_ceiling: Optional[int] = None,
+                 interval: float = 5.0, increase: int = 5, decrease: float = 0.7, max_error_rate: float = 0.2,
+                 max_loop_lag: float = 0.1, tolerance: float = 0.1, history_size: int = 120,
+                 lag_monitor: Optional[LoopLagMonitor] = None):
+        fd_ceiling = fd_ceiling if fd_ceiling else default_fd_ceiling()
+        self.max_limit = min(max_limit, fd_ceiling) if fd_ceiling else max_limit
+        self.min_limit = min(min_limit, self.max_limit)
+        self.limit = max(min(initial, self.max_limit), self.min_limit)
+        self.interval = interval
+        self.increase = increase
+        self.decrease = decrease
+        self.max_error_rate = max_error_rate
+        self.max_loop_lag = max_loop_lag
+        self.tolerance = tolerance
+        self.lag_monitor = lag_monitor if lag_monitor else LoopLagMonitor()
+        self.history = collections.deque(maxlen=history_size)
+        self.in_flight = 0
+        self._released = asyncio.Event()
+        self._reset_window(time.monotonic())
+        self._last_throughput = 0.0
+
+    async def start(self) -> None:
+        if not self.lag_monitor._instance_start:
+            await self.lag_monitor.start()
+        self._instance_start = create_task(self._start())
+
+    def stop(self) -> None:
+        if self._instance_start:
+            self._instance_start.cancel()
+        self.lag_monitor.stop()
+
+    def locked(self) -> bool:
+        return self.in_flight >= self.limit
+
+    async def acquire(self) -> bool:
+        while self.locked():
+            self._released.clear()
+            await self._released.wait()
+        self.in_flight += 1
+        self._peak_in_flight = max(self._peak_in_flight, self.in_flight)
+        return True
+
+    def release(self) -> None:
+        self.in_flight -= 1
+        self._released.set()
+
+    def record(self, ok: bool = True) -> None:
+        """result of task, ok=False - error of checker (not dead proxy)"""
+        self._completed += 1
+        if not ok:
+            self._errors += 1
+
+    def adjust(self, now: Optional[float] = None) -> dict:
+        """recalculate limit by measures of the window since previous adjust"""
+        now = time.monotonic() if now is None else now
+        elapsed = max(now - self._window_start, 1e-6)
+        throughput = self._completed / elapsed
+        error_rate = self._errors / self._completed if self._completed else 0.0
+        loop_lag = max(self.lag_monitor.lag, self.lag_monitor.reset_max() / 2)
+        saturated = self._peak_in_flight >= self.limit
+        previous = self.limit
+        if error_rate > self.max_error_rate or loop_lag > self.max_loop_lag:
+            self.limit = int(self.limit * self.decrease)
+            action = 'decrease'
+        elif saturated and throughput < self._last_throughput * (1 - self.tolerance):
+            self.limit -= self.increase
+            action = 'back_off'
+        elif saturated:
+            self.limit += self.increase
+            action = 'increase'
+        else:
+            action = 'hold'
+        self.limit = max(min(self.limit, self.max_limit), self.min_limit)
+        if self.limit > previous:
+            self._released.set()
+        self._last_throughput = throughput
+        measure = {
+            'time': time.time(),
+            'limit': self.limit,
+            'previous_limit': previous,
+            'action': action,
+            'throughput': round(throughput, 3),
+            'error_rate': round(error_rate, 3),
+            'loop_lag': round(loop_lag, 4),
+            'in_flight': self.in_flight,
+        }
+        self.history.append(measure)
+        self._reset_window(now)
+        return measure
+
+    def stats(self) -> dict:
+        return {
+            'limit': self.limit,
+            'in_flight': self.in_flight,
+            'min_limit': self.min_limit,
+            'max_limit': self.max_limit,
+            'loop_lag': round(self.lag_monitor.lag, 4),
+        }
+
+    def _reset_window(self, now: float) -> None:
+        self._window_start = now
+        self._completed = 0
+        self._errors = 0
+        self._peak_in_flight = self.in_flight
+
+    async def _start(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                measure = self.adjust()
+                if measure['action'] != 'hold':
+                    logger.info(f'{self.__class__.__name__} {measure}')
+            except Exception as e:
+                logger.error(f'{self.__class__.__name__} {e}, {e.args}')
@@ -1,6 +1,6 @@
 from sqlalchemy import (
     Table, Text, Integer, VARCHAR, MetaData, Column, BOOLEAN, ForeignKey, DateTime, CheckConstraint, REAL,
-    UniqueConstraint, Float
+    UniqueConstraint, Float, LargeBinary
 )
 import sqlalchemy as sa
 from sqlalchemy.sql import func
@@ -27,7 +27,22 @@ proxy_table = Table(
     Column('latency', Float, nullable=True),
     Column('is_alive', BOOLEAN, nullable=True),
     Column('anonymous', BOOLEAN, nullable=True),
+    Column('anonymity', VARCHAR(16), nullable=True),
+    Column('https', BOOLEAN, nullable=True),
+    Column('ttfb', Float, nullable=True),
+    Column('throughput', Float, nullable=True),
+    Column('health_bits', Integer, nullable=True),
+    Column('health_latency', LargeBinary, nullable=True),
+    Column('health_checks', Integer, nullable=True),
+    Column('health_score', Float, nullable=True),
+    Column('uptime', Float, nullable=True),
+    Column('latency_p90', Float, nullable=True),
+    Column('source', VARCHAR, nullable=True),
+    Column('location_ip', INET, ForeignKey('location.ip', ondelete='SET NULL'), nullable=True),
+    Column('country_code', VARCHAR(8), nullable=True),
     Column('in_process', BOOLEAN, default=False),
+    Column('claimed_until', DateTime(timezone=False), nullable=True),
+    Column('claimed_by', VARCHAR, nullable=True),
     UniqueConstraint('host', 'port', name='unique_host_port'),
 )
 
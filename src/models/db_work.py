@@ -1,26 +1,78 @@
 import asyncio
+from asyncio import create_task
 import asyncpg
 import logging
 import datetime
-from typing import Optional
+import time
+from types import TracebackType
+from typing import Optional, Type
 # from .checker import BaseTaskHandler
 from .db import proxy_table, location_table
 from sqlalchemy import Table, select, update, and_, or_, delete, exists, text
 from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.dialects import postgresql
-import sys
 from . import Proxy
-if sys.version_info < (3, 7)[:2]:
-    from asyncio import ensure_future as create_task
-else:
-    from asyncio import create_task
+from .scheduler import RecheckScheduler
+from .health import HealthStore
+from .history import CheckHistory
+from .changes import ChangePublisher
+from .storage import (ProxyStorage, LocationStorage, ProxyListColumns, CredentialColumns,
+                      IndexColumns, IndexHistoryColumns, proxy_filters, proxy_sort, create_owner_id)
 
 logger = logging.getLogger(__name__)
 
-__all__ = ("TaskHandlerToDB", 'ProxyDb', 'LocationDb', 'StartProxyHandler')
-
-
-class LocationDb:
+__all__ = ("TaskHandlerToDB", 'ProxyDb', 'LocationDb', 'StartProxyHandler', 'LeaseKeeper', 'WriteStats',
+           'create_owner_id')
+
+
+# written after every check: release of claim, time of check, ring of HealthStore (not indexed)
+ScheduleColumns = frozenset(('date_update', 'in_process', 'claimed_by', 'claimed_until', 'health_bits',
+                             'health_latency', 'health_checks'))
+
+
+def value_size(value) -> int:
+    """approximate bytes of value in row"""
+    if value is None:
+        return 0
+    if isinstance(value, (str, bytes)):
+        return len(value)
+    if isinstance(value, bool):
+        return 1
+    return 8
+
+
+class WriteStats:
+    """updates of TaskHandlerToDB: unchanged - only ScheduleColumns written, narrowed - only changed columns,
+    bytes_saved - values of columns not sent compared to update of whole row, lost - results dropped as lease is lost
+    """
+
+    def __init__(self):
+        self.rows = 0
+        self.lost = 0
+        self.unchanged = 0
+        self.narrowed = 0
+        self.columns_saved = 0
+        self.bytes_written = 0
+        self.bytes_saved = 0
+
+    def add(self, row: dict, written: dict) -> None:
+        self.rows += 1
+        if ScheduleColumns.issuperset(written):
+            self.unchanged += 1
+        elif len(written) < len(row):
+            self.narrowed += 1
+        written_bytes = sum(value_size(value) for value in written.values())
+        self.bytes_written += written_bytes
+        self.bytes_saved += sum(value_size(value) for value in row.values()) - written_bytes
+        self.columns_saved += len(row) - len(written)
+
+    def as_dict(self) -> dict:
+        return {'rows': self.rows, 'unchanged': self.unchanged, 'narrowed': self.narrowed,
+                'columns_saved': self.columns_saved, 'bytes_written': self.bytes_written,
+                'bytes_saved': self.bytes_saved, 'lost': self.lost}
+
+
+class LocationDb(LocationStorage):
     _db: asyncpg.pool.Pool
     table_location: Table = location_table
 
@@ -59,17 +111,17 @@ class LocationDb:
             return res['exists']
 
 
-class ProxyDb:
+class ProxyDb(ProxyStorage):
+    """Postgres storage of proxies, see ProxyStorage"""
     _db: asyncpg.pool.Pool
     table_proxy: Table = location_table
-    delta_minutes_for_check: int
 
     def __init__(self, db_connect: asyncpg.pool.Pool, table_proxy: Optional[Table] = None,
-                 delta_minutes_for_check: int = 60):
+                 delta_minutes_for_check: int = 60, owner: Optional[str] = None, lease_seconds: int = 300):
+        super().__init__(delta_minutes_for_check=delta_minutes_for_check, owner=owner, lease_seconds=lease_seconds)
         self._db = db_connect
         if table_proxy is not None:
             self.table_proxy = table_proxy
-        self.delta_minutes_for_check = delta_minutes_for_check
 
     async def insert_proxy(self, **kwargs):
         """Insert proxy
@@ -114,27 +166,105 @@ class ProxyDb:
             res = await conn.execute(query)
         return res
 
+    async def update_claimed_proxy(self, **kwargs):
+        """UPDATE proxy SET ... WHERE host = :host AND port = :port AND claimed_by = :owner"""
+        host = kwargs.pop('host')
+        port = kwargs.pop('port')
+        async with self._db.acquire() as conn:
+            query = update(self.table_proxy).where(and_(
+                self.table_proxy.c.host == host,
+                self.table_proxy.c.port == port,
+                self.table_proxy.c.claimed_by == self.owner
+            )).values(**kwargs)
+            res = await conn.execute(query)
+        return res
+
+    def query_select_proxies(self, is_alive: Optional[bool] = True, scheme: Optional[str] = None,
+                             anonymity: Optional[str] = None, https: Optional[bool] = None,
+                             max_latency: Optional[float] = None, min_throughput: Optional[float] = None,
+                             country: Optional[str] = None, sort: str = '-health_score', limit: int = 100,
+                             offset: int = 0, credentials: bool = False):
+        """SELECT proxies by filters, sort - column of ProxySortKeys, '-column' - descending, NULLs last,
+        credentials - with login and password (gateway), not for api
+        """
+        column_name, descending = proxy_sort(sort)
+        c = self.table_proxy.c
+        conditions = [op(c[name], value) for name, op, value in proxy_filters(
+            is_alive=is_alive, scheme=scheme, anonymity=anonymity, https=https, max_latency=max_latency,
+            min_throughput=min_throughput, country=country)]
+        column = c[column_name]
+        order = column.desc().nullslast() if descending else column.asc().nullslast()
+        columns = ProxyListColumns + CredentialColumns if credentials else ProxyListColumns
+        query = select([c[name] for name in columns])
+        if conditions:
+            query = query.where(and_(*conditions))
+        return query.order_by(order).limit(limit).offset(offset)
+
+    async def select_proxies(self, **kwargs) -> list:
+        """filters of query_select_proxies"""
+        async with self._db.acquire() as conn:
+            res = await conn.fetch(self.query_select_proxies(**kwargs))
+        return res
+
+    def query_index_rows(self, updated_after: Optional[datetime.datetime] = None):
+        """state of ProxyIndex: columns of GET /proxies (IndexColumns),
+        updated_after - catch up of snapshot: rows checked later, with history of HealthStore
+        """
+        c = self.table_proxy.c
+        columns = IndexColumns + IndexHistoryColumns if updated_after is not None else IndexColumns
+        query = select([c[name] for name in columns])
+        if updated_after is not None:
+            query = query.where(c.date_update > updated_after)
+        return query
+
+    async def select_index_rows(self, updated_after: Optional[datetime.datetime] = None) -> list:
+        async with self._db.acquire() as conn:
+            res = await conn.fetch(self.query_index_rows(updated_after=updated_after))
+        return res
+
+    def query_geo_rows(self):
+        """proxies with coordinates of location saved on row, GeoIndex"""
+        c = self.table_proxy.c
+        return select([c.host, c.port, c.is_alive, c.latency, location_table.c.latitude, location_table.c.longitude]
+                      ).select_from(self.table_proxy.join(location_table, location_table.c.ip == c.location_ip))
+
+    async def select_geo_rows(self) -> list:
+        async with self._db.acquire() as conn:
+            res = await conn.fetch(self.query_geo_rows())
+        return res
+
+    def query_claim_new(self):
+        return select([self.table_proxy]).where(
+            and_(self.table_proxy.c.date_update == None, self.table_proxy.c.in_process == False)  # noqa
+        ).order_by(self.table_proxy.c.date_creation).limit(1).with_for_update(skip_locked=True)
+
+    def query_claim_due(self):
+        return select([self.table_proxy]).where(
+            and_(
+                self.table_proxy.c.date_update < self.due_before(),
+                self.table_proxy.c.in_process == False)  # noqa
+        ).order_by(self.table_proxy.c.date_update).limit(1).with_for_update(skip_locked=True)
+
     async def select_and_set_proxy_to_process(self):
         """
         BEGIN;
-        (SELECT * FROM proxy WHERE proxy.date_update IS NULL AND proxy.in_process = false) as q1
-        IF NOT EXIST q1 (SELECT * FROM proxy WHERE proxy.date_update < :date_update_1 AND proxy.in_process = false) as q2
+        (SELECT * FROM proxy WHERE proxy.date_update IS NULL AND proxy.in_process = false
+            ORDER BY date_creation LIMIT 1 FOR UPDATE SKIP LOCKED) as q1
+        IF NOT EXIST q1 (SELECT * FROM proxy WHERE proxy.date_update < :date_update_1 AND proxy.in_process = false
+            ORDER BY date_update LIMIT 1 FOR UPDATE SKIP LOCKED) as q2
         IF EXIST q1 OR q2(
-        UPDATE proxy SET in_process=:in_process WHERE proxy.host = :host_1 AND proxy.port = :port_1);
+        UPDATE proxy SET in_process=:in_process, claimed_by=:owner, claimed_until=:deadline
+            WHERE proxy.host = :host_1 AND proxy.port = :port_1);
         COMMIT;
+        q1 use index ix_proxy_claim_new, q2 - ix_proxy_claim_due (migrations/0002_proxy_claim_indexes.sql)
         :return:
         """
         async with self._db.acquire() as conn:
             async with conn.transaction():
-                query = select([self.table_proxy]).where(
-                    and_(self.table_proxy.c.date_update == None, self.table_proxy.c.in_process == False)) # noqa
+                query = self.query_claim_new()
                 res = await conn.fetchrow(query)
                 if not res:
-                    query = select([self.table_proxy]).where(
-                        and_(
-                            self.table_proxy.c.date_update < datetime.datetime.utcnow() - datetime.timedelta(
-                                minutes=self.delta_minutes_for_check),
-                            self.table_proxy.c.in_process == False)) # noqa
+                    query = self.query_claim_due()
                     res = await conn.fetchrow(query)
                 if res:
                     query_update = update(self.table_proxy).where(
@@ -142,21 +272,148 @@ class ProxyDb:
                             self.table_proxy.c.host == res['host'],
                             self.table_proxy.c.port == res['port']
                         )
-                    ).values({"in_process": True})
+                    ).values({"in_process": True, "claimed_by": self.owner, "claimed_until": self.lease_deadline()})
                     update_result = await conn.execute(query_update)
                     return res
         return res
 
+    async def select_schedule(self) -> list:
+        """SELECT host, port, date_update FROM proxy; for RecheckScheduler"""
+        async with self._db.acquire() as conn:
+            query = select([self.table_proxy.c.host, self.table_proxy.c.port, self.table_proxy.c.date_update])
+            res = await conn.fetch(query)
+        return res
+
+    async def claim_proxy(self, host: str, port: int):
+        """claim proxy from schedule, if it is not claimed and not checked by other worker
+        UPDATE proxy SET in_process=true, claimed_by=:owner, claimed_until=:deadline
+            WHERE host = :host AND port = :port AND in_process = false
+            AND (date_update IS NULL OR date_update < :date_update) RETURNING *
+        """
+        async with self._db.acquire() as conn:
+            query = update(self.table_proxy).where(and_(
+                self.table_proxy.c.host == host,
+                self.table_proxy.c.port == port,
+                self.table_proxy.c.in_process == False,  # noqa
+                or_(self.table_proxy.c.date_update == None,  # noqa
+                    self.table_proxy.c.date_update < self.due_before())
+            )).values(
+                {"in_process": True, "claimed_by": self.owner, "claimed_until": self.lease_deadline()}
+            ).returning(*self.table_proxy.c)
+            res = await conn.fetchrow(query)
+        return res
+
+    async def renew_lease(self, host: str, port: int) -> bool:
+        """extend lease of own claimed proxy, False if lease lost"""
+        async with self._db.acquire() as conn:
+            query = update(self.table_proxy).where(and_(
+                self.table_proxy.c.host == host,
+                self.table_proxy.c.port == port,
+                self.table_proxy.c.in_process == True,  # noqa
+                self.table_proxy.c.claimed_by == self.owner
+            )).values({"claimed_until": self.lease_deadline()})
+            res = await conn.execute(query)
+        return res == 'UPDATE 1'
+
+    async def release_expired_leases(self) -> str:
+        """UPDATE proxy SET in_process=false, claimed_by=NULL, claimed_until=NULL
+            WHERE in_process = true AND (claimed_until < now OR claimed_until IS NULL)
+        claimed_until IS NULL - claimed before leases
+        """
+        async with self._db.acquire() as conn:
+            query = update(self.table_proxy).where(and_(
+                self.table_proxy.c.in_process == True,  # noqa
+                or_(self.table_proxy.c.claimed_until < datetime.datetime.utcnow(),
+                    self.table_proxy.c.claimed_until == None)  # noqa
+            )).values({"in_process": False, "claimed_by": None, "claimed_until": None})
+            res = await conn.execute(query)
+        return res
+
+    async def release_owner_leases(self) -> str:
+        """release all proxies claimed by self.owner, use on shutdown"""
+        async with self._db.acquire() as conn:
+            query = update(self.table_proxy).where(and_(
+                self.table_proxy.c.in_process == True,  # noqa
+                self.table_proxy.c.claimed_by == self.owner
+            )).values({"in_process": False, "claimed_by": None, "claimed_until": None})
+            res = await conn.execute(query)
+        return res
+
+
+class LeaseKeeper:
+    """Renew lease of claimed proxy while check in progress
+    async with lease_keeper.hold(proxy):
+        await ProxyChecker.check(proxy)
+
+    Lease is not renewed while proxy waits in queues before and after check and in location lookup:
+    time from claim to write minus time of check must stay below lease_seconds,
+    else result of check is dropped (TaskHandlerToDB, write of claimed_by = owner only)
+    """
+    proxy_db: ProxyStorage
+    renew_interval: float
+
+    def __init__(self, proxy_db: ProxyStorage, renew_interval: Optional[float] = None):
+        self.proxy_db = proxy_db
+        self.renew_interval = renew_interval if renew_interval else proxy_db.lease_seconds / 3
+
+    def hold(self, proxy: Proxy) -> '_LeaseHold':
+        return _LeaseHold(keeper=self, proxy=proxy)
+
+    async def keep(self, proxy: Proxy) -> None:
+        while True:
+            await asyncio.sleep(self.renew_interval)
+            try:
+                renewed = await self.proxy_db.renew_lease(host=proxy.host, port=proxy.port)
+            except Exception as e:
+                logger.error('renew lease %s :: %r', proxy, e)
+                continue
+            if not renewed:
+                logger.warning('lease lost %s', proxy)
+                return
+
+
+class _LeaseHold:
+
+    def __init__(self, keeper: LeaseKeeper, proxy: Proxy):
+        self.keeper = keeper
+        self.proxy = proxy
+        self._task: Optional[asyncio.Task] = None
+
+    async def __aenter__(self) -> '_LeaseHold':
+        if self.proxy.in_process:
+            self._task = create_task(self.keeper.keep(self.proxy))
+        return self
+
+    async def __aexit__(self, exc_type: Optional[Type[BaseException]], exc_val: Optional[BaseException],
+                        exc_tb: Optional[TracebackType]) -> None:
+        if self._task:
+            self._task.cancel()
+
 
 class TaskHandlerToDB:
 
     incoming_queue: asyncio.Queue
-    proxy_db: ProxyDb
+    proxy_db: ProxyStorage
+    scheduler: Optional[RecheckScheduler]
+    health_store: Optional[HealthStore]
+    history: Optional[CheckHistory]
+    publisher: Optional[ChangePublisher]
     _instance_start: Optional[asyncio.Task]
 
-    def __init__(self, incoming_queue: asyncio.Queue, proxy_db: ProxyDb):
+    def __init__(self, incoming_queue: asyncio.Queue, proxy_db: ProxyStorage, scheduler: Optional[RecheckScheduler] = None,
+                 health_store: Optional[HealthStore] = None, history: Optional[CheckHistory] = None,
+                 publisher: Optional[ChangePublisher] = None):
+        """health_store - history of checks, saved with result of check,
+        history - append-only table of checks, written in batches,
+        publisher - NOTIFY of saved changes for ProxyIndex of instances
+        """
         self.incoming_queue = incoming_queue
         self.proxy_db = proxy_db
+        self.scheduler = scheduler
+        self.health_store = health_store
+        self.history = history
+        self.publisher = publisher
+        self.write_stats = WriteStats()
 
     async def start(self) -> None:
         self._instance_start = create_task(self._start())
@@ -167,28 +424,58 @@ class TaskHandlerToDB:
             proxy = await self.incoming_queue.get()
             self.incoming_queue.task_done()
             if not isinstance(proxy, Proxy):
-                logger.error(f'{proxy} -- not instance Proxy')
+                logger.error('%s -- not instance Proxy', proxy)
                 continue
             create_task(self.processing_task(proxy))
             await asyncio.sleep(0)
 
     async def processing_task(self, proxy: Proxy) -> None:
         """save db"""
+        claimed = bool(proxy.in_process)
         try:
+            if proxy.in_process and self.health_store is not None:
+                self.health_store.record(proxy)
             dict_proxy = proxy.as_dict()
             if dict_proxy.get('in_process', False):
                 proxy.in_process = False
-                dict_proxy.update({"in_process": False})
-                res = await self.proxy_db.update_proxy_pm(**dict_proxy)
-                logger.debug(f'{dict_proxy} ::: {res}')
+                proxy.claimed_by = proxy.claimed_until = None
+                dict_proxy.update({"in_process": False, "claimed_by": None, "claimed_until": None})
+                # only columns changed since claim, whole row if proxy is not loaded from db
+                changes = proxy.changes()
+                changes.pop('host', None), changes.pop('port', None)
+                changes.update({"in_process": False, "claimed_by": None, "claimed_until": None})
+                self.write_stats.add({k: v for k, v in dict_proxy.items() if k not in ('host', 'port')}, changes)
+                res = await self.proxy_db.update_claimed_proxy(host=proxy.host, port=proxy.port, **changes)
+                logger.debug('%s ::: %s', changes, res)
+                if res != 'UPDATE 1':
+                    # lease expired before write, row is released or claimed by other owner: result is stale
+                    self.write_stats.lost += 1
+                    logger.warning('lease lost %s, result of check dropped', proxy)
+                    return
+                if self.history is not None:
+                    self.history.add(proxy)
+                if self.publisher is not None and res == 'UPDATE 1' and not ScheduleColumns.issuperset(changes):
+                    self.publisher.add(proxy)
+                if self.scheduler is not None:
+                    self.scheduler.schedule_checked(proxy.host, proxy.port, proxy.date_update)
             else:
-                # db auto set date_creation
+                # db auto set date_creation, new proxy is not claimed (in_process NULL is never claimed)
                 dict_proxy.pop('date_creation')
+                dict_proxy['in_process'] = False
                 res = await self.proxy_db.insert_proxy(**dict_proxy)
-            logger.debug(f'{dict_proxy} ::: {res}')
+                if self.publisher is not None and res == 'INSERT 0 1':
+                    self.publisher.add(proxy)
+                if self.scheduler is not None and res == 'INSERT 0 1':
+                    if proxy.lane == 'user':
+                        self.scheduler.schedule_urgent(proxy.host, proxy.port)
+                    else:
+                        self.scheduler.schedule_checked(proxy.host, proxy.port, proxy.date_update)
+            logger.debug('%s ::: %s', dict_proxy, res)
         except Exception as e:
-            logger.error(f'{e} ::: {e.args}')
-            logger.exception(e)
+            logger.exception('save %s ::: %r', proxy, e)
+            if claimed and self.scheduler is not None:
+                # row stays claimed until lease expires and is released by release_expired_leases
+                self.scheduler.schedule(proxy.host, proxy.port, time.time() + self.proxy_db.lease_seconds)
             raise
 
     def is_running(self) -> bool:
@@ -202,48 +489,89 @@ class TaskHandlerToDB:
 
 
 class StartProxyHandler(TaskHandlerToDB):
-    proxy_db: ProxyDb
+    proxy_db: ProxyStorage
     outgoing_queue: asyncio.Queue
     max_tasks_semaphore: asyncio.Semaphore
     works = asyncio.Event()
-
-    def __init__(self, outgoing_queue: asyncio.Queue, proxy_db: ProxyDb, max_tasks: int = 20):
+    reap_interval: float
+    _last_reap: float = 0
+    scheduler: Optional[RecheckScheduler]
+
+    def __init__(self, outgoing_queue: asyncio.Queue, proxy_db: ProxyStorage, max_tasks: int = 20,
+                 reap_interval: float = 60, scheduler: Optional[RecheckScheduler] = None):
+        """with scheduler - wait due proxy in memory and claim it in db,
+        without - poll db for due proxy"""
         self.proxy_db = proxy_db
         self.outgoing_queue = outgoing_queue
         self.max_tasks_semaphore = asyncio.Semaphore(max_tasks)
+        self.reap_interval = reap_interval
+        self.scheduler = scheduler
+
+    async def reap_expired_leases(self) -> None:
+        """release leases of crashed workers and merge schedule of db, not often than reap_interval"""
+        if time.monotonic() - self._last_reap < self.reap_interval:
+            return
+        self._last_reap = time.monotonic()
+        res = await self.proxy_db.release_expired_leases()
+        logger.info('%s release expired leases :: %s', self.__class__.__name__, res)
+        if self.scheduler is not None:
+            added = await self.scheduler.merge(self.proxy_db)
+            logger.info('%s merged schedule :: %s', self.__class__.__name__, added)
 
     def pause(self):
         self.works.clear()
 
     async def _start(self) -> None:
-        logger.info(f'{self.__class__.__name__} starting')
+        logger.info('%s starting', self.__class__.__name__)
         self.works.set()
         while True:
             try:
                 await self.works.wait()
+                await self.reap_expired_leases()
                 proxy = await self.get_proxy()
                 if not proxy:
-                    await asyncio.sleep(1)
+                    if self.scheduler is None:
+                        await asyncio.sleep(1)
                     continue
-                print(proxy)
+                logger.debug('claimed %s', proxy)
                 proxy.in_process = True
             except Exception as e:
-                logger.error(f"{self.__class__.__name__} {e}, {e.args}")
-                logger.exception(e)
+                logger.exception('%s %r', self.__class__.__name__, e)
                 continue
             try:
                 await self.put_proxy_to_queue(proxy)
             except Exception as e:
-                logger.error(f"{self.__class__.__name__} {e}, {e.args}")
-                logger.exception(e)
+                logger.exception('%s %r', self.__class__.__name__, e)
             await asyncio.sleep(0)
 
     async def put_proxy_to_queue(self, proxy: Proxy) -> None:
         await self.outgoing_queue.put(proxy)
 
     async def get_proxy(self) -> Optional[Proxy]:
-        row = await self.proxy_db.select_and_set_proxy_to_process()
+        if self.scheduler is not None:
+            row = await self.claim_scheduled()
+        else:
+            row = await self.proxy_db.select_and_set_proxy_to_process()
         if not row:
             return
-        proxy = Proxy(**{k: v for k, v in row.items()})
+        proxy = Proxy.create_from_row(row)
         return proxy
+
+    async def claim_scheduled(self):
+        """wait due proxy from scheduler and claim it, if claim lost - reschedule from db state.
+        None after reap_interval without due proxy, for reap_expired_leases
+        """
+        try:
+            host, port = await asyncio.wait_for(self.scheduler.wait_due(), self.reap_interval)
+        except asyncio.TimeoutError:
+            return
+        row = await self.proxy_db.claim_proxy(host=host, port=port)
+        if row:
+            return row
+        row = await self.proxy_db.select_proxy_pm(host=host, port=port)
+        if not row:
+            logger.debug('%s:%s deleted, discard from schedule', host, port)
+        elif row['in_process']:
+            self.scheduler.schedule(host, port, time.time() + self.proxy_db.lease_seconds)
+        else:
+            self.scheduler.schedule_checked(host, port, row['date_update'])
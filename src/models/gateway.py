@@ -0,0 +1,615 @@
+import asyncio
+from asyncio import create_task
+import base64
+import ipaddress
+import logging
+import random
+import socket
+import struct
+import time
+from typing import Dict, List, Optional, Set, Tuple
+from urllib.parse import urlsplit
+from .client import Proxy
+from .health import HealthStore, proxy_key
+
+logger = logging.getLogger(__name__)
+
+__all__ = ('ProxyGateway', 'GatewayProxyPool', 'UpstreamPool', 'UpstreamError', 'open_tunnel')
+
+HeadLimit = 1 << 16
+# status of upstream proxy, request without body is retried on other proxy
+RetryStatus = (502, 503, 504)
+# headers of client connection, not forwarded: keep-alive of upstream is decided by gateway
+HopHeaders = (b'proxy-connection', b'proxy-authorization', b'connection', b'keep-alive', b'expect')
+
+
+class UpstreamError(Exception):
+    """upstream proxy refused or failed connect"""
+
+
+def _auth(proxy: Proxy) -> bytes:
+    if proxy.login and proxy.password:
+        token = base64.b64encode(f'{proxy.login}:{proxy.password}'.encode()).decode()
+        return f'Proxy-Authorization: Basic {token}\r\n'.encode()
+    return b''
+
+
+async def _read_head(reader: asyncio.StreamReader) -> bytes:
+    try:
+        return await reader.readuntil(b'\r\n\r\n')
+    except asyncio.LimitOverrunError:
+        raise UpstreamError('head too long')
+    except asyncio.IncompleteReadError as e:
+        raise UpstreamError(f'closed after {len(e.partial)} bytes')
+
+
+def _parse_head(head: bytes) -> Tuple[str, List[bytes]]:
+    """first line and header lines of head of request / response"""
+    first, *lines = head.rstrip(b'\r\n').split(b'\r\n')
+    return first.decode('latin-1'), [line for line in lines if line]
+
+
+def _header(lines: List[bytes], name: bytes) -> Optional[bytes]:
+    for line in lines:
+        key, _, value = line.partition(b':')
+        if key.strip().lower() == name:
+            return value.strip()
+    return None
+
+
+def _framing(lines: List[bytes]) -> Tuple[bool, Optional[int]]:
+    """chunked, content length of body"""
+    if b'chunked' in (_header(lines, b'transfer-encoding') or b'').lower():
+        return True, None
+    length = _header(lines, b'content-length')
+    return False, int(length) if length is not None else None
+
+
+def _keep_alive(version: str, lines: List[bytes]) -> bool:
+    connection = (_header(lines, b'connection') or b'').lower()
+    if version == 'HTTP/1.0':
+        return b'keep-alive' in connection
+    return b'close' not in connection
+
+
+async def _copy(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, size: Optional[int] = None,
+                chunk_size: int = 1 << 16) -> None:
+    """size bytes of reader to writer, till eof if size is None"""
+    while size is None or size > 0:
+        data = await reader.read(chunk_size if size is None else min(size, chunk_size))
+        if not data:
+            if size is None:
+                return
+            raise asyncio.IncompleteReadError(b'', size)
+        writer.write(data)
+        await writer.drain()
+        if size is not None:
+            size -= len(data)
+
+
+async def _copy_chunked(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    """chunked body with trailers"""
+    while True:
+        line = await reader.readuntil(b'\r\n')
+        writer.write(line)
+        size = int(line.split(b';', 1)[0].strip(), 16)
+        if size == 0:
+            break
+        await _copy(reader, writer, size + 2)
+    while line != b'\r\n':
+        line = await reader.readuntil(b'\r\n')
+        writer.write(line)
+    await writer.drain()
+
+
+async def _copy_body(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, chunked: bool,
+                     length: Optional[int]) -> None:
+    if chunked:
+        await _copy_chunked(reader, writer)
+    elif length:
+        await _copy(reader, writer, length)
+
+
+async def _http_connect(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, proxy: Proxy,
+                        host: str, port: int) -> None:
+    target = f'[{host}]:{port}' if ':' in host else f'{host}:{port}'
+    writer.write(f'CONNECT {target} HTTP/1.1\r\nHost: {target}\r\n'.encode() + _auth(proxy) + b'\r\n')
+    head = await _read_head(reader)
+    status_line = head.split(b'\r\n', 1)[0]
+    if status_line.split(b' ', 2)[1:2] != [b'200']:
+        raise UpstreamError(f'CONNECT {status_line!r}')
+
+
+async def _socks5_connect(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, proxy: Proxy,
+                          host: str, port: int) -> None:
+    methods = b'\x00\x02' if proxy.login else b'\x00'
+    writer.write(b'\x05' + bytes([len(methods)]) + methods)
+    version, method = await reader.readexactly(2)
+    if method == 0x02:
+        login, password = (proxy.login or '').encode(), (proxy.password or '').encode()
+        writer.write(b'\x01' + bytes([len(login)]) + login + bytes([len(password)]) + password)
+        if (await reader.readexactly(2))[1] != 0:
+            raise UpstreamError('socks5 auth failed')
+    elif method != 0x00:
+        raise UpstreamError(f'socks5 method {method}')
+    writer.write(b'\x05\x01\x00' + socks5_address(host) + struct.pack('!H', port))
+    reply = await reader.readexactly(4)
+    if reply[1] != 0:
+        raise UpstreamError(f'socks5 reply {reply[1]}')
+    await read_socks5_address(reader, reply[3])
+
+
+async def _socks4_connect(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, proxy: Proxy,
+                          host: str, port: int) -> None:
+    try:
+        address = ipaddress.IPv4Address(host).packed
+        domain = b''
+    except ValueError:
+        address, domain = b'\x00\x00\x00\x01', host.encode() + b'\x00'  # socks4a
+    writer.write(b'\x04\x01' + struct.pack('!H', port) + address + (proxy.login or '').encode() + b'\x00' + domain)
+    reply = await reader.readexactly(8)
+    if reply[1] != 0x5A:
+        raise UpstreamError(f'socks4 reply {reply[1]}')
+
+
+Handshakes = {'http': _http_connect, 'https': _http_connect, 'socks5': _socks5_connect, 'socks5h': _socks5_connect,
+              'socks4': _socks4_connect}
+
+
+def socks5_address(host: str) -> bytes:
+    try:
+        ip = ipaddress.ip_address(host)
+    except ValueError:
+        return b'\x03' + bytes([len(host.encode())]) + host.encode()
+    return (b'\x01' if ip.version == 4 else b'\x04') + ip.packed
+
+
+async def read_socks5_address(reader: asyncio.StreamReader, address_type: int) -> Tuple[str, int]:
+    """address and port of socks5 request / reply"""
+    if address_type == 0x01:
+        host = str(ipaddress.IPv4Address(await reader.readexactly(4)))
+    elif address_type == 0x04:
+        host = str(ipaddress.IPv6Address(await reader.readexactly(16)))
+    elif address_type == 0x03:
+        host = (await reader.readexactly((await reader.readexactly(1))[0])).decode()
+    else:
+        raise UpstreamError(f'socks5 address type {address_type}')
+    port, = struct.unpack('!H', await reader.readexactly(2))
+    return host, port
+
+
+async def open_tunnel(proxy: Proxy, host: str, port: int,
+                      timeout: float = 10) -> Tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+    """connection to host:port through proxy (http CONNECT, socks4, socks5)"""
+    handshake = Handshakes.get(proxy.scheme)
+    if handshake is None:
+        raise UpstreamError(f'scheme {proxy.scheme} is not supported')
+    reader, writer = await asyncio.wait_for(asyncio.open_connection(proxy.host, proxy.port), timeout)
+    try:
+        await asyncio.wait_for(handshake(reader, writer, proxy, host, port), timeout)
+    except BaseException:
+        writer.close()
+        raise
+    return reader, writer
+
+
+async def _pipe(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, chunk_size: int = 1 << 16) -> None:
+    try:
+        while True:
+            data = await reader.read(chunk_size)
+            if not data:
+                break
+            writer.write(data)
+            await writer.drain()
+    except (ConnectionError, asyncio.CancelledError):
+        pass
+    finally:
+        try:
+            writer.close()
+        except RuntimeError:
+            pass
+
+
+class UpstreamPool:
+    """Idle keep-alive upstream connections of gateway (proxy, destination): request to destination takes
+    connection of any usable proxy, at most max_idle per destination, closed after idle_timeout seconds
+    """
+    _idle: Dict[Tuple[str, int], List[Tuple[Proxy, asyncio.StreamReader, asyncio.StreamWriter, float]]]
+
+    def __init__(self, max_idle: int = 8, idle_timeout: float = 30):
+        self.max_idle = max_idle
+        self.idle_timeout = idle_timeout
+        self._idle = {}
+        self._pruned = time.monotonic()
+
+    def __len__(self) -> int:
+        return sum(len(idle) for idle in self._idle.values())
+
+    def take(self, host: str, port: int,
+             usable=None) -> Optional[Tuple[Proxy, asyncio.StreamReader, asyncio.StreamWriter]]:
+        """last idle connection to host:port, usable(proxy) - proxy is not cooling down"""
+        idle = self._idle.get((host, port))
+        now = time.monotonic()
+        while idle:
+            proxy, reader, writer, since = idle.pop()
+            if now - since < self.idle_timeout and not reader.at_eof() and not writer.is_closing() \
+                    and (usable is None or usable(proxy)):
+                return proxy, reader, writer
+            writer.close()
+        self._idle.pop((host, port), None)
+        return None
+
+    def put(self, proxy: Proxy, host: str, port: int, reader: asyncio.StreamReader,
+            writer: asyncio.StreamWriter) -> None:
+        now = time.monotonic()
+        if now - self._pruned > self.idle_timeout:
+            self.prune(now)
+        idle = self._idle.setdefault((host, port), [])
+        if len(idle) >= self.max_idle:
+            writer.close()
+            return
+        idle.append((proxy, reader, writer, now))
+
+    def prune(self, now: float) -> None:
+        """close connections idle longer than idle_timeout"""
+        self._pruned = now
+        for key, idle in list(self._idle.items()):
+            for proxy, reader, writer, since in idle:
+                if now - since >= self.idle_timeout:
+                    writer.close()
+            idle[:] = [item for item in idle if now - item[3] < self.idle_timeout]
+            if not idle:
+                del self._idle[key]
+
+    def close(self) -> None:
+        for idle in self._idle.values():
+            for proxy, reader, writer, since in idle:
+                writer.close()
+        self._idle.clear()
+
+
+class GatewayProxyPool:
+    """Checked alive proxies for gateway, refreshed from ProxyDb by -health_score.
+    pick - two random usable proxies, better score (HealthStore) of two; failed proxy cools down cooldown seconds.
+    Outcomes of gateway connects are added to HealthStore and rank proxies till next check.
+    """
+    proxies: List[Proxy]
+    _cooldown: Dict[int, float]
+    _instance_start: Optional[asyncio.Task] = None
+
+    def __init__(self, proxy_db=None, health_store: Optional[HealthStore] = None, proxies: Optional[List[Proxy]] = None,
+                 size: int = 500, refresh_interval: float = 60, cooldown: float = 30,
+                 schemes: Tuple[str, ...] = tuple(Handshakes)):
+        self.proxy_db = proxy_db
+        self.health_store = health_store if health_store is not None else HealthStore()
+        self.proxies = list(proxies) if proxies else []
+        self.size = size
+        self.refresh_interval = refresh_interval
+        self.cooldown = cooldown
+        self.schemes = schemes
+        self._cooldown = {}
+
+    async def refresh(self) -> int:
+        rows = await self.proxy_db.select_proxies(is_alive=True, sort='-health_score', limit=self.size,
+                                                  credentials=True)
+        proxies = []
+        for row in rows:
+            row = dict(row)
+            row['host'] = str(row['host'])
+            if row.get('scheme') in self.schemes:
+                proxies.append(Proxy(**row))
+        self.proxies = proxies
+        return len(proxies)
+
+    def score(self, proxy: Proxy) -> float:
+        score = self.health_store.get_score(proxy_key(proxy.host, proxy.port))
+        if score is None:
+            score = proxy.health_score if proxy.health_score is not None else 0.5
+        return score
+
+    def usable(self, proxy: Proxy) -> bool:
+        """proxy is not cooling down after failure"""
+        return self._cooldown.get(proxy_key(proxy.host, proxy.port), 0) <= time.monotonic()
+
+    def pick(self, exclude: Set[Tuple[str, int]] = frozenset()) -> Optional[Proxy]:
+        now = time.monotonic()
+        candidates = [proxy for proxy in self.proxies if (proxy.host, proxy.port) not in exclude
+                      and self._cooldown.get(proxy_key(proxy.host, proxy.port), 0) <= now]
+        if not candidates:
+            return None
+        if len(candidates) == 1:
+            return candidates[0]
+        first, second = random.sample(candidates, 2)
+        return first if self.score(first) >= self.score(second) else second
+
+    def report(self, proxy: Proxy, ok: bool, latency: Optional[float] = None) -> None:
+        key = proxy_key(proxy.host, proxy.port)
+        if key not in self.health_store:
+            self.health_store.load(key, proxy.health_bits, proxy.health_latency, proxy.health_checks)
+        self.health_store.add(key, ok=ok, latency=latency)
+        if ok:
+            self._cooldown.pop(key, None)
+        else:
+            self._cooldown[key] = time.monotonic() + self.cooldown
+
+    async def start(self) -> None:
+        if self.proxy_db is not None:
+            await self.refresh()
+            self._instance_start = create_task(self._start())
+
+    def stop(self) -> None:
+        if self._instance_start:
+            self._instance_start.cancel()
+
+    async def _start(self) -> None:
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.error(f'gateway pool refresh :: {e}, {e.args}')
+
+
+class ProxyGateway:
+    """Local forward proxy in front of pool: HTTP (absolute-form requests), CONNECT and optional SOCKS5 (no auth).
+    CONNECT and SOCKS5 tunnels go through proxy of GatewayProxyPool for life of client connection.
+    HTTP requests are forwarded one by one (keep-alive of client): each request goes to idle upstream connection
+    of its destination (UpstreamPool) or through proxy of pool, upstream is kept for next request if response
+    has framed body. Failed connect to upstream (or 502/503/504 of upstream for request without body)
+    is retried on other proxy up to max_attempts.
+
+    gateway = ProxyGateway(pool, host='127.0.0.1', port=8899, socks5=True)
+    await gateway.start()
+    # curl -x http://127.0.0.1:8899 http://example.com
+    """
+    pool: GatewayProxyPool
+    _server: Optional[asyncio.AbstractServer] = None
+
+    def __init__(self, pool: GatewayProxyPool, host: str = '127.0.0.1', port: int = 8899, socks5: bool = False,
+                 max_attempts: int = 3, connect_timeout: float = 10, keepalive_timeout: float = 30,
+                 max_idle: int = 8):
+        """keepalive_timeout - seconds of idle client and upstream connections between requests,
+        max_idle - idle upstream connections per destination
+        """
+        self.pool = pool
+        self.host = host
+        self.port = port
+        self.socks5 = socks5
+        self.max_attempts = max_attempts
+        self.connect_timeout = connect_timeout
+        self.keepalive_timeout = keepalive_timeout
+        self.upstreams = UpstreamPool(max_idle=max_idle, idle_timeout=keepalive_timeout)
+        self.stats = {'connections': 0, 'ok': 0, 'failed': 0, 'retries': 0, 'reused': 0}
+
+    async def start(self) -> None:
+        await self.pool.start()
+        self._server = await asyncio.start_server(self.handle_client, host=self.host, port=self.port,
+                                                  limit=HeadLimit)
+        if not self.port:
+            self.port = self._server.sockets[0].getsockname()[1]
+        logger.info(f'gateway listen {self.host}:{self.port}')
+
+    async def stop(self) -> None:
+        self.pool.stop()
+        self.upstreams.close()
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+
+    async def handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.stats['connections'] += 1
+        try:
+            first = await reader.readexactly(1)
+            if first == b'\x05':
+                if not self.socks5:
+                    return
+                await self.handle_socks5(reader, writer)
+            else:
+                await self.handle_http(first + await reader.readuntil(b'\r\n\r\n'), reader, writer)
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, asyncio.TimeoutError, ConnectionError,
+                UnicodeDecodeError, ValueError, UpstreamError) as e:
+            logger.debug('gateway client :: %s %s', e.__class__.__name__, e)
+        finally:
+            writer.close()
+
+    async def handle_http(self, head: bytes, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """requests of client connection one by one till CONNECT (tunnel) or end of keep-alive"""
+        while True:
+            if head.startswith(b'CONNECT '):
+                await self.handle_connect(head, reader, writer)
+                return
+            if not await self.handle_request(head, reader, writer):
+                return
+            try:
+                head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), self.keepalive_timeout)
+            except (asyncio.TimeoutError, asyncio.IncompleteReadError):
+                return
+
+    async def handle_connect(self, head: bytes, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        request_line, _ = _parse_head(head)
+        method, target, version = request_line.split(' ', 2)
+        host, _, port = target.rpartition(':')
+        upstream = await self.connect(host.strip('[]'), int(port))
+        if upstream is None:
+            writer.write(b'HTTP/1.1 502 Bad Gateway\r\nContent-Length: 0\r\n\r\n')
+            return
+        writer.write(b'HTTP/1.1 200 Connection established\r\n\r\n')
+        await self.relay(reader, writer, *upstream)
+
+    async def handle_request(self, head: bytes, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> bool:
+        """forward absolute-form request and its response, True - client connection is kept for next request"""
+        request_line, lines = _parse_head(head)
+        method, target, version = request_line.split(' ', 2)
+        url = urlsplit(target)
+        if url.scheme != 'http' or not url.hostname:
+            writer.write(b'HTTP/1.1 400 Bad Request\r\nContent-Length: 0\r\n\r\n')
+            return False
+        chunked, length = _framing(lines)
+        body = (chunked, length) if chunked or length else None
+        if body is not None and (_header(lines, b'expect') or b'').lower() == b'100-continue':
+            # body is read from client before response of upstream
+            writer.write(b'HTTP/1.1 100 Continue\r\n\r\n')
+        headers = b''.join(line + b'\r\n' for line in lines if line.split(b':', 1)[0].strip().lower() not in HopHeaders)
+        upstream = await self.forward(method, url, version, headers, reader, body)
+        if upstream is None:
+            writer.write(b'HTTP/1.1 502 Bad Gateway\r\nContent-Length: 0\r\n\r\n')
+            return False
+        proxy, upstream_reader, upstream_writer, response_head = upstream
+        keep_upstream = framed = False
+        try:
+            status_line, response_lines = _parse_head(response_head)
+            response_version, status = status_line.split(' ', 2)[:2]
+            # interim responses (100 Continue, 103 Early Hints) before final one
+            while status.startswith('1'):
+                writer.write(response_head)
+                response_head = await asyncio.wait_for(_read_head(upstream_reader), self.connect_timeout)
+                status_line, response_lines = _parse_head(response_head)
+                response_version, status = status_line.split(' ', 2)[:2]
+            writer.write(response_head)
+            chunked, length = _framing(response_lines)
+            if method == 'HEAD' or status in ('204', '304'):
+                framed = True
+            elif chunked or length is not None:
+                await _copy_body(upstream_reader, writer, chunked, length)
+                framed = True
+            else:
+                # body till close of upstream connection
+                await _copy(upstream_reader, writer)
+            await writer.drain()
+            keep_upstream = framed and _keep_alive(response_version, response_lines)
+        finally:
+            if keep_upstream:
+                self.upstreams.put(proxy, url.hostname, url.port or 80, upstream_reader, upstream_writer)
+            else:
+                upstream_writer.close()
+        return framed and _keep_alive(version, lines)
+
+    async def handle_socks5(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        methods = await reader.readexactly((await reader.readexactly(1))[0])
+        if 0x00 not in methods:
+            writer.write(b'\x05\xff')
+            return
+        writer.write(b'\x05\x00')
+        version, command, _, address_type = await reader.readexactly(4)
+        try:
+            host, port = await read_socks5_address(reader, address_type)
+        except UpstreamError:
+            writer.write(b'\x05\x08\x00\x01' + bytes(6))
+            return
+        if command != 0x01:
+            writer.write(b'\x05\x07\x00\x01' + bytes(6))
+            return
+        upstream = await self.connect(host, port)
+        if upstream is None:
+            writer.write(b'\x05\x05\x00\x01' + bytes(6))
+            return
+        writer.write(b'\x05\x00\x00\x01' + bytes(6))
+        await self.relay(reader, writer, *upstream)
+
+    async def connect(self, host: str, port: int) -> Optional[Tuple[asyncio.StreamReader, asyncio.StreamWriter]]:
+        """tunnel to host:port through pool, retry on other proxy"""
+        tried = set()
+        for attempt in range(self.max_attempts):
+            proxy = self.pool.pick(exclude=tried)
+            if proxy is None:
+                break
+            tried.add((proxy.host, proxy.port))
+            if attempt:
+                self.stats['retries'] += 1
+            t1 = time.perf_counter()
+            try:
+                upstream = await open_tunnel(proxy, host, port, timeout=self.connect_timeout)
+            except (UpstreamError, OSError, asyncio.TimeoutError, asyncio.IncompleteReadError) as e:
+                logger.debug('gateway %s -> %s:%s :: %s %s', proxy, host, port, e.__class__.__name__, e)
+                self.pool.report(proxy, ok=False)
+                continue
+            self.pool.report(proxy, ok=True, latency=time.perf_counter() - t1)
+            self.stats['ok'] += 1
+            return upstream
+        self.stats['failed'] += 1
+        return None
+
+    @staticmethod
+    def request_head(proxy: Proxy, method: str, url, version: str, headers: bytes) -> bytes:
+        """absolute-form request to http proxy, origin-form to destination through socks tunnel"""
+        if proxy.scheme in ('http', 'https'):
+            return f'{method} {url.geturl()} {version}\r\n'.encode() + _auth(proxy) + headers + b'\r\n'
+        path = url.path or '/'
+        if url.query:
+            path = f'{path}?{url.query}'
+        return f'{method} {path} {version}\r\n'.encode() + headers + b'\r\n'
+
+    async def exchange(self, proxy: Proxy, upstream_reader: asyncio.StreamReader,
+                       upstream_writer: asyncio.StreamWriter, method: str, url, version: str, headers: bytes,
+                       client_reader: asyncio.StreamReader, body: Optional[Tuple[bool, Optional[int]]]) -> bytes:
+        """send request (body streamed from client), return head of response"""
+        upstream_writer.write(self.request_head(proxy, method, url, version, headers))
+        if body is not None:
+            await _copy_body(client_reader, upstream_writer, *body)
+        return await asyncio.wait_for(_read_head(upstream_reader), self.connect_timeout)
+
+    async def forward(self, method: str, url, version: str, headers: bytes, client_reader: asyncio.StreamReader,
+                      body: Optional[Tuple[bool, Optional[int]]] = None
+                      ) -> Optional[Tuple[Proxy, asyncio.StreamReader, asyncio.StreamWriter, bytes]]:
+        """send request through idle upstream of destination or proxy of pool, return proxy, upstream and head
+        of response. body - (chunked, length) of request, request with body is not retried
+        """
+        port = url.port or 80
+        idle = self.upstreams.take(url.hostname, port, usable=self.pool.usable) if body is None else None
+        if idle is not None:
+            proxy, upstream_reader, upstream_writer = idle
+            try:
+                response_head = await self.exchange(proxy, upstream_reader, upstream_writer, method, url, version,
+                                                    headers, client_reader, body)
+            except (UpstreamError, OSError, asyncio.TimeoutError) as e:
+                # closed by upstream while idle, new connection
+                logger.debug('gateway idle %s -> %s :: %s %s', proxy, url.geturl(), e.__class__.__name__, e)
+                upstream_writer.close()
+            else:
+                self.stats['reused'] += 1
+                return proxy, upstream_reader, upstream_writer, response_head
+        tried = set()
+        for attempt in range(self.max_attempts):
+            proxy = self.pool.pick(exclude=tried)
+            if proxy is None:
+                break
+            tried.add((proxy.host, proxy.port))
+            if attempt:
+                self.stats['retries'] += 1
+            t1 = time.perf_counter()
+            upstream_writer = None
+            try:
+                if proxy.scheme in ('http', 'https'):
+                    upstream_reader, upstream_writer = await asyncio.wait_for(
+                        asyncio.open_connection(proxy.host, proxy.port), self.connect_timeout)
+                else:
+                    upstream_reader, upstream_writer = await open_tunnel(proxy, url.hostname, port,
+                                                                         timeout=self.connect_timeout)
+                response_head = await self.exchange(proxy, upstream_reader, upstream_writer, method, url, version,
+                                                    headers, client_reader, body)
+                status = response_head.split(b' ', 2)[1:2]
+                if status and int(status[0]) in RetryStatus and body is None and attempt + 1 < self.max_attempts:
+                    raise UpstreamError(f'status {status[0]!r}')
+            except (UpstreamError, OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError) as e:
+                logger.debug('gateway %s -> %s :: %s %s', proxy, url.geturl(), e.__class__.__name__, e)
+                if upstream_writer is not None:
+                    upstream_writer.close()
+                self.pool.report(proxy, ok=False)
+                if body is not None and upstream_writer is not None:
+                    # body is sent (or partly read from client), request can not be repeated
+                    break
+                continue
+            self.pool.report(proxy, ok=True, latency=time.perf_counter() - t1)
+            self.stats['ok'] += 1
+            return proxy, upstream_reader, upstream_writer, response_head
+        self.stats['failed'] += 1
+        return None
+
+    @staticmethod
+    async def relay(client_reader: asyncio.StreamReader, client_writer: asyncio.StreamWriter,
+                    upstream_reader: asyncio.StreamReader, upstream_writer: asyncio.StreamWriter) -> None:
+        sock = client_writer.get_extra_info('socket')
+        if sock is not None:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        await asyncio.gather(_pipe(client_reader, upstream_writer), _pipe(upstream_reader, client_writer))
+
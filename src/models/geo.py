@@ -0,0 +1,229 @@
+import asyncio
+from asyncio import create_task
+import heapq
+import logging
+import math
+from typing import Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+__all__ = ('GeoIndex', 'haversine_km')
+
+EarthRadiusKm = 6371.0088
+
+
+def haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EarthRadiusKm * math.asin(min(1.0, math.sqrt(a)))
+
+
+def _half_chord(distance_km: float) -> float:
+    """haversine term of distance: sin^2(d / 2R), same order as distance"""
+    return math.sin(min(distance_km / (2 * EarthRadiusKm), math.pi / 2)) ** 2
+
+
+class GeoPoint:
+    __slots__ = ('lat', 'lon', 'latency', 'alive', 'cell', 'phi', 'lam', 'cos_phi')
+
+    def __init__(self, lat: float, lon: float, latency: Optional[float], alive: bool, cell: Tuple[int, int]):
+        self.lat = lat
+        self.lon = lon
+        self.latency = latency
+        self.alive = alive
+        self.cell = cell
+        # radians for nearest
+        self.phi = math.radians(lat)
+        self.lam = math.radians(lon)
+        self.cos_phi = math.cos(self.phi)
+
+
+class GeoIndex:
+    """Grid of cell_degrees x cell_degrees cells of alive proxies for k nearest by coordinates.
+    Coordinates of dead proxies are kept (not in cells), proxy is back in cell when alive again.
+    nearest searches rings of cells around point until k-th distance is less than distance
+    to any cell out of searched square (bound by latitude and by meridian), see benchmarks/geo_index_bench.py
+
+    geo_index.update('1.1.1.1', 8080, alive=True, latency=0.3, lat=52.5, lon=13.4)
+    geo_index.nearest(lat=52.0, lon=13.0, k=10)
+    """
+    cell_degrees: float
+    _points: Dict[Tuple[str, int], GeoPoint]
+    _cells: Dict[Tuple[int, int], Dict[Tuple[str, int], GeoPoint]]
+    _instance_start: Optional[asyncio.Task] = None
+
+    def __init__(self, cell_degrees: float = 1.0, proxy_db=None, refresh_interval: float = 300):
+        """proxy_db - source of load (select_geo_rows), refresh_interval - seconds of reload,
+        results of checks of other instances
+        """
+        if not 0 < cell_degrees <= 90 or not (180 / cell_degrees).is_integer():
+            raise ValueError('cell_degrees must be 0..90 and divide 180')
+        self.cell_degrees = cell_degrees
+        self.proxy_db = proxy_db
+        self.refresh_interval = refresh_interval
+        self._columns = int(360 / cell_degrees)
+        self._rows = int(180 / cell_degrees)
+        self._points = {}
+        self._cells = {}
+        self.alive = 0
+
+    def __len__(self) -> int:
+        return self.alive
+
+    def __contains__(self, key: Tuple[str, int]) -> bool:
+        return key in self._points
+
+    def cell(self, lat: float, lon: float) -> Tuple[int, int]:
+        row = min(self._rows - 1, max(0, int((lat + 90) // self.cell_degrees)))
+        column = int(((lon + 180) % 360) // self.cell_degrees) % self._columns
+        return row, column
+
+    def update(self, host: str, port: int, alive: Optional[bool], latency: Optional[float] = None,
+               lat: Optional[float] = None, lon: Optional[float] = None) -> None:
+        """result of check, coordinates of location if known"""
+        key = (host, port)
+        point = self._points.get(key)
+        if lat is not None and lon is not None:
+            if point is not None and (point.lat, point.lon) != (lat, lon):
+                self._remove(key, point)
+                point = None
+            if point is None:
+                point = self._points[key] = GeoPoint(lat, lon, latency, False, self.cell(lat, lon))
+        if point is None:
+            return
+        point.latency = latency
+        if alive and not point.alive:
+            self._cells.setdefault(point.cell, {})[key] = point
+            self.alive += 1
+        elif not alive and point.alive:
+            self._remove(key, point)
+            self._points[key] = point
+        point.alive = bool(alive)
+
+    def _remove(self, key: Tuple[str, int], point: GeoPoint) -> None:
+        if point.alive:
+            cell = self._cells[point.cell]
+            cell.pop(key, None)
+            if not cell:
+                del self._cells[point.cell]
+            self.alive -= 1
+            point.alive = False
+        self._points.pop(key, None)
+
+    def update_proxy(self, proxy) -> None:
+        location = proxy.location
+        lat = getattr(location, 'latitude', None) if location else None
+        lon = getattr(location, 'longitude', None) if location else None
+        self.update(str(proxy.host), proxy.port, proxy.is_alive, proxy.latency, lat, lon)
+
+    def load(self, rows: Iterable) -> int:
+        """replace by rows: host, port, is_alive, latency, latitude, longitude"""
+        self._points, self._cells, self.alive = {}, {}, 0
+        for row in rows:
+            if row['latitude'] is None or row['longitude'] is None:
+                continue
+            self.update(str(row['host']), row['port'], row['is_alive'], row['latency'], float(row['latitude']),
+                        float(row['longitude']))
+        return len(self._points)
+
+    def _bound_km(self, lat: float, lon: float, radius: int) -> float:
+        """min distance from point to any cell out of square of radius cells around cell of point"""
+        size = self.cell_degrees
+        row, column = self.cell(lat, lon)
+        south = (row - radius) * size - 90
+        north = (row + radius + 1) * size - 90
+        lat_margin = min(lat - south if south > -90 else math.inf, north - lat if north < 90 else math.inf)
+        west = (column - radius) * size - 180
+        lon_margin = min(((lon + 180) % 360 - 180) - west, west + (2 * radius + 1) * size - ((lon + 180) % 360 - 180))
+        if (2 * radius + 1) * size >= 360:
+            lon_bound = math.inf
+        else:
+            # distance to meridian at lon_margin, true for any latitude of other point
+            lon_bound = EarthRadiusKm * math.asin(
+                math.cos(math.radians(lat)) * math.sin(math.radians(min(lon_margin, 90))))
+        return min(EarthRadiusKm * math.radians(lat_margin), lon_bound)
+
+    def _ring(self, row: int, column: int, radius: int) -> Iterable[Tuple[int, int]]:
+        if radius == 0:
+            yield row, column
+            return
+        columns = self._columns
+        for r in range(row - radius, row + radius + 1):
+            if not 0 <= r < self._rows:
+                continue
+            if r in (row - radius, row + radius):
+                seen = set()
+                for c in range(column - radius, column + radius + 1):
+                    c %= columns
+                    if c not in seen:
+                        seen.add(c)
+                        yield r, c
+            else:
+                yield r, (column - radius) % columns
+                if (column + radius) % columns != (column - radius) % columns:
+                    yield r, (column + radius) % columns
+
+    def nearest(self, lat: float, lon: float, k: int = 10, max_latency: Optional[float] = None,
+                max_km: Optional[float] = None) -> List[dict]:
+        """k nearest alive proxies: host, port, latency, latitude, longitude, distance_km, by distance"""
+        if not -90 <= lat <= 90 or not -180 <= lon <= 180:
+            raise ValueError('lat must be -90..90, lon -180..180')
+        # compared by haversine term, not by km: no asin and sqrt per point
+        best: List[Tuple[float, Tuple[str, int], GeoPoint]] = []  # heap of (-term, key, point)
+        row, column = self.cell(lat, lon)
+        phi, lam = math.radians(lat), math.radians(lon)
+        cos_phi, sin = math.cos(phi), math.sin
+        limit = _half_chord(max_km) if max_km is not None else math.inf
+        worst = limit
+        for radius in range(max(self._rows, self._columns // 2 + 1) + 1):
+            for cell in self._ring(row, column, radius):
+                points = self._cells.get(cell)
+                if not points:
+                    continue
+                for key, point in points.items():
+                    term = sin((point.phi - phi) / 2) ** 2
+                    if term > worst:
+                        continue
+                    if max_latency is not None and (point.latency is None or point.latency > max_latency):
+                        continue
+                    term += cos_phi * point.cos_phi * sin((point.lam - lam) / 2) ** 2
+                    if term > worst:
+                        continue
+                    if len(best) < k:
+                        heapq.heappush(best, (-term, key, point))
+                        if len(best) == k:
+                            worst = min(limit, -best[0][0])
+                    else:
+                        heapq.heapreplace(best, (-term, key, point))
+                        worst = min(limit, -best[0][0])
+            bound = self._bound_km(lat, lon, radius)
+            if bound == math.inf or _half_chord(bound) >= worst:
+                break
+        result = []
+        for term, key, point in sorted(best, reverse=True):
+            distance = 2 * EarthRadiusKm * math.asin(min(1.0, math.sqrt(-term)))
+            result.append({'host': key[0], 'port': key[1], 'latency': point.latency, 'latitude': point.lat,
+                           'longitude': point.lon, 'distance_km': round(distance, 3)})
+        return result
+
+    async def refresh(self) -> int:
+        rows = await self.proxy_db.select_geo_rows()
+        count = self.load(rows)
+        logger.info(f'geo index: {count} proxies with coordinates, {self.alive} alive')
+        return count
+
+    async def start(self) -> None:
+        await self.refresh()
+        self._instance_start = create_task(self._start())
+
+    def stop(self) -> None:
+        if self._instance_start:
+            self._instance_start.cancel()
+
+    async def _start(self) -> None:
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.error(f'geo index refresh :: {e}, {e.args}')
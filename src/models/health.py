@@ -0,0 +1,228 @@
+import heapq
+import ipaddress
+import math
+from array import array
+from typing import Iterator, List, Optional, Tuple
+
+__all__ = ('HealthStore', 'proxy_key', 'quantize_latency', 'dequantize_latency')
+
+# latency 0..~60 s in one byte, log scale: step ~3.5 %
+LatencyBase = 0.01
+LatencySteps = 20
+
+
+def quantize_latency(latency: float) -> int:
+    return min(255, max(1, int(round(LatencySteps * math.log2(1 + latency / LatencyBase)))))
+
+
+def dequantize_latency(value: int) -> float:
+    return LatencyBase * (2 ** (value / LatencySteps) - 1)
+
+
+def proxy_key(host, port: int) -> int:
+    """int key of ip:port, less memory than tuple of str"""
+    return int(ipaddress.ip_address(str(host))) << 16 | int(port)
+
+
+class HealthStore:
+    """Rolling history of last `window` checks of proxies in columns, slot of proxy is position
+    in open addressing table of keys (no dict, no objects per proxy):
+        keys    array('Q')  - proxy_key + 1, 0 - free slot (ipv6 keys folded to 63 bits)
+        bits    array('H')  - success of check at position of ring
+        latency bytearray   - window quantized latencies, ring
+        checks  array('I')  - total checks, head of ring = checks % window
+        score   array('f')  - health score, updated on record
+    34 bytes per slot, table is at most 3/4 full: <= ~70 bytes per proxy, see benchmarks/health_store_bench.py
+
+    score = recency weighted uptime * 1 / (1 + latency_p90 / latency_ref), 0..1
+    Persisted by columns of proxy: health_bits, health_latency, health_checks, health_score, uptime, latency_p90
+
+    health_store.record(proxy)  # after check, seed from proxy health_* if proxy not in store
+    """
+    window: int
+    max_load: float = 0.75
+
+    def __init__(self, window: int = 16, decay: float = 0.85, latency_ref: float = 1.0, capacity: int = 1024):
+        if not 0 < window <= 16:
+            raise ValueError('window must be 1..16 (bits of array H)')
+        self.window = window
+        self.latency_ref = latency_ref
+        self._weights = [decay ** age for age in range(window)]
+        self._size = 0
+        self._allocate(1 << max(capacity - 1, 1).bit_length())
+
+    def _allocate(self, capacity: int) -> None:
+        self._mask = capacity - 1
+        self.keys = array('Q', bytes(8 * capacity))
+        self.bits = array('H', bytes(2 * capacity))
+        self.latency = bytearray(self.window * capacity)
+        self.checks = array('I', bytes(4 * capacity))
+        self.score = array('f', bytes(4 * capacity))
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __contains__(self, key: int) -> bool:
+        return self._find(key) is not None
+
+    @staticmethod
+    def _stored(key: int) -> int:
+        if key >= 1 << 62:  # ipv6, ipv4 keys are < 2 ** 48
+            key = 1 << 62 | key % ((1 << 61) - 1)
+        return key + 1
+
+    def _probe(self, stored: int) -> int:
+        """slot of key or free slot"""
+        mask = self._mask
+        keys = self.keys
+        slot = (stored * 0x9E3779B97F4A7C15 >> 16) & mask
+        while keys[slot] and keys[slot] != stored:
+            slot = (slot + 1) & mask
+        return slot
+
+    def _find(self, key: int) -> Optional[int]:
+        stored = self._stored(key)
+        slot = self._probe(stored)
+        return slot if self.keys[slot] == stored else None
+
+    def slot(self, key: int) -> int:
+        stored = self._stored(key)
+        slot = self._probe(stored)
+        if self.keys[slot] != stored:
+            if (self._size + 1) > self.max_load * (self._mask + 1):
+                self._grow()
+                slot = self._probe(stored)
+            self.keys[slot] = stored
+            self._size += 1
+        return slot
+
+    def restore(self, keys: array, bits: array, latency: bytearray, checks: array, score: array) -> None:
+        """replace columns by columns of snapshot of store with same window"""
+        capacity = len(keys)
+        if capacity & (capacity - 1) or len(latency) != self.window * capacity or not (
+                len(bits) == len(checks) == len(score) == capacity):
+            raise ValueError('columns of snapshot do not match')
+        self._mask = capacity - 1
+        self.keys, self.bits, self.latency, self.checks, self.score = keys, bits, latency, checks, score
+        self._size = capacity - keys.count(0)
+
+    def _grow(self) -> None:
+        keys, bits, latency, checks, score = self.keys, self.bits, self.latency, self.checks, self.score
+        window = self.window
+        self._allocate(2 * (self._mask + 1))
+        for old, stored in enumerate(keys):
+            if not stored:
+                continue
+            slot = self._probe(stored)
+            self.keys[slot] = stored
+            self.bits[slot] = bits[old]
+            self.latency[slot * window:(slot + 1) * window] = latency[old * window:(old + 1) * window]
+            self.checks[slot] = checks[old]
+            self.score[slot] = score[old]
+
+    def load(self, key: int, bits: Optional[int], latency: Optional[bytes], checks: Optional[int]) -> int:
+        """history saved in db"""
+        slot = self.slot(key)
+        if checks:
+            self.bits[slot] = bits & 0xFFFF if bits else 0
+            ring = bytes(latency or b'')[:self.window]
+            self.latency[slot * self.window:slot * self.window + len(ring)] = ring
+            self.checks[slot] = checks
+            self.score[slot] = self._score(slot)
+        return slot
+
+    def add(self, key: int, ok: bool, latency: Optional[float] = None) -> float:
+        """record check, return score"""
+        slot = self.slot(key)
+        position = self.checks[slot] % self.window
+        if ok:
+            self.bits[slot] |= 1 << position
+            self.latency[slot * self.window + position] = quantize_latency(latency) if latency is not None else 0
+        else:
+            self.bits[slot] &= ~(1 << position) & 0xFFFF
+            self.latency[slot * self.window + position] = 0
+        self.checks[slot] += 1
+        self.score[slot] = score = self._score(slot)
+        return score
+
+    def record(self, proxy) -> float:
+        """add result of check of proxy, seed from persisted history, write health fields to proxy"""
+        key = proxy_key(proxy.host, proxy.port)
+        if key not in self:
+            self.load(key, proxy.health_bits, proxy.health_latency, proxy.health_checks)
+        score = self.add(key, ok=bool(proxy.is_alive), latency=proxy.latency)
+        proxy.__dict__.update(self.as_dict(key))
+        return score
+
+    def count(self, slot: int) -> int:
+        return min(self.checks[slot], self.window)
+
+    def uptime(self, slot: int) -> Optional[float]:
+        count = self.count(slot)
+        if not count:
+            return None
+        return bin(self.bits[slot] & ((1 << count) - 1)).count('1') / count
+
+    def latencies(self, slot: int) -> Iterator[float]:
+        """latencies of successful checks of window"""
+        bits = self.bits[slot]
+        base = slot * self.window
+        for position in range(self.count(slot)):
+            value = self.latency[base + position]
+            if bits >> position & 1 and value:
+                yield dequantize_latency(value)
+
+    def latency_p90(self, slot: int) -> Optional[float]:
+        values = sorted(self.latencies(slot))
+        if not values:
+            return None
+        return values[min(len(values) - 1, int(math.ceil(0.9 * len(values))) - 1)]
+
+    def _score(self, slot: int) -> float:
+        count = self.count(slot)
+        if not count:
+            return 0.0
+        bits = self.bits[slot]
+        head = self.checks[slot] % self.window
+        success = total = 0.0
+        for age in range(count):
+            weight = self._weights[age]
+            total += weight
+            if bits >> ((head - 1 - age) % self.window) & 1:
+                success += weight
+        if not success:
+            return 0.0
+        p90 = self.latency_p90(slot)
+        penalty = 1.0 / (1.0 + p90 / self.latency_ref) if p90 is not None else 1.0
+        return success / total * penalty
+
+    def as_dict(self, key: int) -> dict:
+        """columns of proxy table"""
+        slot = self._find(key)
+        if slot is None:
+            raise KeyError(key)
+        uptime = self.uptime(slot)
+        p90 = self.latency_p90(slot)
+        return {
+            'health_bits': self.bits[slot],
+            'health_latency': bytes(self.latency[slot * self.window:(slot + 1) * self.window]),
+            'health_checks': self.checks[slot],
+            'health_score': round(self.score[slot], 4),
+            'uptime': round(uptime, 4) if uptime is not None else None,
+            'latency_p90': round(p90, 4) if p90 is not None else None,
+        }
+
+    def get_score(self, key: int) -> Optional[float]:
+        slot = self._find(key)
+        return self.score[slot] if slot is not None else None
+
+    def ranked(self, limit: int = 100) -> List[Tuple[int, float]]:
+        """keys with best scores"""
+        score = self.score
+        slots = heapq.nlargest(limit, (slot for slot, stored in enumerate(self.keys) if stored), key=score.__getitem__)
+        return [(self.keys[slot] - 1, score[slot]) for slot in slots]
+
+    def nbytes(self) -> int:
+        """memory of columns"""
+        return sum(column.itemsize * len(column) for column in (self.keys, self.bits, self.checks, self.score)) + len(
+            self.latency)
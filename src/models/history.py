@@ -0,0 +1,212 @@
+import asyncio
+from asyncio import create_task
+import asyncpg
+import datetime
+import logging
+import re
+from typing import List, Optional, Set, Tuple
+from .client import Proxy
+
+logger = logging.getLogger(__name__)
+
+__all__ = ('CheckHistory', 'partition_name')
+
+CheckColumns = ('checked_at', 'host', 'port', 'is_alive', 'latency', 'throughput', 'anonymity', 'country_code', 'source')
+PartitionPattern = re.compile(r'^proxy_check_(\d{8})$')
+
+# key of dimension in proxy_check
+Dimensions = {
+    'proxy': "host(host) || ':' || port",
+    'country': "coalesce(country_code, '')",
+    'source': "coalesce(source, '')",
+}
+
+RollupHourSql = '''
+INSERT INTO proxy_check_hourly (bucket, dimension, key, checks, alive, latency_sum, latency_count, latency_max)
+SELECT $1::timestamp, '{dimension}', {key}, count(*), count(*) FILTER (WHERE is_alive),
+       coalesce(sum(latency) FILTER (WHERE is_alive), 0), count(latency) FILTER (WHERE is_alive),
+       max(latency) FILTER (WHERE is_alive)
+FROM proxy_check
+WHERE checked_at >= $1 AND checked_at < $2
+GROUP BY 3
+ON CONFLICT (bucket, dimension, key) DO UPDATE SET
+    checks = EXCLUDED.checks, alive = EXCLUDED.alive, latency_sum = EXCLUDED.latency_sum,
+    latency_count = EXCLUDED.latency_count, latency_max = EXCLUDED.latency_max
+'''
+
+RollupDaySql = '''
+INSERT INTO proxy_check_daily (bucket, dimension, key, checks, alive, latency_sum, latency_count, latency_max)
+SELECT $1::timestamp, dimension, key, sum(checks), sum(alive), sum(latency_sum), sum(latency_count), max(latency_max)
+FROM proxy_check_hourly
+WHERE bucket >= $1 AND bucket < $2
+GROUP BY dimension, key
+ON CONFLICT (bucket, dimension, key) DO UPDATE SET
+    checks = EXCLUDED.checks, alive = EXCLUDED.alive, latency_sum = EXCLUDED.latency_sum,
+    latency_count = EXCLUDED.latency_count, latency_max = EXCLUDED.latency_max
+'''
+
+
+def partition_name(day: datetime.date) -> str:
+    return f'proxy_check_{day:%Y%m%d}'
+
+
+def hour_start(moment: datetime.datetime) -> datetime.datetime:
+    return moment.replace(minute=0, second=0, microsecond=0)
+
+
+def day_start(moment: datetime.datetime) -> datetime.datetime:
+    return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+class CheckHistory:
+    """Append-only history of checks in table proxy_check partitioned by day.
+    Results are buffered and written by COPY in batches (batch_size or every flush_interval seconds),
+    batch of failed COPY is kept for next flush, oldest checks over max_buffer are dropped.
+    Maintenance every maintenance_interval seconds: partitions of today and tomorrow,
+    rollups of current and previous hour / day per proxy, country and source,
+    drop of partitions older than retention_days and rollups older than rollup_retention_days.
+
+    history = CheckHistory(db_connect=pool)
+    await history.start()
+    history.add(proxy)  # checked proxy
+    """
+    _db: asyncpg.pool.Pool
+    _buffer: List[Tuple]
+    _partitions: Set[datetime.date]
+    _instance_start: Optional[asyncio.Task] = None
+
+    def __init__(self, db_connect: asyncpg.pool.Pool, batch_size: int = 500, flush_interval: float = 5,
+                 maintenance_interval: float = 300, retention_days: int = 30, rollup_retention_days: int = 400,
+                 max_buffer: int = 100000):
+        self._db = db_connect
+        self.batch_size = batch_size
+        self.max_buffer = max_buffer
+        self.flush_interval = flush_interval
+        self.maintenance_interval = maintenance_interval
+        self.retention_days = retention_days
+        self.rollup_retention_days = rollup_retention_days
+        self._buffer = []
+        self._partitions = set()
+        self._flush_lock = asyncio.Lock()
+        self._flush_task: Optional[asyncio.Task] = None
+        self.stats = {'written': 0, 'batches': 0, 'errors': 0, 'dropped': 0}
+
+    @staticmethod
+    def record(proxy: Proxy) -> Tuple:
+        return (proxy.date_update or datetime.datetime.utcnow(), proxy.host, proxy.port, proxy.is_alive,
+                proxy.latency, proxy.throughput, proxy.anonymity, proxy.country_code, proxy.source)
+
+    def add(self, proxy: Proxy) -> None:
+        self._buffer.append(self.record(proxy))
+        if len(self._buffer) >= self.batch_size and (self._flush_task is None or self._flush_task.done()):
+            self._flush_task = create_task(self.flush())
+
+    async def flush(self) -> int:
+        """COPY buffered checks, return count of written"""
+        async with self._flush_lock:
+            records, self._buffer = self._buffer, []
+            if not records:
+                return 0
+            try:
+                async with self._db.acquire() as conn:
+                    for day in {record[0].date() for record in records}:
+                        await self.ensure_partition(conn, day)
+                    await conn.copy_records_to_table('proxy_check', records=records, columns=CheckColumns)
+            except Exception as e:
+                self.stats['errors'] += 1
+                logger.error(f'write {len(records)} checks :: {e}, {e.args}')
+                self.requeue(records)
+                return 0
+            self.stats['written'] += len(records)
+            self.stats['batches'] += 1
+            return len(records)
+
+    def requeue(self, records: List[Tuple]) -> None:
+        """records of failed COPY before checks added since, oldest over max_buffer dropped"""
+        self._buffer = records + self._buffer
+        dropped = len(self._buffer) - self.max_buffer
+        if dropped > 0:
+            del self._buffer[:dropped]
+            self.stats['dropped'] += dropped
+            logger.warning(f'history buffer is full, {dropped} oldest checks dropped')
+
+    async def ensure_partition(self, conn: asyncpg.Connection, day: datetime.date) -> None:
+        if day in self._partitions:
+            return
+        next_day = day + datetime.timedelta(days=1)
+        await conn.execute(f'''CREATE TABLE IF NOT EXISTS {partition_name(day)} PARTITION OF proxy_check
+                               FOR VALUES FROM ('{day.isoformat()}') TO ('{next_day.isoformat()}')''')
+        self._partitions.add(day)
+
+    async def rollup_hour(self, hour: datetime.datetime) -> None:
+        """recompute hourly aggregates of hour, idempotent"""
+        hour = hour_start(hour)
+        async with self._db.acquire() as conn:
+            async with conn.transaction():
+                for dimension, key in Dimensions.items():
+                    await conn.execute(RollupHourSql.format(dimension=dimension, key=key),
+                                       hour, hour + datetime.timedelta(hours=1))
+
+    async def rollup_day(self, day: datetime.datetime) -> None:
+        """daily aggregates from hourly"""
+        day = day_start(day)
+        async with self._db.acquire() as conn:
+            await conn.execute(RollupDaySql, day, day + datetime.timedelta(days=1))
+
+    async def drop_expired(self, now: Optional[datetime.datetime] = None) -> List[str]:
+        """drop partitions older than retention_days (no delete, no vacuum), delete old rollups"""
+        now = now if now else datetime.datetime.utcnow()
+        cutoff = (now - datetime.timedelta(days=self.retention_days)).date()
+        dropped = []
+        async with self._db.acquire() as conn:
+            rows = await conn.fetch('''SELECT child.relname AS name FROM pg_inherits
+                                       JOIN pg_class parent ON pg_inherits.inhparent = parent.oid
+                                       JOIN pg_class child ON pg_inherits.inhrelid = child.oid
+                                       WHERE parent.relname = 'proxy_check' ''')
+            for row in rows:
+                match = PartitionPattern.match(row['name'])
+                if not match:
+                    continue
+                day = datetime.datetime.strptime(match[1], '%Y%m%d').date()
+                if day < cutoff:
+                    await conn.execute(f'DROP TABLE IF EXISTS {row["name"]}')
+                    self._partitions.discard(day)
+                    dropped.append(row['name'])
+            rollup_cutoff = day_start(now - datetime.timedelta(days=self.rollup_retention_days))
+            await conn.execute('DELETE FROM proxy_check_hourly WHERE bucket < $1', rollup_cutoff)
+            await conn.execute('DELETE FROM proxy_check_daily WHERE bucket < $1', rollup_cutoff)
+        if dropped:
+            logger.info(f'dropped check partitions {dropped}')
+        return dropped
+
+    async def maintenance(self, now: Optional[datetime.datetime] = None) -> None:
+        now = now if now else datetime.datetime.utcnow()
+        async with self._db.acquire() as conn:
+            for day in (now.date(), now.date() + datetime.timedelta(days=1)):
+                await self.ensure_partition(conn, day)
+        for hour in (now - datetime.timedelta(hours=1), now):
+            await self.rollup_hour(hour)
+        for day in (now - datetime.timedelta(days=1), now):
+            await self.rollup_day(day)
+        await self.drop_expired(now)
+
+    async def start(self) -> None:
+        self._instance_start = create_task(self._start())
+
+    def stop(self) -> None:
+        if self._instance_start:
+            self._instance_start.cancel()
+
+    async def _start(self) -> None:
+        loop = asyncio.get_event_loop()
+        next_maintenance = loop.time()
+        while True:
+            await self.flush()
+            if loop.time() >= next_maintenance:
+                try:
+                    await self.maintenance()
+                except Exception as e:
+                    logger.error(f'check history maintenance :: {e}, {e.args}')
+                    logger.exception(e)
+                next_maintenance = loop.time() + self.maintenance_interval
+            await asyncio.sleep(self.flush_interval)
@@ -0,0 +1,153 @@
+import datetime
+import heapq
+import itertools
+import logging
+import operator
+import time
+from operator import attrgetter, itemgetter
+from typing import Dict, Iterable, List, Optional, Tuple
+from .storage import ProxyListColumns, proxy_filters, proxy_sort
+
+logger = logging.getLogger(__name__)
+
+__all__ = ('ProxyIndex', 'IndexEntry', 'EntryColumns')
+
+
+# columns of IndexEntry in order of its arguments and of ProxyIndex.apply, with host and port - ProxyListColumns
+EntryColumns = ('is_alive', 'latency', 'country_code', 'health_score', 'scheme', 'ttfb', 'throughput', 'anonymity',
+                'https', 'uptime', 'latency_p90', 'date_update')
+
+
+class IndexEntry:
+    """columns of GET /proxies of proxy, same as select_proxies of db"""
+    __slots__ = ('alive', 'latency', 'country', 'score', 'scheme', 'ttfb', 'throughput', 'anonymity', 'https',
+                 'uptime', 'latency_p90', 'date_update')
+
+    def __init__(self, alive: Optional[bool], latency: Optional[float], country: Optional[str],
+                 score: Optional[float] = None, scheme: Optional[str] = None, ttfb: Optional[float] = None,
+                 throughput: Optional[float] = None, anonymity: Optional[str] = None, https: Optional[bool] = None,
+                 uptime: Optional[float] = None, latency_p90: Optional[float] = None,
+                 date_update: Optional[datetime.datetime] = None):
+        self.alive = alive
+        self.latency = latency
+        self.country = country
+        self.score = score
+        self.scheme = scheme
+        self.ttfb = ttfb
+        self.throughput = throughput
+        self.anonymity = anonymity
+        self.https = https
+        self.uptime = uptime
+        self.latency_p90 = latency_p90
+        self.date_update = date_update
+
+
+# column: attribute of IndexEntry
+EntryAttrs = dict(zip(EntryColumns, IndexEntry.__slots__))
+ListAttrs = tuple((column, EntryAttrs[column]) for column in ProxyListColumns if column in EntryAttrs)
+
+
+class ProxyIndex:
+    """In-memory state of proxies of all instances: (host, port) -> columns of GET /proxies (IndexEntry).
+    Filled by resync (select from db) and change events (ChangeListener), serves GET /proxies without db.
+
+    index.apply('1.1.1.1', 8080, True, 0.3, 'DE', 0.8, 'http')
+    index.query(is_alive=True, country='DE', sort='latency', limit=10)
+    """
+    _entries: Dict[Tuple[str, int], IndexEntry]
+    # entries of alive proxies: default filter of GET /proxies (is_alive=True) does not scan dead ones
+    _alive: Dict[Tuple[str, int], IndexEntry]
+
+    def __init__(self):
+        self._entries = {}
+        self._alive = {}
+        self.updated = None
+        self.stats = {'events': 0, 'resyncs': 0, 'gaps': 0}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: Tuple[str, int]) -> bool:
+        return key in self._entries
+
+    def get(self, host: str, port: int) -> Optional[IndexEntry]:
+        return self._entries.get((host, port))
+
+    def apply(self, host: str, port: int, *values) -> None:
+        """values of EntryColumns in order, missing last values are None (events of older instances),
+        country of location is kept if not known
+        """
+        entry = IndexEntry(*values)
+        if entry.country is None:
+            old = self._entries.get((host, port))
+            if old is not None:
+                entry.country = old.country
+        self._entries[(host, port)] = entry
+        if entry.alive is True:
+            self._alive[(host, port)] = entry
+        else:
+            self._alive.pop((host, port), None)
+        self.updated = time.time()
+
+    def apply_row(self, row) -> None:
+        """row of select_index_rows"""
+        self.apply(str(row['host']), row['port'], *(row[column] for column in EntryColumns))
+
+    def items(self) -> Iterable[Tuple[Tuple[str, int], IndexEntry]]:
+        return self._entries.items()
+
+    def restore(self, entries: Dict[Tuple[str, int], IndexEntry]) -> int:
+        """replace state by entries of snapshot"""
+        self._entries = entries
+        self._alive = {key: entry for key, entry in entries.items() if entry.alive is True}
+        self.updated = time.time()
+        return len(entries)
+
+    def discard(self, host: str, port: int) -> None:
+        self._entries.pop((host, port), None)
+        self._alive.pop((host, port), None)
+
+    def load(self, rows: Iterable) -> int:
+        """replace state by rows of select_index_rows"""
+        entries = {}
+        for row in rows:
+            entries[(str(row['host']), row['port'])] = IndexEntry(*(row[column] for column in EntryColumns))
+        self._entries = entries
+        self._alive = {key: entry for key, entry in entries.items() if entry.alive is True}
+        self.updated = time.time()
+        self.stats['resyncs'] += 1
+        return len(entries)
+
+    def query(self, sort: str = '-health_score', limit: int = 100, offset: int = 0, **filters) -> List[dict]:
+        """rows of ProxyListColumns as select_proxies: filters of proxy_filters, same order, NULLs last"""
+        column, descending = proxy_sort(sort)
+        if limit < 0 or offset < 0:
+            raise ValueError('limit and offset must not be negative')
+        conditions = proxy_filters(**filters)
+        items = self._entries.items()
+        if ('is_alive', operator.eq, True) in conditions:
+            conditions.remove(('is_alive', operator.eq, True))
+            items = self._alive.items()
+        # one pass per filter, each narrows items for the next
+        for name, op, value in conditions:
+            get = attrgetter(EntryAttrs[name])
+            if op is operator.eq:
+                # value of filter is not None: NULL of entry is not equal
+                items = [(key, entry) for key, entry in items if get(entry) == value]
+            else:
+                items = [(key, entry) for key, entry in items if get(entry) is not None and op(get(entry), value)]
+        get = attrgetter(EntryAttrs[column])
+        count = offset + limit
+        valued = [(get(entry), key, entry) for key, entry in items if get(entry) is not None]
+        select = heapq.nlargest if descending else heapq.nsmallest
+        selected = [(key, entry) for _, key, entry in select(count, valued, key=itemgetter(0))]
+        if len(selected) < count:
+            selected += itertools.islice(((key, entry) for key, entry in items if get(entry) is None),
+                                         count - len(selected))
+        rows = []
+        for (host, port), entry in selected[offset:]:
+            row = {'host': host, 'port': port}
+            for name, entry_attr in ListAttrs:
+                row[name] = getattr(entry, entry_attr)
+            rows.append(row)
+        return rows
@@ -0,0 +1,136 @@
+import asyncio
+from asyncio import create_task
+import logging
+import random
+import time
+from typing import Dict, List, Optional
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+__all__ = ('Judge', 'JudgePool')
+
+
+class Judge:
+    """Judge endpoint (GET /judge of this app), echo of ip and headers of client.
+    Health by direct requests: latency ewma, consecutive failures, origin_ip - our ip as judge sees it
+    """
+    url: str
+    healthy: bool
+    latency: Optional[float]
+    failures: int
+    origin_ip: Optional[str]
+    last_check: Optional[float]
+
+    def __init__(self, url: str):
+        self.url = url
+        self.healthy = True
+        self.latency = None
+        self.failures = 0
+        self.origin_ip = None
+        self.last_check = None
+        self.checks = 0
+
+    def record(self, ok: bool, latency: Optional[float] = None, max_failures: int = 2, smoothing: float = 0.3) -> None:
+        self.checks += 1
+        self.last_check = time.time()
+        if ok:
+            self.failures = 0
+            self.healthy = True
+            self.latency = latency if self.latency is None else self.latency + smoothing * (latency - self.latency)
+        else:
+            self.failures += 1
+            if self.failures >= max_failures:
+                self.healthy = False
+
+    def payload_url(self, size: int) -> str:
+        """GET /judge/payload?size= - size bytes for throughput probe"""
+        return f'{self.url.rstrip("/")}/payload?size={size}'
+
+    def as_dict(self) -> dict:
+        return {'url': self.url, 'healthy': self.healthy, 'latency': self.latency, 'failures': self.failures,
+                'origin_ip': self.origin_ip, 'last_check': self.last_check}
+
+    def __repr__(self):
+        return f'<Judge {self.url} healthy={self.healthy} latency={self.latency}>'
+
+
+class JudgePool:
+    """Judges of checker with health based selection:
+    two random healthy judges, judge with lower latency (power of two choices), any judge if none is healthy.
+
+    https_url - TLS endpoint of CONNECT probe of checker, not probed if None
+
+    judge_pool = JudgePool(['http://judge1:8080/judge', 'http://judge2:8080/judge'], http_session=session,
+                           https_url='https://judge1:8443/judge')
+    await judge_pool.start()  # health check every check_interval seconds
+    judge = judge_pool.select()
+    """
+    judges: List[Judge]
+    _instance_start: Optional[asyncio.Task] = None
+
+    def __init__(self, urls: List[str], http_session: Optional[aiohttp.ClientSession] = None,
+                 check_interval: float = 60, timeout: float = 10, max_failures: int = 2,
+                 https_url: Optional[str] = None):
+        if not urls:
+            raise ValueError('JudgePool needs at least one judge url')
+        self.https_url = https_url
+        self.judges = [Judge(url) for url in urls]
+        self.http_session = http_session
+        self.check_interval = check_interval
+        self.timeout = timeout
+        self.max_failures = max_failures
+
+    def select(self) -> Judge:
+        healthy = [judge for judge in self.judges if judge.healthy]
+        if not healthy:
+            return random.choice(self.judges)
+        if len(healthy) == 1:
+            return healthy[0]
+        first, second = random.sample(healthy, 2)
+        if first.latency is None or second.latency is None:
+            return first
+        return first if first.latency <= second.latency else second
+
+    @property
+    def origin_ip(self) -> Optional[str]:
+        """our ip seen by judges, proxy which passes it is transparent"""
+        for judge in self.judges:
+            if judge.origin_ip:
+                return judge.origin_ip
+        return None
+
+    async def check_judge(self, judge: Judge) -> bool:
+        """direct request to judge"""
+        t1 = time.perf_counter()
+        try:
+            async with self.http_session.get(judge.url, timeout=aiohttp.ClientTimeout(total=self.timeout)) as resp:
+                echo = await resp.json() if resp.status == 200 else None
+            ok = isinstance(echo, dict) and 'ip' in echo
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            logger.info('judge %s :: %s %s', judge.url, e.__class__.__name__, e)
+            ok, echo = False, None
+        judge.record(ok, latency=time.perf_counter() - t1, max_failures=self.max_failures)
+        if ok:
+            judge.origin_ip = echo['ip']
+        return ok
+
+    async def check_all(self) -> Dict[str, bool]:
+        results = await asyncio.gather(*(self.check_judge(judge) for judge in self.judges))
+        return {judge.url: ok for judge, ok in zip(self.judges, results)}
+
+    async def start(self) -> None:
+        await self.check_all()
+        self._instance_start = create_task(self._start())
+
+    def stop(self) -> None:
+        if self._instance_start:
+            self._instance_start.cancel()
+
+    def stats(self) -> List[dict]:
+        return [judge.as_dict() for judge in self.judges]
+
+    async def _start(self) -> None:
+        while True:
+            await asyncio.sleep(self.check_interval)
+            await self.check_all()
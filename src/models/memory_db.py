@@ -0,0 +1,197 @@
+import datetime
+import heapq
+from operator import itemgetter
+from typing import Dict, Iterable, List, Optional, Tuple
+from .db import proxy_table, location_table
+from .storage import (ProxyStorage, LocationStorage, ProxyListColumns, CredentialColumns, IndexColumns,
+                      IndexHistoryColumns, GeoColumns, proxy_filters, proxy_sort)
+
+__all__ = ('MemoryProxyDb', 'MemoryLocationDb')
+
+ProxyColumns = tuple(column.name for column in proxy_table.c)
+LocationColumns = tuple(column.name for column in location_table.c)
+
+
+def _columns(kwargs: dict, columns: Iterable[str]) -> None:
+    unknown = set(kwargs).difference(columns)
+    if unknown:
+        raise ValueError(f'unknown columns {sorted(unknown)}')
+
+
+class MemoryLocationDb(LocationStorage):
+    """Locations in dict of process by ip (str)"""
+    _rows: Dict[str, dict]
+
+    def __init__(self):
+        self._rows = {}
+
+    async def insert_location(self, **kwargs) -> str:
+        _columns(kwargs, LocationColumns)
+        ip = str(kwargs['ip'])
+        if ip in self._rows:
+            return 'INSERT 0 0'
+        row = dict.fromkeys(LocationColumns)
+        row.update(kwargs, ip=ip)
+        self._rows[ip] = row
+        return 'INSERT 0 1'
+
+    async def select_pm(self, ip: str) -> Optional[dict]:
+        row = self._rows.get(str(ip))
+        return dict(row) if row else None
+
+    async def delete_for_ip(self, ip: str) -> str:
+        return f'DELETE {int(self._rows.pop(str(ip), None) is not None)}'
+
+    async def exist_ip(self, ip: str) -> bool:
+        return str(ip) in self._rows
+
+    def get(self, ip: str) -> Optional[dict]:
+        return self._rows.get(ip)
+
+
+class MemoryProxyDb(ProxyStorage):
+    """Proxies in dict of process by (host, port): single node without db, tests and benchmarks.
+    Same semantics as ProxyDb: NULL passes no filter, claim only of in_process = false.
+    No await between read and write of row - claim is atomic in event loop, no lock.
+    Rows are copies, host and location_ip are str.
+    location_db - locations of select_geo_rows
+    """
+    _rows: Dict[Tuple[str, int], dict]
+
+    def __init__(self, location_db: Optional[MemoryLocationDb] = None, delta_minutes_for_check: int = 60,
+                 owner: Optional[str] = None, lease_seconds: int = 300):
+        super().__init__(delta_minutes_for_check=delta_minutes_for_check, owner=owner, lease_seconds=lease_seconds)
+        self.location_db = location_db
+        self._rows = {}
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def _row(self, host: str, port: int) -> Optional[dict]:
+        return self._rows.get((str(host), int(port)))
+
+    @staticmethod
+    def _set(row: dict, values: dict) -> None:
+        _columns(values, ProxyColumns)
+        row.update(values)
+        if row['location_ip'] is not None:
+            row['location_ip'] = str(row['location_ip'])
+
+    async def insert_proxy(self, **kwargs) -> str:
+        key = (str(kwargs['host']), int(kwargs['port']))
+        if key in self._rows:
+            return 'INSERT 0 0'
+        row = dict.fromkeys(ProxyColumns)
+        # defaults of table
+        row.update(in_process=False, date_creation=datetime.datetime.utcnow())
+        self._set(row, kwargs)
+        row['host'], row['port'] = key
+        self._rows[key] = row
+        return 'INSERT 0 1'
+
+    async def select_proxy_pm(self, host: str, port: int) -> Optional[dict]:
+        row = self._row(host, port)
+        return dict(row) if row else None
+
+    async def delete_proxy_pm(self, host: str, port: int) -> str:
+        return f'DELETE {int(self._rows.pop((str(host), int(port)), None) is not None)}'
+
+    async def update_proxy_pm(self, **kwargs) -> str:
+        row = self._row(kwargs.pop('host'), kwargs.pop('port'))
+        if row is None:
+            return 'UPDATE 0'
+        self._set(row, kwargs)
+        return 'UPDATE 1'
+
+    async def update_claimed_proxy(self, **kwargs) -> str:
+        row = self._row(kwargs['host'], kwargs['port'])
+        if row is None or row['claimed_by'] != self.owner:
+            return 'UPDATE 0'
+        return await self.update_proxy_pm(**kwargs)
+
+    async def select_proxies(self, sort: str = '-health_score', limit: int = 100, offset: int = 0,
+                             credentials: bool = False, **filters) -> List[dict]:
+        """filters of proxy_filters, same order as ProxyDb.query_select_proxies"""
+        column, descending = proxy_sort(sort)
+        conditions = proxy_filters(**filters)
+        rows = [row for row in self._rows.values()
+                if all(row[name] is not None and op(row[name], value) for name, op, value in conditions)]
+        # top of page only, not sort of all rows
+        top = heapq.nlargest if descending else heapq.nsmallest
+        ordered = top(offset + limit, (row for row in rows if row[column] is not None), key=itemgetter(column))
+        if len(ordered) < offset + limit:
+            ordered += [row for row in rows if row[column] is None]
+        columns = ProxyListColumns + CredentialColumns if credentials else ProxyListColumns
+        return [{name: row[name] for name in columns} for row in ordered[offset:offset + limit]]
+
+    async def select_index_rows(self, updated_after: Optional[datetime.datetime] = None) -> List[dict]:
+        if updated_after is None:
+            return [{name: row[name] for name in IndexColumns} for row in self._rows.values()]
+        columns = IndexColumns + IndexHistoryColumns
+        return [{name: row[name] for name in columns} for row in self._rows.values()
+                if row['date_update'] is not None and row['date_update'] > updated_after]
+
+    async def select_geo_rows(self) -> List[dict]:
+        rows = []
+        if self.location_db is None:
+            return rows
+        for row in self._rows.values():
+            location = self.location_db.get(row['location_ip']) if row['location_ip'] is not None else None
+            if location is not None:
+                rows.append({name: row[name] if name in row else location[name] for name in GeoColumns})
+        return rows
+
+    def _claim(self, row: dict) -> None:
+        row.update(in_process=True, claimed_by=self.owner, claimed_until=self.lease_deadline())
+
+    async def select_and_set_proxy_to_process(self) -> Optional[dict]:
+        """scan of rows: never checked proxy with oldest date_creation, else due proxy with oldest date_update,
+        row before claim as ProxyDb returns
+        """
+        new = [row for row in self._rows.values() if row['date_update'] is None and row['in_process'] is False]
+        if new:
+            row = min(new, key=lambda row: row['date_creation'])
+        else:
+            due_before = self.due_before()
+            due = [row for row in self._rows.values() if row['in_process'] is False
+                   and row['date_update'] is not None and row['date_update'] < due_before]
+            if not due:
+                return None
+            row = min(due, key=lambda row: row['date_update'])
+        claimed = dict(row)
+        self._claim(row)
+        return claimed
+
+    async def select_schedule(self) -> List[dict]:
+        return [{'host': host, 'port': port, 'date_update': row['date_update']}
+                for (host, port), row in self._rows.items()]
+
+    async def claim_proxy(self, host: str, port: int) -> Optional[dict]:
+        row = self._row(host, port)
+        if row is None or row['in_process'] is not False:
+            return None
+        if row['date_update'] is not None and row['date_update'] >= self.due_before():
+            return None
+        self._claim(row)
+        return dict(row)
+
+    async def renew_lease(self, host: str, port: int) -> bool:
+        row = self._row(host, port)
+        if row is None or row['in_process'] is not True or row['claimed_by'] != self.owner:
+            return False
+        row['claimed_until'] = self.lease_deadline()
+        return True
+
+    def _release(self, rows: List[dict]) -> str:
+        for row in rows:
+            row.update(in_process=False, claimed_by=None, claimed_until=None)
+        return f'UPDATE {len(rows)}'
+
+    async def release_expired_leases(self) -> str:
+        now = datetime.datetime.utcnow()
+        return self._release([row for row in self._rows.values() if row['in_process'] is True
+                              and (row['claimed_until'] is None or row['claimed_until'] < now)])
+
+    async def release_owner_leases(self) -> str:
+        return self._release([row for row in self._rows.values() if row['in_process'] is True
+                              and row['claimed_by'] == self.owner])
@@ -0,0 +1,88 @@
+import asyncpg
+import logging
+import pathlib
+import re
+from typing import List, Optional, Union
+
+logger = logging.getLogger(__name__)
+
+__all__ = ('Migration', 'MigrationRunner', 'load_migrations', 'MIGRATIONS_DIR')
+
+MIGRATIONS_DIR = pathlib.Path(__file__).parent.parent.parent / 'migrations'
+
+MigrationFilePattern = re.compile(r'^(?P<version>\d+)_(?P<name>\w+)\.sql$')
+
+
+class Migration:
+    """One versioned sql file, migrations/0002_proxy_claim_indexes.sql -> version 2"""
+
+    def __init__(self, version: int, name: str, path: pathlib.Path):
+        self.version = version
+        self.name = name
+        self.path = path
+
+    @property
+    def sql(self) -> str:
+        with open(self.path) as f:
+            return f.read()
+
+    def __repr__(self):
+        return f'<Migration {self.version:04d} {self.name}>'
+
+
+def load_migrations(path: Union[str, pathlib.Path, None] = None) -> List[Migration]:
+    """Versioned migrations from dir, sorted by version"""
+    path = pathlib.Path(path) if path else MIGRATIONS_DIR
+    migrations = []
+    for child in path.iterdir():
+        match = MigrationFilePattern.match(child.name)
+        if not match:
+            continue
+        migrations.append(Migration(version=int(match['version']), name=match['name'], path=child))
+    migrations.sort(key=lambda m: m.version)
+    versions = [m.version for m in migrations]
+    if len(versions) != len(set(versions)):
+        raise ValueError(f'duplicate migration versions in {path}: {versions}')
+    return migrations
+
+
+class MigrationRunner:
+    """Apply not applied migrations, each in its own transaction.
+    Applied versions are stored in table schema_migrations.
+    Advisory lock serializes runners of several app instances.
+    """
+    _db: asyncpg.pool.Pool
+    table_name: str = 'schema_migrations'
+    lock_id: int = 7201026
+
+    def __init__(self, db_connect: asyncpg.pool.Pool, path: Union[str, pathlib.Path, None] = None):
+        self._db = db_connect
+        self.path = path
+
+    async def applied_versions(self, conn) -> set:
+        await conn.execute(f'''CREATE TABLE IF NOT EXISTS {self.table_name}(
+                                version INTEGER PRIMARY KEY,
+                                name VARCHAR,
+                                applied_at timestamp without time zone default (now() at time zone 'utc'));''')
+        rows = await conn.fetch(f'SELECT version FROM {self.table_name};')
+        return {row['version'] for row in rows}
+
+    async def migrate(self, target: Optional[int] = None) -> List[Migration]:
+        """apply migrations up to target version (all by default), return applied"""
+        applied = []
+        async with self._db.acquire() as conn:
+            await conn.execute(f'SELECT pg_advisory_lock({self.lock_id});')
+            try:
+                versions = await self.applied_versions(conn)
+                for migration in load_migrations(self.path):
+                    if migration.version in versions or (target is not None and migration.version > target):
+                        continue
+                    logger.info(f'apply migration {migration}')
+                    async with conn.transaction():
+                        await conn.execute(migration.sql)
+                        await conn.execute(f'INSERT INTO {self.table_name} (version, name) VALUES ($1, $2);',
+                                           migration.version, migration.name)
+                    applied.append(migration)
+            finally:
+                await conn.execute(f'SELECT pg_advisory_unlock({self.lock_id});')
+        return applied
@@ -0,0 +1,148 @@
+import asyncio
+import collections
+import logging
+from typing import Any, Callable, Deque, Dict, Optional, Union
+
+logger = logging.getLogger(__name__)
+
+__all__ = ('PriorityLaneQueue', 'proxy_lane', 'DEFAULT_LANES')
+
+# lane: weight, lane with weight 8 gets 8 items for 1 item of lane with weight 1
+DEFAULT_LANES: Dict[str, int] = {
+    'user': 8,      # posted by client to api
+    'alive': 4,     # alive at the last check
+    'recheck': 2,   # dead at the last check
+    'new': 1,       # never checked, bulk import from parsers
+}
+
+
+def proxy_lane(proxy: Any) -> str:
+    """lane of proxy: explicit proxy.lane, else by result of the last check"""
+    lane = getattr(proxy, 'lane', None)
+    if lane:
+        return lane
+    if getattr(proxy, 'is_alive', None):
+        return 'alive'
+    if getattr(proxy, 'date_update', None) is None:
+        return 'new'
+    return 'recheck'
+
+
+class PriorityLaneQueue:
+    """Multi-lane queue with asyncio.Queue interface.
+    get - smooth weighted round robin between not empty lanes,
+    put - waits while lane of item is full, other lanes are not blocked.
+
+    queue = PriorityLaneQueue(maxsize={'new': 1000})
+    await queue.put(proxy)              # lane from proxy_lane(proxy)
+    await queue.put(proxy, lane='user')
+    proxy = await queue.get()
+    """
+    weights: Dict[str, int]
+    maxsize: Dict[str, int]
+    lane_selector: Callable[[Any], str]
+    _lanes: Dict[str, Deque]
+
+    def __init__(self, lanes: Optional[Dict[str, int]] = None, maxsize: Union[int, Dict[str, int]] = 0,
+                 lane_selector: Callable[[Any], str] = proxy_lane, default_lane: str = 'new'):
+        self.weights = dict(lanes if lanes else DEFAULT_LANES)
+        if default_lane not in self.weights:
+            raise ValueError(f'default_lane {default_lane} not in lanes {list(self.weights)}')
+        if isinstance(maxsize, int):
+            self.maxsize = {lane: maxsize for lane in self.weights}
+        else:
+            self.maxsize = {lane: maxsize.get(lane, 0) for lane in self.weights}
+        self.lane_selector = lane_selector
+        self.default_lane = default_lane
+        self._lanes = {lane: collections.deque() for lane in self.weights}
+        self._current = {lane: 0 for lane in self.weights}
+        self._not_empty = asyncio.Event()
+        self._not_full = {lane: asyncio.Event() for lane in self.weights}
+        for event in self._not_full.values():
+            event.set()
+        self._unfinished_tasks = 0
+        self._finished = asyncio.Event()
+        self._finished.set()
+
+    def select_lane(self, item: Any, lane: Optional[str] = None) -> str:
+        lane = lane if lane else self.lane_selector(item)
+        if lane not in self._lanes:
+            lane = self.default_lane
+        return lane
+
+    def qsize(self, lane: Optional[str] = None) -> int:
+        if lane:
+            return len(self._lanes[lane])
+        return sum(len(q) for q in self._lanes.values())
+
+    def empty(self) -> bool:
+        return self.qsize() == 0
+
+    def full(self, lane: Optional[str] = None) -> bool:
+        lane = lane if lane else self.default_lane
+        return 0 < self.maxsize[lane] <= len(self._lanes[lane])
+
+    def stats(self) -> Dict[str, int]:
+        """depth of lanes"""
+        return {lane: len(q) for lane, q in self._lanes.items()}
+
+    async def put(self, item: Any, lane: Optional[str] = None) -> None:
+        lane = self.select_lane(item, lane)
+        while self.full(lane):
+            self._not_full[lane].clear()
+            await self._not_full[lane].wait()
+        self._put(item, lane)
+
+    def put_nowait(self, item: Any, lane: Optional[str] = None) -> None:
+        lane = self.select_lane(item, lane)
+        if self.full(lane):
+            raise asyncio.QueueFull()
+        self._put(item, lane)
+
+    async def get(self) -> Any:
+        while self.empty():
+            self._not_empty.clear()
+            await self._not_empty.wait()
+        return self._get()
+
+    def get_nowait(self) -> Any:
+        if self.empty():
+            raise asyncio.QueueEmpty()
+        return self._get()
+
+    def task_done(self) -> None:
+        if self._unfinished_tasks <= 0:
+            raise ValueError('task_done() called too many times')
+        self._unfinished_tasks -= 1
+        if self._unfinished_tasks == 0:
+            self._finished.set()
+
+    async def join(self) -> None:
+        if self._unfinished_tasks > 0:
+            await self._finished.wait()
+
+    def _put(self, item: Any, lane: str) -> None:
+        self._lanes[lane].append(item)
+        self._unfinished_tasks += 1
+        self._finished.clear()
+        self._not_empty.set()
+
+    def _get(self) -> Any:
+        lane = self._next_lane()
+        item = self._lanes[lane].popleft()
+        self._not_full[lane].set()
+        return item
+
+    def _next_lane(self) -> str:
+        """smooth weighted round robin (as nginx upstreams) over not empty lanes"""
+        total = 0
+        best = None
+        for lane, weight in self.weights.items():
+            if not self._lanes[lane]:
+                continue
+            self._current[lane] += weight
+            total += weight
+            if best is None or self._current[lane] > self._current[best]:
+                best = lane
+        self._current[best] -= total
+        return best
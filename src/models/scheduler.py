@@ -0,0 +1,131 @@
+import asyncio
+import datetime
+import heapq
+import logging
+import time
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+__all__ = ('RecheckScheduler', )
+
+EPOCH = datetime.datetime(1970, 1, 1)
+
+Key = Tuple[str, int]
+
+
+def to_timestamp(date: datetime.datetime) -> float:
+    """naive utc datetime (as in table proxy) to unix timestamp"""
+    return (date - EPOCH).total_seconds()
+
+
+class RecheckScheduler:
+    """In memory schedule of proxy checks, heap keyed by next check time.
+    Loaded from db, updated when check results are written (TaskHandlerToDB), merged with db periodically
+    (StartProxyHandler): proxies inserted by other instances, proxies lost by failed check or write.
+    Rescheduled key leaves stale entry in heap, it is skipped on pop (lazy deletion).
+
+    scheduler = RecheckScheduler(delta_minutes_for_check=60)
+    await scheduler.load(proxy_db)
+    host, port = await scheduler.wait_due()
+    """
+    delta_minutes_for_check: int
+    _heap: List[Tuple[float, Key]]
+    _due: Dict[Key, float]
+
+    def __init__(self, delta_minutes_for_check: int = 60):
+        self.delta_minutes_for_check = delta_minutes_for_check
+        self._heap = []
+        self._due = {}
+        self._changed = asyncio.Event()
+
+    def __len__(self) -> int:
+        return len(self._due)
+
+    def __contains__(self, key: Key) -> bool:
+        return key in self._due
+
+    @staticmethod
+    def key(host, port) -> Key:
+        return str(host), int(port)
+
+    def schedule(self, host, port, due: Optional[float] = None) -> None:
+        """schedule check at due timestamp, now by default"""
+        key = self.key(host, port)
+        due = time.time() if due is None else due
+        self._due[key] = due
+        heapq.heappush(self._heap, (due, key))
+        if self._heap[0][1] == key:
+            self._changed.set()
+        if len(self._heap) > 2 * len(self._due) + 1024:
+            self._compact()
+
+    def schedule_urgent(self, host, port) -> None:
+        """schedule before all due proxies, for proxies posted by client"""
+        self.schedule(host, port, 0.0)
+
+    def schedule_checked(self, host, port, date_update: Optional[datetime.datetime]) -> None:
+        """schedule next check of proxy checked at date_update, never checked - now"""
+        if date_update is None:
+            self.schedule(host, port)
+        else:
+            self.schedule(host, port, to_timestamp(date_update) + self.delta_minutes_for_check * 60)
+
+    def discard(self, host, port) -> None:
+        self._due.pop(self.key(host, port), None)
+
+    def next_due(self) -> Optional[float]:
+        """timestamp of nearest check"""
+        self._drop_stale()
+        return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, now: Optional[float] = None) -> Optional[Key]:
+        """key of proxy if time to check has come"""
+        now = time.time() if now is None else now
+        self._drop_stale()
+        if not self._heap or self._heap[0][0] > now:
+            return
+        due, key = heapq.heappop(self._heap)
+        del self._due[key]
+        return key
+
+    async def wait_due(self) -> Key:
+        """wait nearest check time, return key of proxy"""
+        while True:
+            key = self.pop_due()
+            if key:
+                return key
+            self._changed.clear()
+            next_due = self.next_due()
+            timeout = None if next_due is None else max(next_due - time.time(), 0)
+            try:
+                await asyncio.wait_for(self._changed.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def load(self, proxy_db) -> int:
+        """load schedule of all proxies from db"""
+        rows = await proxy_db.select_schedule()
+        for row in rows:
+            self.schedule_checked(row['host'], row['port'], row['date_update'])
+        logger.info(f'{self.__class__.__name__} loaded {len(rows)} proxies')
+        return len(rows)
+
+    async def merge(self, proxy_db) -> int:
+        """schedule proxies of db missing in schedule, scheduled proxies keep their time"""
+        rows = await proxy_db.select_schedule()
+        added = 0
+        for row in rows:
+            if self.key(row['host'], row['port']) not in self._due:
+                self.schedule_checked(row['host'], row['port'], row['date_update'])
+                added += 1
+        return added
+
+    def _drop_stale(self) -> None:
+        heap = self._heap
+        while heap and self._due.get(heap[0][1]) != heap[0][0]:
+            heapq.heappop(heap)
+
+    def _compact(self) -> None:
+        self._heap = [(due, key) for key, due in self._due.items()]
+        heapq.heapify(self._heap)
@@ -0,0 +1,249 @@
+import asyncio
+from asyncio import create_task
+import datetime
+import logging
+import math
+import mmap
+import os
+import socket
+import struct
+import sys
+import time
+from array import array
+from typing import Dict, List, Optional, Tuple
+from .health import HealthStore, proxy_key
+from .index import IndexEntry, ProxyIndex
+
+logger = logging.getLogger(__name__)
+
+__all__ = ('StateSnapshot',)
+
+Magic = b'PXST'
+Version = 2
+# magic, version, little endian, window of HealthStore, taken_at (unix time), proxies of index, slots of HealthStore
+Header = struct.Struct('<4sHHHdII')
+Ipv4Prefix = b'\0' * 10 + b'\xff\xff'
+NoCountry = b'\0\0'
+Epoch = datetime.datetime(1970, 1, 1)
+# columns of index after host, port, country: attribute of IndexEntry, typecode of array
+# b - bool (-1 None), f / d - float (nan None), d of date_update - seconds from Epoch, B - code of TextCodes (0 None)
+IndexLayout = (('alive', 'b'), ('latency', 'f'), ('score', 'f'), ('scheme', 'B'), ('anonymity', 'B'), ('https', 'b'),
+               ('ttfb', 'f'), ('throughput', 'f'), ('uptime', 'f'), ('latency_p90', 'f'), ('date_update', 'd'))
+# text of code, other text is saved as None
+TextCodes = {'scheme': (None, 'http', 'https', 'socks4', 'socks5'),
+             'anonymity': (None, 'transparent', 'anonymous', 'elite')}
+_text_code = {attr: {text: code for code, text in enumerate(texts)} for attr, texts in TextCodes.items()}
+
+
+def _pad(size: int) -> int:
+    return -size % 8
+
+
+def _encode(attr: str, typecode: str, value):
+    if typecode == 'B':
+        return _text_code[attr].get(value, 0)
+    if value is None:
+        return -1 if typecode == 'b' else math.nan
+    if attr == 'date_update':
+        return (value - Epoch).total_seconds()
+    return int(value) if typecode == 'b' else value
+
+
+def _decode(attr: str, typecode: str, values: list) -> list:
+    """column of IndexLayout"""
+    if typecode == 'B':
+        texts = TextCodes[attr]
+        return [texts[value] if value < len(texts) else None for value in values]
+    if typecode == 'b':
+        return [None if value < 0 else value == 1 for value in values]
+    if attr == 'date_update':
+        return [None if value != value else Epoch + datetime.timedelta(seconds=value) for value in values]
+    return [None if value != value else value for value in values]
+
+
+def pack_host(host: str) -> bytes:
+    """16 bytes, ipv4 as ipv4-mapped ipv6"""
+    try:
+        return Ipv4Prefix + socket.inet_pton(socket.AF_INET, host)
+    except OSError:
+        return socket.inet_pton(socket.AF_INET6, host)
+
+
+def unpack_host(packed: bytes) -> str:
+    if packed[:12] == Ipv4Prefix:
+        return socket.inet_ntop(socket.AF_INET, packed[12:])
+    return socket.inet_ntop(socket.AF_INET6, packed)
+
+
+class StateSnapshot:
+    """Binary snapshot of ProxyIndex and HealthStore in columns (arrays), written every interval seconds
+    and on shutdown, loaded from mmap on start: warm state in milliseconds instead of full select.
+    After load catch_up selects only proxies with date_update newer than snapshot (minus catch_up_margin).
+
+    file: Header, then columns padded to 8 bytes
+        index:  host 16 bytes, port H, country 2 bytes, columns of IndexLayout
+        health: keys Q, bits H, checks I, score f, latency window bytes - columns of HealthStore as is
+
+    snapshot = StateSnapshot('proxy_state.snapshot', index=index, health_store=health_store)
+    if snapshot.load():
+        await snapshot.catch_up(proxy_db)
+    await snapshot.start()
+    """
+    index: Optional[ProxyIndex]
+    health_store: Optional[HealthStore]
+    taken_at: Optional[datetime.datetime] = None
+    _instance_start: Optional[asyncio.Task] = None
+
+    def __init__(self, path: str, index: Optional[ProxyIndex] = None, health_store: Optional[HealthStore] = None,
+                 interval: float = 60, catch_up_margin: float = 60):
+        """catch_up_margin - seconds before snapshot, writes in flight and clock skew of instances"""
+        self.path = path
+        self.index = index
+        self.health_store = health_store
+        self.interval = interval
+        self.catch_up_margin = catch_up_margin
+
+    def dump(self) -> bytes:
+        hosts, ports, countries = bytearray(), array('H'), bytearray()
+        values = [array(typecode) for _, typecode in IndexLayout]
+        entries = self.index.items() if self.index is not None else ()
+        for (host, port), entry in entries:
+            try:
+                hosts += pack_host(host)
+            except OSError:
+                continue
+            ports.append(port)
+            country = (entry.country or '').encode('ascii', 'replace')
+            countries += country if len(country) == 2 else NoCountry
+            for column, (attr, typecode) in zip(values, IndexLayout):
+                column.append(_encode(attr, typecode, getattr(entry, attr)))
+        store = self.health_store
+        window, slots = (store.window, store._mask + 1) if store is not None else (0, 0)
+        header = Header.pack(Magic, Version, sys.byteorder == 'little', window, time.time(), len(ports), slots)
+        parts = [header + b'\0' * _pad(len(header))]
+        columns = [hosts, ports, countries] + values
+        if store is not None:
+            columns += [store.keys, store.bits, store.checks, store.score, store.latency]
+        for column in columns:
+            data = column.tobytes() if isinstance(column, array) else bytes(column)
+            parts.append(data + b'\0' * _pad(len(data)))
+        return b''.join(parts)
+
+    def write(self, data: bytes) -> None:
+        """atomic: reader sees old or new snapshot"""
+        temp = f'{self.path}.tmp'
+        with open(temp, 'wb') as file:
+            file.write(data)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp, self.path)
+
+    async def save(self) -> int:
+        data = self.dump()
+        await asyncio.get_event_loop().run_in_executor(None, self.write, data)
+        return len(data)
+
+    def load(self) -> Optional[datetime.datetime]:
+        """fill index and health_store from file, return time of snapshot (utc), None if no valid snapshot"""
+        try:
+            with open(self.path, 'rb') as file:
+                if not os.fstat(file.fileno()).st_size:
+                    return None
+                with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    taken_at = self._load(memoryview(mapped))
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, struct.error) as e:
+            logger.error(f'snapshot {self.path} is not loaded :: {e}, {e.args}')
+            return None
+        self.taken_at = datetime.datetime.utcfromtimestamp(taken_at)
+        return self.taken_at
+
+    def _load(self, view: memoryview) -> float:
+        columns: List[memoryview] = []
+        try:
+            magic, version, little, window, taken_at, count, slots = Header.unpack_from(view)
+            if magic != Magic or version != Version or bool(little) != (sys.byteorder == 'little'):
+                raise ValueError('unknown format of snapshot')
+            offset = Header.size + _pad(Header.size)
+            sizes = [16 * count, 2 * count, 2 * count] + [array(typecode).itemsize * count
+                                                          for _, typecode in IndexLayout]
+            index_columns = len(sizes)
+            if slots:
+                sizes += [8 * slots, 2 * slots, 4 * slots, 4 * slots, window * slots]
+            for size in sizes:
+                if offset + size > len(view):
+                    raise ValueError('snapshot is truncated')
+                columns.append(view[offset:offset + size])
+                offset += size + _pad(size)
+            if self.index is not None:
+                self.index.restore(self._index_entries(*columns[:index_columns]))
+            if slots and self.health_store is not None:
+                if window != self.health_store.window:
+                    raise ValueError(f'window of snapshot {window} != {self.health_store.window}')
+                keys, bits, checks, score = array('Q'), array('H'), array('I'), array('f')
+                health = columns[index_columns:]
+                for column, data in zip((keys, bits, checks, score), health[:4]):
+                    column.frombytes(data)
+                self.health_store.restore(keys, bits, bytearray(health[4]), checks, score)
+            return taken_at
+        finally:
+            # mmap is closed after load, no views may stay exported
+            for column in columns:
+                column.release()
+            view.release()
+
+    @staticmethod
+    def _index_entries(hosts: memoryview, ports: memoryview, countries: memoryview,
+                       *values: memoryview) -> Dict[Tuple[str, int], IndexEntry]:
+        """columns to lists at once, no python object per cell of memoryview"""
+        hosts, countries = hosts.tobytes(), countries.tobytes()
+        columns = [ports.cast('H')] + [column.cast(typecode) for column, (_, typecode) in zip(values, IndexLayout)]
+        try:
+            lists = [column.tolist() for column in columns]
+        finally:
+            for column in columns:
+                column.release()
+        ports = lists[0]
+        decoded = {attr: _decode(attr, typecode, column) for (attr, typecode), column in zip(IndexLayout, lists[1:])}
+        decoded['country'] = [None if countries[2 * n:2 * n + 2] == NoCountry else
+                              countries[2 * n:2 * n + 2].decode('ascii') for n in range(len(ports))]
+        prefix, ntop = Ipv4Prefix, socket.inet_ntop
+        ipv4, ipv6 = socket.AF_INET, socket.AF_INET6
+        keys = []
+        for n, port in enumerate(ports):
+            packed = hosts[16 * n:16 * n + 16]
+            keys.append((ntop(ipv4, packed[12:]) if packed[:12] == prefix else ntop(ipv6, packed), port))
+        return {key: IndexEntry(*entry_values)
+                for key, entry_values in zip(keys, zip(*(decoded[attr] for attr in IndexEntry.__slots__)))}
+
+    async def catch_up(self, proxy_db) -> int:
+        """rows of proxies checked after snapshot"""
+        if self.taken_at is None:
+            return 0
+        since = self.taken_at - datetime.timedelta(seconds=self.catch_up_margin)
+        rows = await proxy_db.select_index_rows(updated_after=since)
+        for row in rows:
+            host = str(row['host'])
+            if self.index is not None:
+                self.index.apply_row(row)
+            if self.health_store is not None and row['health_checks']:
+                self.health_store.load(proxy_key(host, row['port']), row['health_bits'], row['health_latency'],
+                                       row['health_checks'])
+        logger.info(f'snapshot of {self.taken_at} caught up: {len(rows)} proxies')
+        return len(rows)
+
+    async def start(self) -> None:
+        self._instance_start = create_task(self._start())
+
+    def stop(self) -> None:
+        if self._instance_start:
+            self._instance_start.cancel()
+
+    async def _start(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.save()
+            except OSError as e:
+                logger.error(f'snapshot {self.path} :: {e}, {e.args}')
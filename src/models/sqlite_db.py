@@ -0,0 +1,262 @@
+import datetime
+import ipaddress
+import logging
+import operator
+from typing import List, Optional, Sequence
+from sqlalchemy import Boolean, DateTime, Float, Integer, LargeBinary, Table
+from .db import proxy_table, location_table
+from .storage import (ProxyStorage, LocationStorage, ProxyListColumns, CredentialColumns, IndexColumns,
+                      IndexHistoryColumns, GeoColumns, proxy_filters, proxy_sort)
+
+try:
+    import aiosqlite
+except ImportError:  # optional, storage backend sqlite
+    aiosqlite = None
+
+logger = logging.getLogger(__name__)
+
+__all__ = ('SqliteDb', 'SqliteProxyDb', 'SqliteLocationDb')
+
+SqlOperators = {operator.eq: '=', operator.le: '<=', operator.ge: '>='}
+
+
+def _sqlite_type(column) -> str:
+    for type_, name in ((Boolean, 'BOOLEAN'), (DateTime, 'TIMESTAMP'), (Integer, 'INTEGER'), (Float, 'REAL'),
+                        (LargeBinary, 'BLOB')):
+        if isinstance(column.type, type_):
+            return name
+    return 'TEXT'
+
+
+def _create_table(table: Table, constraint: str) -> str:
+    columns = []
+    for column in table.c:
+        default = column.default.arg if column.default is not None else None
+        columns.append(f'{column.name} {_sqlite_type(column)}' + (f' DEFAULT {int(default)}'
+                                                                  if isinstance(default, bool) else ''))
+    return f'CREATE TABLE IF NOT EXISTS {table.name} ({", ".join(columns + [constraint])})'
+
+
+# same tables as migrations, INET as text; partial indexes of claims as migrations/0002_proxy_claim_indexes.sql
+Schema = (
+    _create_table(location_table, 'PRIMARY KEY (ip)'),
+    _create_table(proxy_table, 'UNIQUE (host, port)'),
+    'CREATE INDEX IF NOT EXISTS ix_proxy_claim_new ON proxy (date_creation) '
+    'WHERE date_update IS NULL AND in_process = 0',
+    'CREATE INDEX IF NOT EXISTS ix_proxy_claim_due ON proxy (date_update) WHERE in_process = 0',
+    'CREATE INDEX IF NOT EXISTS ix_proxy_country_alive_latency ON proxy (country_code, is_alive, latency)',
+)
+ProxyColumns = frozenset(column.name for column in proxy_table.c)
+LocationColumns = frozenset(column.name for column in location_table.c)
+# sqlite stores BOOLEAN as 0/1, TIMESTAMP as iso text
+Converters = {column.name: bool if _sqlite_type(column) == 'BOOLEAN' else datetime.datetime.fromisoformat
+              for table in (proxy_table, location_table) for column in table.c
+              if _sqlite_type(column) in ('BOOLEAN', 'TIMESTAMP')}
+
+
+def _row(cursor, values: tuple) -> dict:
+    row = {}
+    for description, value in zip(cursor.description, values):
+        name = description[0]
+        if value is not None and name in Converters:
+            value = Converters[name](value)
+        row[name] = value
+    return row
+
+
+def _value(value):
+    if isinstance(value, datetime.datetime):
+        return value.isoformat(sep=' ', timespec='microseconds')
+    if isinstance(value, (ipaddress.IPv4Address, ipaddress.IPv6Address)):
+        return str(value)
+    return value
+
+
+def _columns(kwargs: dict, columns: frozenset) -> None:
+    unknown = set(kwargs).difference(columns)
+    if unknown:
+        raise ValueError(f'unknown columns {sorted(unknown)}')
+
+
+class SqliteDb:
+    """Connection of sqlite file, shared by SqliteProxyDb and SqliteLocationDb, tables created on connect.
+    Autocommit, one statement is a transaction: claims are UPDATE ... RETURNING (sqlite >= 3.35),
+    WAL - readers of other processes do not wait for writer.
+
+    sqlite_db = await SqliteDb('proxies.sqlite3').connect()
+    proxy_db = SqliteProxyDb(db_connect=sqlite_db)
+    """
+    _connection: Optional['aiosqlite.Connection'] = None
+
+    def __init__(self, path: str = ':memory:', busy_timeout: float = 5):
+        """busy_timeout - seconds of wait for lock of other process"""
+        self.path = path
+        self.busy_timeout = busy_timeout
+
+    async def connect(self) -> 'SqliteDb':
+        if aiosqlite is None:
+            raise RuntimeError('storage backend sqlite needs aiosqlite: pip install aiosqlite')
+        self._connection = await aiosqlite.connect(self.path, isolation_level=None)
+        self._connection.row_factory = _row
+        await self._connection.execute(f'PRAGMA busy_timeout = {int(self.busy_timeout * 1000)}')
+        if self.path != ':memory:':
+            await self._connection.execute('PRAGMA journal_mode = WAL')
+        for statement in Schema:
+            await self._connection.execute(statement)
+        return self
+
+    async def close(self) -> None:
+        if self._connection is not None:
+            await self._connection.close()
+
+    async def execute(self, query: str, params: Sequence = ()) -> int:
+        """rowcount"""
+        async with self._connection.execute(query, [_value(param) for param in params]) as cursor:
+            return cursor.rowcount
+
+    async def fetch(self, query: str, params: Sequence = ()) -> List[dict]:
+        async with self._connection.execute(query, [_value(param) for param in params]) as cursor:
+            return await cursor.fetchall()
+
+    async def fetchrow(self, query: str, params: Sequence = ()) -> Optional[dict]:
+        rows = await self.fetch(query, params)
+        return rows[0] if rows else None
+
+
+class SqliteLocationDb(LocationStorage):
+    _db: SqliteDb
+
+    def __init__(self, db_connect: SqliteDb):
+        self._db = db_connect
+
+    async def insert_location(self, **kwargs) -> str:
+        _columns(kwargs, LocationColumns)
+        names = list(kwargs)
+        count = await self._db.execute(
+            f'INSERT OR IGNORE INTO location ({", ".join(names)}) VALUES ({", ".join("?" * len(names))})',
+            [kwargs[name] for name in names])
+        return f'INSERT 0 {count}'
+
+    async def select_pm(self, ip: str) -> Optional[dict]:
+        return await self._db.fetchrow('SELECT * FROM location WHERE ip = ?', [ip])
+
+    async def delete_for_ip(self, ip: str) -> str:
+        return f'DELETE {await self._db.execute("DELETE FROM location WHERE ip = ?", [ip])}'
+
+    async def exist_ip(self, ip: str) -> bool:
+        return await self._db.fetchrow('SELECT 1 FROM location WHERE ip = ?', [ip]) is not None
+
+
+class SqliteProxyDb(ProxyStorage):
+    """Proxies in sqlite, see ProxyStorage, same queries as ProxyDb"""
+    _db: SqliteDb
+
+    def __init__(self, db_connect: SqliteDb, delta_minutes_for_check: int = 60, owner: Optional[str] = None,
+                 lease_seconds: int = 300):
+        super().__init__(delta_minutes_for_check=delta_minutes_for_check, owner=owner, lease_seconds=lease_seconds)
+        self._db = db_connect
+
+    async def insert_proxy(self, **kwargs) -> str:
+        _columns(kwargs, ProxyColumns)
+        kwargs.setdefault('date_creation', datetime.datetime.utcnow())
+        names = list(kwargs)
+        count = await self._db.execute(
+            f'INSERT OR IGNORE INTO proxy ({", ".join(names)}) VALUES ({", ".join("?" * len(names))})',
+            [kwargs[name] for name in names])
+        return f'INSERT 0 {count}'
+
+    async def select_proxy_pm(self, host: str, port: int) -> Optional[dict]:
+        return await self._db.fetchrow('SELECT * FROM proxy WHERE host = ? AND port = ?', [host, port])
+
+    async def delete_proxy_pm(self, host: str, port: int) -> str:
+        return f'DELETE {await self._db.execute("DELETE FROM proxy WHERE host = ? AND port = ?", [host, port])}'
+
+    async def update_proxy_pm(self, **kwargs) -> str:
+        host = kwargs.pop('host')
+        port = kwargs.pop('port')
+        _columns(kwargs, ProxyColumns)
+        names = list(kwargs)
+        count = await self._db.execute(
+            f'UPDATE proxy SET {", ".join(f"{name} = ?" for name in names)} WHERE host = ? AND port = ?',
+            [kwargs[name] for name in names] + [host, port])
+        return f'UPDATE {count}'
+
+    async def update_claimed_proxy(self, **kwargs) -> str:
+        host = kwargs.pop('host')
+        port = kwargs.pop('port')
+        _columns(kwargs, ProxyColumns)
+        names = list(kwargs)
+        count = await self._db.execute(
+            f'UPDATE proxy SET {", ".join(f"{name} = ?" for name in names)} '
+            f'WHERE host = ? AND port = ? AND claimed_by = ?',
+            [kwargs[name] for name in names] + [host, port, self.owner])
+        return f'UPDATE {count}'
+
+    async def select_proxies(self, sort: str = '-health_score', limit: int = 100, offset: int = 0,
+                             credentials: bool = False, **filters) -> List[dict]:
+        """filters of proxy_filters, same order as ProxyDb.query_select_proxies"""
+        column, descending = proxy_sort(sort)
+        conditions = proxy_filters(**filters)
+        where = ' AND '.join(f'{name} {SqlOperators[op]} ?' for name, op, value in conditions) or '1'
+        columns = ProxyListColumns + CredentialColumns if credentials else ProxyListColumns
+        return await self._db.fetch(
+            f'SELECT {", ".join(columns)} FROM proxy WHERE {where} '
+            f'ORDER BY {column} {"DESC" if descending else "ASC"} NULLS LAST LIMIT ? OFFSET ?',
+            [value for name, op, value in conditions] + [limit, offset])
+
+    async def select_index_rows(self, updated_after: Optional[datetime.datetime] = None) -> List[dict]:
+        if updated_after is None:
+            return await self._db.fetch(f'SELECT {", ".join(IndexColumns)} FROM proxy')
+        return await self._db.fetch(f'SELECT {", ".join(IndexColumns + IndexHistoryColumns)} FROM proxy '
+                                    f'WHERE date_update > ?', [updated_after])
+
+    async def select_geo_rows(self) -> List[dict]:
+        columns = ', '.join(f'location.{name}' if name in ('latitude', 'longitude') else f'proxy.{name}'
+                            for name in GeoColumns)
+        return await self._db.fetch(f'SELECT {columns} FROM proxy JOIN location ON location.ip = proxy.location_ip')
+
+    async def _claim_where(self, where: str, params: list) -> Optional[dict]:
+        return await self._db.fetchrow(
+            f'UPDATE proxy SET in_process = 1, claimed_by = ?, claimed_until = ? WHERE {where} RETURNING *',
+            [self.owner, self.lease_deadline()] + params)
+
+    async def select_and_set_proxy_to_process(self) -> Optional[dict]:
+        """never checked proxy (index ix_proxy_claim_new), else due proxy (ix_proxy_claim_due),
+        row before claim as ProxyDb returns
+        """
+        row = await self._claim_where(
+            'rowid = (SELECT rowid FROM proxy WHERE date_update IS NULL AND in_process = 0 '
+            'ORDER BY date_creation LIMIT 1)', [])
+        if row is None:
+            row = await self._claim_where(
+                'rowid = (SELECT rowid FROM proxy WHERE date_update < ? AND in_process = 0 '
+                'ORDER BY date_update LIMIT 1)', [self.due_before()])
+        if row is not None:
+            # RETURNING gives columns after update
+            row.update(in_process=False, claimed_by=None, claimed_until=None)
+        return row
+
+    async def select_schedule(self) -> List[dict]:
+        return await self._db.fetch('SELECT host, port, date_update FROM proxy')
+
+    async def claim_proxy(self, host: str, port: int) -> Optional[dict]:
+        return await self._claim_where('host = ? AND port = ? AND in_process = 0 '
+                                       'AND (date_update IS NULL OR date_update < ?)', [host, port, self.due_before()])
+
+    async def renew_lease(self, host: str, port: int) -> bool:
+        count = await self._db.execute(
+            'UPDATE proxy SET claimed_until = ? WHERE host = ? AND port = ? AND in_process = 1 AND claimed_by = ?',
+            [self.lease_deadline(), host, port, self.owner])
+        return count == 1
+
+    async def release_expired_leases(self) -> str:
+        count = await self._db.execute(
+            'UPDATE proxy SET in_process = 0, claimed_by = NULL, claimed_until = NULL '
+            'WHERE in_process = 1 AND (claimed_until < ? OR claimed_until IS NULL)', [datetime.datetime.utcnow()])
+        return f'UPDATE {count}'
+
+    async def release_owner_leases(self) -> str:
+        count = await self._db.execute(
+            'UPDATE proxy SET in_process = 0, claimed_by = NULL, claimed_until = NULL '
+            'WHERE in_process = 1 AND claimed_by = ?', [self.owner])
+        return f'UPDATE {count}'
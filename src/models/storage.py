@@ -0,0 +1,161 @@
+import datetime
+import operator
+import os
+import socket
+import uuid
+from abc import ABC, abstractmethod
+from typing import Any, Callable, List, Optional, Tuple
+
+__all__ = ('ProxyStorage', 'LocationStorage', 'ProxyListColumns', 'CredentialColumns', 'ProxySortKeys',
+           'proxy_filters', 'proxy_sort', 'create_owner_id')
+
+# columns of select_proxies, GET /proxies
+ProxyListColumns = ('host', 'port', 'scheme', 'is_alive', 'latency', 'ttfb', 'throughput', 'anonymity', 'https',
+                    'health_score', 'uptime', 'latency_p90', 'country_code', 'date_update')
+# with select_proxies(credentials=True) only, never served by api
+CredentialColumns = ('login', 'password')
+ProxySortKeys = ('latency', 'ttfb', 'throughput', 'health_score', 'uptime', 'latency_p90', 'date_update')
+# columns of select_index_rows: ProxyIndex answers GET /proxies with columns of db, with updated_after
+IndexColumns = ProxyListColumns
+IndexHistoryColumns = ('health_bits', 'health_latency', 'health_checks')
+GeoColumns = ('host', 'port', 'is_alive', 'latency', 'latitude', 'longitude')
+# column, operator, value of proxy_filters
+Filter = Tuple[str, Callable[[Any, Any], Any], Any]
+
+
+def create_owner_id() -> str:
+    """unique id of worker, owner of claimed proxies: host:pid:random"""
+    return f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+
+
+def proxy_filters(is_alive: Optional[bool] = True, scheme: Optional[str] = None, anonymity: Optional[str] = None,
+                  https: Optional[bool] = None, max_latency: Optional[float] = None,
+                  min_throughput: Optional[float] = None, country: Optional[str] = None) -> List[Filter]:
+    """filters of select_proxies: (column, operator, value), operator is applied to column of query or value of row,
+    NULL of row passes no filter
+    """
+    filters = []
+    for column, value in (('is_alive', is_alive), ('scheme', scheme), ('anonymity', anonymity), ('https', https),
+                          ('country_code', country)):
+        if value is not None:
+            filters.append((column, operator.eq, value))
+    if max_latency is not None:
+        filters.append(('latency', operator.le, max_latency))
+    if min_throughput is not None:
+        filters.append(('throughput', operator.ge, min_throughput))
+    return filters
+
+
+def proxy_sort(sort: str) -> Tuple[str, bool]:
+    """column of ProxySortKeys, descending ('-column'), NULLs last in both orders"""
+    column = sort.lstrip('-')
+    if column not in ProxySortKeys:
+        raise ValueError(f'sort must be one of {ProxySortKeys}, got {sort!r}')
+    return column, sort.startswith('-')
+
+
+class ProxyStorage(ABC):
+    """Storage of proxies of pipeline: ProxyDb (postgres), SqliteProxyDb, MemoryProxyDb.
+    Rows are mappings of columns of proxy_table (row['host'], dict(row)),
+    writes return status as postgres does: 'INSERT 0 1', 'UPDATE 1', 'DELETE 1'.
+
+    Claimed proxy (in_process = true) is a lease of owner (claimed_by) until claimed_until,
+    owner renews lease while checking, expired leases released by release_expired_leases
+    """
+    delta_minutes_for_check: int
+    owner: str
+    lease_seconds: int
+
+    def __init__(self, delta_minutes_for_check: int = 60, owner: Optional[str] = None, lease_seconds: int = 300):
+        self.delta_minutes_for_check = delta_minutes_for_check
+        self.owner = owner if owner else create_owner_id()
+        self.lease_seconds = lease_seconds
+
+    def lease_deadline(self) -> datetime.datetime:
+        return datetime.datetime.utcnow() + datetime.timedelta(seconds=self.lease_seconds)
+
+    def due_before(self) -> datetime.datetime:
+        """proxy checked before is due for check"""
+        return datetime.datetime.utcnow() - datetime.timedelta(minutes=self.delta_minutes_for_check)
+
+    @abstractmethod
+    async def insert_proxy(self, **kwargs):
+        """insert, skip existing host and port"""
+
+    @abstractmethod
+    async def select_proxy_pm(self, host: str, port: int):
+        pass
+
+    @abstractmethod
+    async def delete_proxy_pm(self, host: str, port: int):
+        pass
+
+    @abstractmethod
+    async def update_proxy_pm(self, **kwargs):
+        """update columns of kwargs of proxy of kwargs host and port"""
+
+    @abstractmethod
+    async def update_claimed_proxy(self, **kwargs):
+        """update_proxy_pm of proxy claimed by self.owner, 'UPDATE 0' if lease is lost (released or claimed by
+        other owner)
+        """
+
+    @abstractmethod
+    async def select_proxies(self, **kwargs) -> list:
+        """columns ProxyListColumns (+ CredentialColumns with credentials=True), kwargs - filters of proxy_filters,
+        sort (proxy_sort), limit, offset
+        """
+
+    @abstractmethod
+    async def select_index_rows(self, updated_after: Optional[datetime.datetime] = None) -> list:
+        """IndexColumns of ProxyIndex, updated_after - with IndexHistoryColumns of rows checked later"""
+
+    @abstractmethod
+    async def select_geo_rows(self) -> list:
+        """GeoColumns of proxies with location saved on row"""
+
+    @abstractmethod
+    async def select_and_set_proxy_to_process(self):
+        """claim never checked proxy (oldest date_creation), else due proxy (oldest date_update), None if none.
+        Row is of state before claim (in_process false, not claimed), as select ... FOR UPDATE of ProxyDb
+        """
+
+    @abstractmethod
+    async def select_schedule(self) -> list:
+        """host, port, date_update of all proxies"""
+
+    @abstractmethod
+    async def claim_proxy(self, host: str, port: int):
+        """claim proxy if it is not claimed and it is due, row after claim (RETURNING) or None"""
+
+    @abstractmethod
+    async def renew_lease(self, host: str, port: int) -> bool:
+        """extend lease of own claimed proxy, False if lease lost"""
+
+    @abstractmethod
+    async def release_expired_leases(self) -> str:
+        pass
+
+    @abstractmethod
+    async def release_owner_leases(self) -> str:
+        """release all proxies claimed by self.owner, use on shutdown"""
+
+
+class LocationStorage(ABC):
+    """Storage of locations of LocationTaskHandler: LocationDb (postgres), SqliteLocationDb, MemoryLocationDb"""
+
+    @abstractmethod
+    async def insert_location(self, **kwargs):
+        """insert, skip existing ip"""
+
+    @abstractmethod
+    async def select_pm(self, ip: str):
+        pass
+
+    @abstractmethod
+    async def delete_for_ip(self, ip: str):
+        pass
+
+    @abstractmethod
+    async def exist_ip(self, ip: str) -> bool:
+        pass
@@ -1 +1,4 @@
 from .default_parse import *
+from .scheduler import ParseScheduler
+from .extractor import ProxyExtractor
+from .html_pool import HtmlExtractor
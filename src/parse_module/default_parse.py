@@ -1,11 +1,18 @@
+import asyncio
+import collections
 import re
 import logging
-from typing import Optional, Union, Tuple
+import time
+from abc import ABC, abstractmethod
+from types import TracebackType
+from typing import Optional, Union, Tuple, Dict, Type, List
+from urllib.parse import urlsplit
 from aiohttp import ClientSession
+from .html_pool import HtmlExtractor
 
 logger = logging.getLogger(__name__)
 
-__all__ = ('request_get', 'DefaultParse')
+__all__ = ('request_get', 'DefaultParse', 'DomainLimiter', 'ParseReport')
 
 
 async def request_get(session: ClientSession, url: str, proxy: Optional[str] = None) -> Union[str, None]:
@@ -18,21 +25,148 @@ async def request_get(session: ClientSession, url: str, proxy: Optional[str] = N
         return text
 
 
-class DefaultParse:
-    """ """
+class DomainLimiter:
+    """Limit of concurrent connections per domain, shared by all sources"""
+    limit_per_domain: int
+    _semaphores: Dict[str, asyncio.Semaphore]
 
-    def __init__(self, session: ClientSession, proxy: Optional[str]):
-        self._session = session
-        self._proxy = proxy
+    def __init__(self, limit_per_domain: int = 4, limits: Optional[Dict[str, int]] = None):
+        self.limit_per_domain = limit_per_domain
+        self.limits = limits if limits else {}
+        self._semaphores = {}
+
+    def semaphore(self, url: str) -> asyncio.Semaphore:
+        domain = urlsplit(url).hostname or ''
+        if domain not in self._semaphores:
+            self._semaphores[domain] = asyncio.Semaphore(self.limits.get(domain, self.limit_per_domain))
+        return self._semaphores[domain]
+
+
+class ParseReport:
+    """Yield of one run of source"""
+
+    def __init__(self, source: str):
+        self.source = source
+        self.new = 0
+        self.duplicate = 0
+        self.invalid = 0
+        self.skipped = 0  # unchanged pages and archives processed before
+        self.error: Optional[str] = None
+        self.started = time.time()
+        self.finished: Optional[float] = None
+
+    def as_dict(self) -> dict:
+        return {k: v for k, v in self.__dict__.items()}
+
+    def __repr__(self):
+        return str(self.as_dict())
+
+
+class _Limits:
+    """acquire semaphore of source and semaphore of domain"""
+
+    def __init__(self, *semaphores: asyncio.Semaphore):
+        self.semaphores = semaphores
+
+    async def __aenter__(self) -> None:
+        for semaphore in self.semaphores:
+            await semaphore.acquire()
+
+    async def __aexit__(self, exc_type: Optional[Type[BaseException]], exc_val: Optional[BaseException],
+                        exc_tb: Optional[TracebackType]) -> None:
+        for semaphore in reversed(self.semaphores):
+            semaphore.release()
+
+
+class DefaultParse(ABC):
+    """Base of proxy list sources. Subclass with name is registered in DefaultParse.registry
+    and crawled by ParseScheduler every interval seconds, concurrency - max requests of source at once.
+    Proxies put by source are remembered (seen_size last ones) across runs: found again - duplicate of report.
+
+    class MySource(DefaultParse):
+        name = 'my_source'
+        interval = 3600
+
+        async def parse(self):
+            text = await self.get_page(self.base_url)
+            for proxy in self.create_proxies(text):
+                await self.put_out_queue(proxy)
+    """
+    registry: Dict[str, Type['DefaultParse']] = {}
+    name: Optional[str] = None
+    base_url: Optional[str] = None
+    interval: float = 3600
+    concurrency: int = 4
+    enabled: bool = True
+    seen_size: int = 100000
+    out_queue: Optional[asyncio.Queue]
+    report: ParseReport
+    _seen: 'collections.OrderedDict[Tuple[str, int], None]'
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if cls.name:
+            DefaultParse.registry[cls.name] = cls
+
+    def __init__(self, client_session: ClientSession, url: Optional[str] = None, http_proxy: Optional[str] = None,
+                 out_queue: Optional[asyncio.Queue] = None, domain_limiter: Optional[DomainLimiter] = None,
+                 html_extractor: Optional[HtmlExtractor] = None):
+        if url:
+            self.base_url = url
+        self._client_session = client_session
+        self._http_proxy = http_proxy
+        self.out_queue = out_queue
+        self.domain_limiter = domain_limiter if domain_limiter else DomainLimiter()
+        self.html_extractor = html_extractor if html_extractor else HtmlExtractor(max_workers=0)
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        self._seen = collections.OrderedDict()
+        self.report = ParseReport(source=self.name)
+
+    def limit(self, url: str) -> _Limits:
+        """async with self.limit(url): request"""
+        return _Limits(self._semaphore, self.domain_limiter.semaphore(url))
 
     async def get_page(self, url: str) -> Union[str, None]:
         try:
-            text = await request_get(session=self._session, url=url, proxy=self._proxy)
+            async with self.limit(url):
+                text = await request_get(session=self._client_session, url=url, proxy=self._http_proxy)
         except Exception as e:
-            logger.error(f'--- get {url} - {e}, {e.args}')
-            logger.exception(e)
+            logger.error('--- get %s - %r', url, e)
             text = None
         return text
 
+    async def xpath(self, html: str, xpath: str) -> List[str]:
+        """xpath of html page, in process pool of html_extractor"""
+        return await self.html_extractor.xpath(html, xpath)
+
+    @abstractmethod
+    async def parse(self) -> None:
+        """crawl of source, proxies to put_out_queue"""
+
+    async def run(self) -> ParseReport:
+        """one crawl of source, return yield"""
+        self.report = ParseReport(source=self.name)
+        try:
+            await self.parse()
+        except Exception as e:
+            self.report.error = f'{e.__class__.__name__}: {e}'
+            raise
+        finally:
+            self.report.finished = time.time()
+        return self.report
+
+    async def put_out_queue(self, proxy) -> None:
+        key = (proxy.host, proxy.port)
+        if key in self._seen:
+            self._seen.move_to_end(key)
+            self.report.duplicate += 1
+            return
+        self._seen[key] = None
+        while len(self._seen) > self.seen_size:
+            self._seen.popitem(last=False)
+        self.report.new += 1
+        proxy.source = self.name
+        await self.out_queue.put(proxy)
+
     def parse_text_to_proxy(self, text: str) -> Union[Tuple[str, ...], None]:
-        pass
\ No newline at end of file
+        pass
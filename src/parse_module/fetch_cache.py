@@ -0,0 +1,97 @@
+import collections
+import hashlib
+import logging
+from typing import Dict, Optional, Tuple
+from multidict import CIMultiDictProxy
+
+logger = logging.getLogger(__name__)
+
+__all__ = ('FetchCache', 'CacheEntry', 'content_hash')
+
+
+def content_hash(body: bytes) -> str:
+    return hashlib.sha1(body).hexdigest()
+
+
+class CacheEntry:
+    __slots__ = ('url', 'etag', 'last_modified', 'content_hash', 'body', 'encoding')
+
+    def __init__(self, url: str, etag: Optional[str], last_modified: Optional[str], content_hash: str,
+                 body: Optional[bytes], encoding: Optional[str]):
+        self.url = url
+        self.etag = etag
+        self.last_modified = last_modified
+        self.content_hash = content_hash
+        self.body = body
+        self.encoding = encoding
+
+
+class FetchCache:
+    """Per url ETag, Last-Modified and hash of content, for conditional requests of parsers,
+    plus keys (urls, content hashes) already processed by parser, last max_processed of them.
+
+    headers = cache.conditional_headers(url)
+    # response 304 -> cache.get(url).body, 200 -> cache.store(...)
+    """
+    max_entries: int
+    _entries: 'collections.OrderedDict[str, CacheEntry]'
+    _processed: 'collections.OrderedDict[str, None]'
+
+    def __init__(self, max_entries: int = 4096, max_processed: int = 16384):
+        self.max_entries = max_entries
+        self.max_processed = max_processed
+        self._entries = collections.OrderedDict()
+        self._processed = collections.OrderedDict()
+        self.stats = {'requests': 0, 'not_modified': 0, 'unchanged': 0, 'bytes': 0}
+
+    def get(self, url: str) -> Optional[CacheEntry]:
+        entry = self._entries.get(url)
+        if entry:
+            self._entries.move_to_end(url)
+        return entry
+
+    def conditional_headers(self, url: str) -> Dict[str, str]:
+        entry = self.get(url)
+        headers = {}
+        if entry and entry.body is not None:
+            if entry.etag:
+                headers['If-None-Match'] = entry.etag
+            if entry.last_modified:
+                headers['If-Modified-Since'] = entry.last_modified
+        return headers
+
+    def store(self, url: str, headers: CIMultiDictProxy, body: bytes, encoding: Optional[str] = None,
+              keep_body: bool = True) -> Tuple[CacheEntry, bool]:
+        """save response 200, return entry and changed - content differs from cached"""
+        self.stats['requests'] += 1
+        self.stats['bytes'] += len(body)
+        digest = content_hash(body)
+        previous = self.get(url)
+        changed = previous is None or previous.content_hash != digest
+        if not changed:
+            self.stats['unchanged'] += 1
+        entry = CacheEntry(url=url, etag=headers.get('ETag'), last_modified=headers.get('Last-Modified'),
+                           content_hash=digest, body=body if keep_body else None, encoding=encoding)
+        self._entries[url] = entry
+        self._entries.move_to_end(url)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        return entry, changed
+
+    def not_modified(self, url: str) -> CacheEntry:
+        """response 304"""
+        self.stats['requests'] += 1
+        self.stats['not_modified'] += 1
+        return self.get(url)
+
+    def is_processed(self, key: str) -> bool:
+        if key in self._processed:
+            self._processed.move_to_end(key)
+            return True
+        return False
+
+    def mark_processed(self, key: str) -> None:
+        self._processed[key] = None
+        self._processed.move_to_end(key)
+        while len(self._processed) > self.max_processed:
+            self._processed.popitem(last=False)
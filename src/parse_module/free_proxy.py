@@ -1,20 +1,20 @@
 import asyncio
-import pathlib
-from typing import List
+from asyncio import create_task
+import json
+import logging
+from typing import Any, Iterator, List, Optional, Tuple, Union
 import aiohttp
-import sys
-from lxml import etree
-from io import StringIO
+from io import BytesIO
 # from .utils import HEADERS
 from .utils import IPPattern, IPPortPatternLine
+from .extractor import ProxyExtractor, ProxyTuple
+from .default_parse import DefaultParse
+from .fetch_cache import FetchCache, content_hash
 from ..models.client import Proxy
 import zipfile
 import re
-if sys.version_info < (3, 7)[:2]:
-    from asyncio import ensure_future as create_task
-else:
-    from asyncio import create_task
 
+logger = logging.getLogger(__name__)
 
 
 HEADERS = {
@@ -35,68 +35,94 @@ HEADERS = {
 # )
 
 
-class Sslproxies24_top:
+class Sslproxies24_top(DefaultParse):
 
+    name = 'sslproxies24_top'
     base_url = 'http://www.sslproxies24.top/'
+    interval = 6 * 3600
+    concurrency = 8
     _client_session: aiohttp.ClientSession
     _http_proxy: str
     headers: dict = HEADERS
     tokens = {}
     out_queue: asyncio.Queue
 
-    def __init__(self, client_session: aiohttp.ClientSession, url: str = None, http_proxy: str = None,
-                 out_queue: asyncio.Queue = None):
-        if url:
-            self.base_url = url
-        self._client_session = client_session
-        self._http_proxy = http_proxy
-        self.out_queue = out_queue
+    def __init__(self, *args, fetch_cache: Optional[FetchCache] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fetch_cache = fetch_cache if fetch_cache else FetchCache()
 
     async def _get_content(self, url: str = None, returned_body: str = 'text') -> str:
+        body, changed = await self._fetch(url=url, returned_body=returned_body)
+        return body
+
+    async def _fetch(self, url: str = None, returned_body: str = 'text') -> Tuple[Any, bool]:
+        """get url with conditional request (ETag/Last-Modified of previous response),
+        returned_body - text, json, read (bytes);
+        return body and changed - False if 304 or content hash is same as previous
+        """
         url = url if url else self.base_url
         t = self.tokens.get(url.split('/')[-1])
+        conditional = returned_body != 'read'
+        headers = dict(self.headers, **self.fetch_cache.conditional_headers(url)) if conditional else self.headers
         context = {
             'url': url,
             'proxy': self._http_proxy,
-            'headers': self.headers
+            'headers': headers
         }
         if t:
             context.update({'cookies': {'token': t}})
-        async with self._client_session.get(**context) as resp:
-            text = await getattr(resp, returned_body)()
-            # print('--', resp.cookies.get('token'))
-            if resp.cookies.get('token'):
-                token = resp.cookies.get('token').value
-                self.tokens.update({url.split('/')[-1]: token})
-
-        return text
+        async with self.limit(url):
+            async with self._client_session.get(**context) as resp:
+                if resp.status == 304:
+                    entry = self.fetch_cache.not_modified(url)
+                    body, encoding, changed = entry.body, entry.encoding, False
+                else:
+                    body = await resp.read()
+                    encoding = resp.get_encoding() if returned_body != 'read' else None
+                    entry, changed = self.fetch_cache.store(url, resp.headers, body, encoding=encoding,
+                                                            keep_body=conditional)
+                # print('--', resp.cookies.get('token'))
+                if resp.cookies.get('token'):
+                    token = resp.cookies.get('token').value
+                    self.tokens.update({url.split('/')[-1]: token})
+        if returned_body == 'text':
+            body = body.decode(encoding, errors='replace')
+        elif returned_body == 'json':
+            body = json.loads(body.decode(encoding, errors='replace'))
+        return body, changed
 
     async def parse(self):
         start_html = await self._get_content()
-        text = StringIO(start_html)
-        htmlparser = etree.HTMLParser()
-        tree = etree.parse(text, htmlparser)
-        hrefs = tree.xpath('//h3//a/@href')
+        hrefs = await self.xpath(start_html, '//h3//a/@href')
         tasks = []
         for url in hrefs:
-            task = create_task(self._get_content(url=url))
+            task = create_task(self._fetch(url=url))
             tasks.append(task)
         list_html = await asyncio.gather(*tasks)
 
-        hrefs = []
-        for html in list_html:
-            text = StringIO(html)
-            htmlparser = etree.HTMLParser()
-            tree = etree.parse(text, htmlparser)
-            hrefs.extend(tree.xpath("//div[contains(@id, 'post-body')]/a/@href"))
-
+        tasks = []
+        for url, (html, changed) in zip(hrefs, list_html):
+            if not changed and self.fetch_cache.is_processed(url):
+                self.report.skipped += 1
+                continue
+            tasks.append(create_task(self.parse_post(url=url, html=html)))
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        for result in results:
+            if isinstance(result, Exception):
+                logger.error('%s post :: %r', self.name, result)
+
+    async def parse_post(self, url: str, html: str):
+        """download archives of post, mark post as processed"""
+        hrefs = await self.xpath(html, "//div[contains(@id, 'post-body')]/a/@href")
 
+        tasks = []
         for href in hrefs:
-            print(href)
+            logger.debug('%s archive %s', self.name, href)
             task = create_task(self._get_content(url=href, returned_body='text'))
             tasks.append(task)
         answers = await asyncio.gather(*tasks)
 
+        tasks = []
         for href in hrefs:
             href = href.replace('/file/', '/start/')
             task = create_task(self._get_content(url=href, returned_body='text'))
@@ -106,7 +132,6 @@ class Sslproxies24_top:
         # https://workupload.com/api/file/getDownloadServer/3JmLAyaL39w
         tasks = []
         for href in hrefs:
-            print(href)
             if 'workupload.com' in href:
                 href = 'https://workupload.com/api/file/getDownloadServer/' + href.split('/')[-1]
             # print(href)
@@ -115,47 +140,51 @@ class Sslproxies24_top:
         answers = await asyncio.gather(*tasks)
         tasks = []
         for row in answers:
-            url = row['data']['url']
-            tasks.append(create_task(self._get_content(url=url, returned_body='read')))
+            url_archive = row['data']['url']
+            tasks.append(create_task(self._get_content(url=url_archive, returned_body='read')))
         answers = await asyncio.gather(*tasks)
-        n = 1
-        self.create_tmp_dir()
         for zipf in answers:
-            path = f'tmp/archive{str(n)}.zip'
-            with open(path, 'wb') as f:
-                f.write(zipf)
-            path_extract = path.split('.', 1)[0]
-            self.create_tmp_dir(path_extract)
-            n += 1
-            path_extract_dir = self.unzip(path)
-            path_extract_dir = pathlib.Path(path_extract_dir)
-            for child in path_extract_dir.iterdir():
-                if child.suffix == '.txt':
-                    with open(child) as f:
-                        text = f.read()
-                    proxies = self.create_proxies(text=text)
-                    for prx in proxies:
-                        print(prx)
-                        await self.put_out_queue(prx)
-
-    async def put_out_queue(self, proxy: Proxy):
-        await self.out_queue.put(proxy)
-
-    def create_proxies(self, text: str) -> List[Proxy]:
-        ips = IPPortPatternLine.findall(text)
-        proxies = [Proxy.create_from_url(f'http://{prx[0]}:{prx[1]}') for prx in ips]
+            digest = content_hash(zipf)
+            if self.fetch_cache.is_processed(digest):
+                self.report.skipped += 1
+                continue
+            await self.process_archive(zipf)
+            self.fetch_cache.mark_processed(digest)
+        self.fetch_cache.mark_processed(url)
+
+    async def process_archive(self, zipf: bytes):
+        """extract proxies from zip in memory, blocking unzip and scan in executor"""
+        loop = asyncio.get_event_loop()
+        extractor = ProxyExtractor()
+        tuples = await loop.run_in_executor(None, extract_archive_proxies, zipf, extractor)
+        self.report.invalid += extractor.invalid
+        for prx in extractor.create_proxies(tuples):
+            await self.put_out_queue(prx)
+
+    def create_proxies(self, text: Union[str, bytes]) -> List[Proxy]:
+        extractor = ProxyExtractor()
+        proxies = extractor.extract(text)
+        self.report.invalid += extractor.invalid
         return proxies
 
-    def create_tmp_dir(self, tmp_dir: str = 'tmp'):
-        path = pathlib.Path(tmp_dir)
-        if not(path.exists() and path.is_dir()):
-            path.mkdir(parents=True, exist_ok=True)
 
-    def unzip(self, path_to_zip_file: str):
-        if zipfile.is_zipfile(path_to_zip_file):
-            with zipfile.ZipFile(path_to_zip_file, 'r') as zip_ref:
-                zip_ref.extractall(path_to_zip_file.split('.')[0] + '/')
-        return path_to_zip_file.split('.')[0]
+def iter_archive_chunks(zipf: bytes, suffix: str = '.txt', chunk_size: int = 1 << 20) -> Iterator[bytes]:
+    """chunks of files with suffix in zip archive, read from memory"""
+    if not zipfile.is_zipfile(BytesIO(zipf)):
+        return
+    with zipfile.ZipFile(BytesIO(zipf)) as zip_ref:
+        for member in zip_ref.infolist():
+            if member.is_dir() or not member.filename.endswith(suffix):
+                continue
+            with zip_ref.open(member) as raw:
+                for chunk in iter(lambda: raw.read(chunk_size), b''):
+                    yield chunk
+            yield b'\n'
+
+
+def extract_archive_proxies(zipf: bytes, extractor: ProxyExtractor) -> List[ProxyTuple]:
+    """proxies from .txt files of zip archive, blocking - run in executor"""
+    return list(extractor.scan_stream(iter_archive_chunks(zipf)))
 
 
 async def _main():
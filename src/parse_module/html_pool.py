@@ -0,0 +1,64 @@
+import asyncio
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from io import StringIO
+from typing import List, Optional
+from lxml import etree
+
+logger = logging.getLogger(__name__)
+
+__all__ = ('HtmlExtractor', 'xpath_extract')
+
+# parser of worker process, created once and reused for all pages of worker
+_html_parser: Optional[etree.HTMLParser] = None
+
+
+def _init_worker() -> None:
+    global _html_parser
+    _html_parser = etree.HTMLParser()
+
+
+def xpath_extract(html: str, xpath: str) -> List[str]:
+    """parse html, return results of xpath as plain strings (hrefs, text)"""
+    if _html_parser is None:
+        _init_worker()
+    if not html:
+        return []
+    tree = etree.parse(StringIO(html), _html_parser)
+    if tree.getroot() is None:
+        return []
+    return [str(item) for item in tree.xpath(xpath)]
+
+
+class HtmlExtractor:
+    """HTML parsing and XPath of parsers in ProcessPoolExecutor, event loop is not blocked by lxml,
+    only extracted strings are sent back.
+    max_workers=0 - parse inline in event loop (tests, small pages)
+
+    html_extractor = HtmlExtractor(max_workers=2)
+    hrefs = await html_extractor.xpath(html, '//h3//a/@href')
+    html_extractor.shutdown()
+    """
+    max_workers: int
+    _executor: Optional[ProcessPoolExecutor]
+
+    def __init__(self, max_workers: int = 2):
+        self.max_workers = max_workers
+        self._executor = None
+
+    @property
+    def executor(self) -> Optional[ProcessPoolExecutor]:
+        if self._executor is None and self.max_workers > 0:
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers, initializer=_init_worker)
+        return self._executor
+
+    async def xpath(self, html: str, xpath: str) -> List[str]:
+        if not self.max_workers:
+            return xpath_extract(html, xpath)
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self.executor, xpath_extract, html, xpath)
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
@@ -0,0 +1,101 @@
+import asyncio
+from asyncio import create_task
+import collections
+import logging
+import random
+from typing import Deque, Dict, Iterable, Optional
+import aiohttp
+from .default_parse import DefaultParse, DomainLimiter, ParseReport
+from .html_pool import HtmlExtractor
+from . import free_proxy  # noqa register sources
+
+logger = logging.getLogger(__name__)
+
+__all__ = ('ParseScheduler', )
+
+
+class ParseScheduler:
+    """Run registered sources (DefaultParse.registry) periodically, every source in own task,
+    failure of source does not stop others.
+    Next run after interval * backoff +- jitter, backoff doubles (up to max_backoff)
+    when run failed or yield of new proxies less than min_yield, and resets otherwise.
+
+    sources_config = {'sslproxies24_top': {'interval': 3600, 'concurrency': 4, 'enabled': True}}
+    html_workers - processes of lxml parsing shared by sources, 0 - parse in event loop
+    """
+    parsers: Dict[str, DefaultParse]
+    backoff: Dict[str, float]
+    reports: Dict[str, Deque[ParseReport]]
+
+    def __init__(self, client_session: aiohttp.ClientSession, out_queue: asyncio.Queue,
+                 sources: Optional[Iterable[str]] = None, sources_config: Optional[Dict[str, dict]] = None,
+                 http_proxy: Optional[str] = None, limit_per_domain: int = 4, jitter: float = 0.1,
+                 max_backoff: float = 8, min_yield: float = 0.01, history_size: int = 20,
+                 html_workers: int = 2):
+        sources_config = sources_config if sources_config else {}
+        sources = sources if sources is not None else DefaultParse.registry.keys()
+        self.domain_limiter = DomainLimiter(limit_per_domain=limit_per_domain)
+        self.html_extractor = HtmlExtractor(max_workers=html_workers)
+        self.jitter = jitter
+        self.max_backoff = max_backoff
+        self.min_yield = min_yield
+        self.parsers = {}
+        for name in sources:
+            parser = DefaultParse.registry[name](client_session=client_session, http_proxy=http_proxy,
+                                                 out_queue=out_queue, domain_limiter=self.domain_limiter,
+                                                 html_extractor=self.html_extractor)
+            for attr, value in sources_config.get(name, {}).items():
+                setattr(parser, attr, value)
+            parser._semaphore = asyncio.Semaphore(parser.concurrency)
+            if parser.enabled:
+                self.parsers[name] = parser
+        self.backoff = {name: 1.0 for name in self.parsers}
+        self.reports = {name: collections.deque(maxlen=history_size) for name in self.parsers}
+        self._tasks = []
+
+    async def start(self) -> None:
+        for parser in self.parsers.values():
+            self._tasks.append(create_task(self._start(parser)))
+
+    def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        self.html_extractor.shutdown()
+
+    def is_running(self) -> bool:
+        return any(not task.done() for task in self._tasks)
+
+    async def run_source(self, parser: DefaultParse) -> ParseReport:
+        """run source once, isolate failure, update backoff"""
+        try:
+            report = await parser.run()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f'{parser.name} failed :: {e}, {e.args}')
+            logger.exception(e)
+            report = parser.report
+        self.reports[parser.name].append(report)
+        total = report.new + report.duplicate
+        if report.error or not total or report.new / total < self.min_yield:
+            self.backoff[parser.name] = min(self.backoff[parser.name] * 2, self.max_backoff)
+        else:
+            self.backoff[parser.name] = 1.0
+        logger.info(f'{parser.name} {report}, backoff {self.backoff[parser.name]}')
+        return report
+
+    def next_delay(self, parser: DefaultParse) -> float:
+        delay = parser.interval * self.backoff[parser.name]
+        return delay * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def stats(self) -> dict:
+        return {name: {'backoff': self.backoff[name],
+                       'interval': parser.interval,
+                       'last': self.reports[name][-1].as_dict() if self.reports[name] else None}
+                for name, parser in self.parsers.items()}
+
+    async def _start(self, parser: DefaultParse) -> None:
+        await asyncio.sleep(random.uniform(0, self.jitter * 10))
+        while True:
+            await self.run_source(parser)
+            await asyncio.sleep(self.next_delay(parser))
@@ -10,5 +10,10 @@ def setup_routes(app):
 	app.router.add_route('GET', '/', api.Root)
 	app.router.add_routes([
 		web.post('/proxy', api.ProxyHandler, ),
-		web.get('/stats', api.StatsHandler)
+		web.get('/stats', api.StatsHandler),
+		web.get('/stats/concurrency', api.ConcurrencyStatsHandler),
+		web.get('/judge', api.JudgeHandler),
+		web.get('/judge/payload', api.JudgePayloadHandler),
+		web.get('/proxies', api.ProxyListHandler),
+		web.get('/proxies/near', api.ProxyNearHandler),
 	])
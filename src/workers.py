@@ -0,0 +1,230 @@
+"""Multi-worker serving: api processes listen on one port (SO_REUSEPORT, kernel balances connections),
+one pipeline process runs checks, parsers, gateway and writes; supervisor restarts crashed processes.
+
+python entry.py --workers 4
+"""
+import asyncio
+from asyncio import create_task
+import logging
+import multiprocessing
+import multiprocessing.connection
+import queue
+import signal
+import socket
+import time
+from typing import List, Optional
+import src
+from .log import setup_logging
+
+logger = logging.getLogger(__name__)
+
+__all__ = ('WorkerSupervisor', 'WorkerProcess', 'ProxyForward', 'ProxyInbox', 'run_worker')
+
+WorkerLogFormat = '%(asctime)s %(processName)s %(levelname)s %(name)s: %(message)s'
+# columns of proxy of POST /proxy sent to pipeline
+ForwardColumns = ('host', 'port', 'login', 'password', 'scheme')
+
+
+class ProxyForward:
+    """queue_api_to_db of api worker: proxies of POST /proxy go to pipeline process by queue of supervisor"""
+
+    def __init__(self, worker_queue: 'multiprocessing.Queue'):
+        self._queue = worker_queue
+
+    async def put(self, proxy: 'src.Proxy') -> None:
+        # unbounded queue, feeder thread of queue writes to pipe: no wait in event loop
+        self._queue.put_nowait(tuple(getattr(proxy, name) for name in ForwardColumns))
+
+
+class ProxyInbox:
+    """pipeline process: proxies of ProxyForward of api workers to queue_api_to_db, lane user"""
+    _instance_start: Optional[asyncio.Task] = None
+
+    def __init__(self, worker_queue: 'multiprocessing.Queue', outgoing_queue, poll_timeout: float = 1):
+        self._queue = worker_queue
+        self.outgoing_queue = outgoing_queue
+        self.poll_timeout = poll_timeout
+        self.received = 0
+
+    def _get(self) -> Optional[tuple]:
+        try:
+            return self._queue.get(timeout=self.poll_timeout)
+        except queue.Empty:
+            return None
+
+    async def start(self) -> None:
+        self._instance_start = create_task(self._start())
+
+    def stop(self) -> None:
+        if self._instance_start:
+            self._instance_start.cancel()
+
+    async def _start(self) -> None:
+        loop = asyncio.get_event_loop()
+        while True:
+            # blocking get in thread, wakes up every poll_timeout seconds
+            values = await loop.run_in_executor(None, self._get)
+            if values is None:
+                continue
+            proxy = src.Proxy(**dict(zip(ForwardColumns, values)))
+            proxy.lane = 'user'
+            self.received += 1
+            await self.outgoing_queue.put(proxy)
+
+
+class WorkerProcess:
+    """slot of supervisor: role of process, port, restart backoff"""
+    process: Optional[multiprocessing.Process] = None
+
+    def __init__(self, name: str, role: str, port: Optional[int]):
+        self.name = name
+        self.role = role
+        self.port = port
+        self.started = 0.0
+        self.restarts = 0
+        self.delay = 0.0
+        self.restart_at = 0.0
+
+    def exited(self, now: float, restart_delay: float, max_restart_delay: float, stable_seconds: float) -> float:
+        """schedule restart: delay doubles while process dies before stable_seconds, else restart_delay"""
+        if now - self.started >= stable_seconds:
+            self.delay = restart_delay
+        else:
+            self.delay = min(max(self.delay * 2, restart_delay), max_restart_delay)
+        self.restart_at = now + self.delay
+        self.restarts += 1
+        return self.delay
+
+    def stats(self) -> dict:
+        return {'name': self.name, 'role': self.role, 'pid': self.process.pid if self.process else None,
+                'restarts': self.restarts}
+
+
+def run_worker(role: str, config: dict, host: str, port: Optional[int], worker_queue) -> None:
+    """target of process of supervisor (spawn): own logging, event loop and app of role.
+    pipeline without port does not serve http
+    """
+    from aiohttp import web
+    setup_logging(config.get('LOGGING_LEVEL', 'INFO'), rate_limit=config.get('logging_rate_limit'),
+                  fmt=WorkerLogFormat)
+    try:
+        import uvloop
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    except ImportError:
+        pass
+    app = src.create_app(config=config, role=role, worker_queue=worker_queue)
+    if port is None:
+        asyncio.run(_run_without_site(app))
+        return
+    web.run_app(app, host=host, port=port, reuse_port=role == 'api', print=logger.info)
+
+
+async def _run_without_site(app) -> None:
+    from aiohttp import web
+    runner = web.AppRunner(await app, handle_signals=False)
+    # on_startup, on_cleanup of app as run_app does
+    await runner.setup()
+    stop = asyncio.Event()
+    loop = asyncio.get_event_loop()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signum, stop.set)
+    try:
+        await stop.wait()
+    finally:
+        await runner.cleanup()
+
+
+class WorkerSupervisor:
+    """Pipeline process and workers api processes on host:port, processes are started by spawn (no state of
+    parent, own event loop), crashed process is restarted with backoff. SIGTERM / SIGINT - graceful stop of all.
+    Storage is shared by processes: postgres or sqlite.
+
+    WorkerSupervisor(config, port=5000, workers=4).run()
+    """
+    slots: List[WorkerProcess]
+
+    def __init__(self, config: dict, host: str = '0.0.0.0', port: int = 5000, workers: int = 2,
+                 pipeline_port: Optional[int] = None, restart_delay: float = 1, max_restart_delay: float = 30,
+                 stable_seconds: float = 60, shutdown_timeout: float = 30):
+        """pipeline_port - port of /stats of pipeline process, not served if None"""
+        self.config = config
+        self.host = host
+        self.port = int(port)
+        self.restart_delay = restart_delay
+        self.max_restart_delay = max_restart_delay
+        self.stable_seconds = stable_seconds
+        self.shutdown_timeout = shutdown_timeout
+        self._context = multiprocessing.get_context('spawn')
+        self.worker_queue = self._context.Queue()
+        self.slots = [WorkerProcess('pipeline', 'pipeline', pipeline_port)]
+        self.slots += [WorkerProcess(f'api-{n}', 'api', self.port) for n in range(1, workers + 1)]
+        self._stopping = False
+
+    def check(self) -> None:
+        """errors before start of processes: storage of process, port is taken"""
+        if not hasattr(socket, 'SO_REUSEPORT'):
+            raise RuntimeError('multi-worker serving needs SO_REUSEPORT, not supported on this platform')
+        backend = self.config.get('storage', {}).get('backend', 'postgres')
+        if backend == 'memory':
+            raise ValueError('storage backend memory is per process, workers need postgres or sqlite')
+        family, type_, proto, _, address = socket.getaddrinfo(self.host, self.port, type=socket.SOCK_STREAM)[0]
+        with socket.socket(family, type_, proto) as probe:
+            probe.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            probe.bind(address)
+
+    def start(self, slot: WorkerProcess) -> None:
+        slot.process = self._context.Process(target=run_worker, name=slot.name,
+                                             args=(slot.role, self.config, self.host, slot.port, self.worker_queue))
+        slot.process.start()
+        slot.started = time.monotonic()
+        logger.info('started %s, pid %s', slot.name, slot.process.pid)
+
+    def reap(self) -> None:
+        """restart exited processes when delay of slot is passed"""
+        now = time.monotonic()
+        for slot in self.slots:
+            if slot.process is not None and not slot.process.is_alive():
+                delay = slot.exited(now, self.restart_delay, self.max_restart_delay, self.stable_seconds)
+                logger.warning('%s (pid %s) exited with code %s, restart in %.0f s', slot.name, slot.process.pid,
+                               slot.process.exitcode, delay)
+                slot.process = None
+            if slot.process is None and slot.restart_at <= now and not self._stopping:
+                self.start(slot)
+
+    def _on_signal(self, signum, frame) -> None:
+        logger.info('signal %s, stop workers', signum)
+        self._stopping = True
+
+    def run(self) -> None:
+        self.check()
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, self._on_signal)
+        try:
+            for slot in self.slots:
+                self.start(slot)
+            while not self._stopping:
+                sentinels = [slot.process.sentinel for slot in self.slots if slot.process is not None]
+                # wakes up on exit of process, signal is checked every second
+                multiprocessing.connection.wait(sentinels, timeout=1)
+                self.reap()
+        finally:
+            self.stop()
+
+    def stop(self) -> None:
+        """SIGTERM to processes (graceful shutdown of app), SIGKILL after shutdown_timeout"""
+        self._stopping = True
+        running = [slot.process for slot in self.slots if slot.process is not None and slot.process.is_alive()]
+        for process in running:
+            process.terminate()
+        deadline = time.monotonic() + self.shutdown_timeout
+        for process in running:
+            process.join(max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                logger.warning('%s (pid %s) is killed after %s s', process.name, process.pid, self.shutdown_timeout)
+                process.kill()
+                process.join()
+        self.worker_queue.close()
+        self.worker_queue.cancel_join_thread()
+
+    def stats(self) -> List[dict]:
+        return [slot.stats() for slot in self.slots]